@@ -1,9 +1,38 @@
 from django.contrib import admin
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from .models import *
+from .images import enqueue_renditions
+from .order_export import CONTENT_TYPES, EXTENSIONS, FORMATS, iter_export
+from .reporting import summarize
 
 # Register your models here.
 
-class OrderAdmin(admin.ModelAdmin):
+def export_orders_action(file_format):
+    def export_orders(modeladmin, request, queryset):
+        # Streamed chunk by chunk, see backend/order_export.py
+        response = StreamingHttpResponse(iter_export(queryset, file_format), content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = 'attachment; filename="orders.%s"' % EXTENSIONS[file_format]
+        return response
+    export_orders.__name__ = 'export_orders_' + file_format
+    export_orders.short_description = 'Export selected orders (%s)' % file_format
+    return export_orders
+
+
+class TotalPriceMixin:
+    """
+    The ``total_price`` column, annotated by ``with_total_price()`` in get_queryset().
+    """
+
+    def get_total_price(self, obj):
+        if obj.total_price is None:
+            return '---'
+        return "{:.2f}".format(obj.total_price)
+    get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'total_price'
+
+
+class OrderAdmin(TotalPriceMixin, admin.ModelAdmin):
     list_display = [
         'user_email',
         'id',
@@ -11,6 +40,7 @@ class OrderAdmin(admin.ModelAdmin):
         'get_product_variation_id',
         'get_product',
         'get_product_category',
+        'get_total_price',
         'ordered_date',
     ]
     
@@ -22,20 +52,15 @@ class OrderAdmin(admin.ModelAdmin):
         'payment'
     )
     
-    list_prefetch_related = (
-        'product__lettering_item_variation_set__lettering_item_category',
-    )
-
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related(
+        # The price snapshot, computed in SQL for orders without one, no lettering items need to be loaded
+        return qs.with_total_price().select_related(
             'product',
             'product__product',
             'product__product__category',
             'product__product_color',
             'payment'
-        ).prefetch_related(
-            'product__lettering_item_variation_set__lettering_item_category'
         )
 
     def get_product_variation_id(self, obj):
@@ -64,6 +89,8 @@ class OrderAdmin(admin.ModelAdmin):
 
     search_fields = ['user_email', 'id']
 
+    actions = [export_orders_action(file_format) for file_format in FORMATS]
+
 
 
 
@@ -129,16 +156,22 @@ class ProductAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         return qs.select_related('category')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            enqueue_renditions(obj)
+
 
 
 
 
-class ProductVariationAdmin(admin.ModelAdmin):
+class ProductVariationAdmin(TotalPriceMixin, admin.ModelAdmin):
     list_display = [
         'product',
         'get_amount_of_lettering',
         'product_color',
         'get_amount',
+        'get_total_price',
         'id',
     ]
     
@@ -156,7 +189,7 @@ class ProductVariationAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related(
+        return qs.with_total_price().select_related(
             'product',
             'product__category',
             'product_color'
@@ -269,6 +302,85 @@ class CommentAdmin(admin.ModelAdmin):
     search_fields = ['user_email', 'id']
     list_per_page = 50  # Limit items per page for better performance
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            enqueue_renditions(obj)
+
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    """
+    Sales dashboard, read only. The rollups are maintained by
+    backend/reporting.py and rebuilt with manage.py rebuild_sales_rollups.
+    """
+    list_display = [
+        'day',
+        'dimension',
+        'label',
+        'orders',
+        'units',
+        'get_revenue',
+    ]
+    list_filter = ['dimension']
+    date_hierarchy = 'day'
+    search_fields = ['label']
+    ordering = ['-day', '-revenue']
+    list_per_page = 100
+
+    def get_revenue(self, obj):
+        return "{:.2f}".format(obj.revenue)
+    get_revenue.short_description = 'Revenue'
+    get_revenue.admin_order_field = 'revenue'
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        try:
+            queryset = response.context_data['cl'].queryset
+        except (AttributeError, KeyError):
+            # A redirect, e.g. after an invalid filter
+            return response
+        # Best sellers of the filtered days, per dimension
+        response.context_data['summary'] = summarize(queryset)
+        return response
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+
+def retry_emails(modeladmin, request, queryset):
+    queryset.exclude(status=OutboxEmail.SENT).update(status=OutboxEmail.PENDING, attempts=0, next_attempt=timezone.now())
+retry_emails.short_description = 'Send selected emails again'
+
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """
+    Purchase emails waiting for, or sent by, manage.py send_emails (backend/outbox.py).
+    """
+    list_display = [
+        'to_email',
+        'kind',
+        'order',
+        'status',
+        'attempts',
+        'next_attempt',
+        'sent',
+    ]
+    list_select_related = ('order',)
+    list_filter = ['status', 'kind']
+    search_fields = ['to_email', 'order__id']
+    readonly_fields = ['order']
+    ordering = ['-created']
+    list_per_page = 100
+    actions = [retry_emails]
+
 
 
 # Optimize admin site settings
@@ -286,3 +398,5 @@ admin.site.register(LetteringItemVariation, LetteringItemVariationAdmin)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(DailySales, DailySalesAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
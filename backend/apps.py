@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BackendConfig(AppConfig):
     name = 'backend'
+
+    def ready(self):
+        from .signals import connect_cache_signals
+        connect_cache_signals()
@@ -0,0 +1,100 @@
+"""
+The two Stripe calls of a payment (token and charge) as coroutines, for the
+async ``PaymentView`` under ASGI (backend/async_views.py).
+
+stripe-python only talks to Stripe synchronously, which under ASGI would
+park a thread per checkout. Here the requests go out over an
+``httpx.AsyncClient`` (one per event loop, connections are reused across
+checkouts), while the request encoding, the error classes and the response
+objects are stripe-python's own, so callers see exactly what
+``stripe.Token.create`` / ``stripe.Charge.create`` would give them.
+
+Those come from stripe-python internals, which are only used by encode()
+and decode() below, for the version pinned in requirements.txt. The tests
+check both against the public API, update them together with stripe.
+
+A client is closed when its event loop shuts down, see get_client().
+"""
+import asyncio
+import weakref
+from urllib.parse import urlencode
+
+import httpx
+import stripe
+from stripe import api_requestor, util
+
+# stripe-python's defaults
+TIMEOUT = 80
+CONNECT_TIMEOUT = 30
+
+_clients = weakref.WeakKeyDictionary()
+
+
+async def _close_on_shutdown(client):
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def get_client():
+    """
+    The client of the running event loop. It is closed by
+    ``loop.shutdown_asyncgens()``, which asyncio.run(), uvicorn and asgiref's
+    async_to_sync call before they close a loop.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT))
+        closer = _close_on_shutdown(client)
+        # Started, so the loop finalizes it on shutdown
+        await closer.asend(None)
+        entry = _clients[loop] = (client, closer)
+    return entry[0]
+
+
+def encode(params):
+    """
+    The form-encoded request body stripe-python sends for ``params``.
+    """
+    return urlencode(list(api_requestor._api_encode(params)))
+
+
+def decode(content, status_code, headers):
+    """
+    The StripeObject for a response, raises the stripe.error class
+    (CardError, RateLimitError, ...) for an error status.
+    """
+    response = api_requestor.APIRequestor(stripe.api_key).interpret_response(content, status_code, headers)
+    return util.convert_to_stripe_object(response, stripe.api_key, stripe.api_version)
+
+
+async def request(path, params, idempotency_key=None):
+    """
+    POSTs ``params`` to ``path`` of the Stripe API and returns the response
+    as a StripeObject, raises the stripe.error class stripe-python would.
+    """
+    headers = {
+        'Authorization': 'Bearer %s' % stripe.api_key,
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'User-Agent': 'Stripe/v1 PythonBindings/%s (httpx)' % stripe.version.VERSION,
+    }
+    if stripe.api_version:
+        headers['Stripe-Version'] = stripe.api_version
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
+    client = await get_client()
+    try:
+        response = await client.post(stripe.api_base + path, content=encode(params), headers=headers)
+    except httpx.HTTPError as exc:
+        raise stripe.error.APIConnectionError("Error communicating with Stripe: %r" % exc)
+    return decode(response.content, response.status_code, response.headers)
+
+
+async def create_token(card, idempotency_key=None):
+    return await request('/v1/tokens', {'card': card}, idempotency_key)
+
+
+async def create_charge(idempotency_key=None, **params):
+    return await request('/v1/charges', params, idempotency_key)
@@ -0,0 +1,152 @@
+"""
+Async variants of the catalog and payment views, used under ASGI.
+
+With ``ASYNC_VIEWS`` on (for ``truck_signs_designs/asgi.py``) backend/urls.py
+routes the same URLs to the views below, otherwise (WSGI, the tests) the
+plain DRF views are used as before.
+
+- Catalog views answer a cache hit (or a 304) on the event loop, from the
+  response cache of ``CachedResponseMixin`` without building a DRF request.
+  Django 3.2 has no async cache API, so the lookup itself runs in a worker
+  thread that no query has to wait for. A miss, the browsable API and any
+  other method run the DRF view in the sync thread.
+- A payment awaits Stripe (``payments.acharge_order``) instead of parking a
+  thread on it, the queries before and after run in the sync thread. The
+  emails are already sent by ``manage.py send_emails`` (backend/outbox.py),
+  so no SMTP is left in the request. Payments with ``Prefer:
+  respond-async`` (or ``PAYMENT_ASYNC``) and GET run the DRF view.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from . import idempotency
+from .caching import cache_variant, finish_cached_response, get_cache_state
+from .metrics import record_cache
+from .payments import acharge_order
+from .views import PaymentView
+
+# Accept headers the JSON renderer is negotiated for, with that media type
+JSON_ACCEPT = ('', '*/*', 'application/json')
+
+
+def _accepts_json(request):
+    return request.META.get('HTTP_ACCEPT', '').strip() in JSON_ACCEPT and 'format' not in request.GET
+
+
+def _cached_response(view_class, request):
+    """
+    The cached response (or a 304) of ``view_class`` for ``request``, None on a miss.
+    """
+    variant = cache_variant(request, JSONRenderer.media_type)
+    etag, last_modified, cache_key = get_cache_state(view_class.cache_key_prefix, view_class.cache_models, variant)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content = cache.get(cache_key)
+        if content is None:
+            return None
+        response = HttpResponse(content, content_type=JSONRenderer.media_type)
+    record_cache(True)
+    return finish_cached_response(response, etag, last_modified)
+
+
+def catalog_view(view_class):
+    """
+    The view for a ``CachedResponseMixin`` view class, async when
+    ``ASYNC_VIEWS`` is on.
+    """
+    if not settings.ASYNC_VIEWS:
+        return view_class.as_view()
+    return async_catalog_view(view_class)
+
+
+def async_catalog_view(view_class):
+    sync_view = sync_to_async(view_class.as_view())
+    lookup = sync_to_async(_cached_response, thread_sensitive=False)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET' and _accepts_json(request):
+            response = await lookup(view_class, request)
+            if response is not None:
+                return response
+        # Counted as the miss by CachedResponseMixin
+        return await sync_view(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    view.view_class = view_class
+    return view
+
+
+def payment_view():
+    """
+    The view for ``order-payment/<id>/``, async when ``ASYNC_VIEWS`` is on.
+    """
+    if not settings.ASYNC_VIEWS:
+        return PaymentView.as_view()
+    return AsyncPaymentView.as_async_view()
+
+
+class AsyncPaymentView(PaymentView):
+    """
+    ``PaymentView.post`` in three steps: prepare the order in the sync
+    thread, await Stripe, mark it paid in the sync thread. With an
+    Idempotency-Key a retry during the Stripe call gets a 409 instead of
+    waiting for it, see ``idempotency.begin``.
+    """
+
+    @classmethod
+    def as_async_view(cls):
+        sync_view = sync_to_async(PaymentView.as_view())
+
+        async def view(request, *args, **kwargs):
+            if request.method != 'POST' or cls().is_async(request):
+                return await sync_view(request, *args, **kwargs)
+            self = cls()
+            self.setup(request, *args, **kwargs)
+            return await self.apost(request, *args, **kwargs)
+
+        view.csrf_exempt = True
+        view.view_class = cls
+        return view
+
+    def start(self, request, *args, **kwargs):
+        # APIView.dispatch() up to the handler, returns a response when the request ends here
+        self.args, self.kwargs = args, kwargs
+        request = self.request = self.initialize_request(request, *args, **kwargs)
+        self.headers = self.default_response_headers
+        self.idempotency_record = None
+        try:
+            self.initial(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(exc)
+        response, self.idempotency_record = idempotency.begin(request)
+        if response is not None:
+            return response
+        try:
+            self.order, self.card = self.prepare(request, kwargs['id'])
+        except Exception as exc:
+            return self.payment_error(exc)
+        return None
+
+    def finish(self, response):
+        if self.idempotency_record is not None:
+            idempotency.finish(self.idempotency_record, response)
+        return self.finalize_response(self.request, response, *self.args, **self.kwargs)
+
+    async def apost(self, request, *args, **kwargs):
+        response = await sync_to_async(self.start)(request, *args, **kwargs)
+        if response is None:
+            try:
+                await acharge_order(
+                    self.order, self.card,
+                    idempotency_key=idempotency.stripe_key(self.request, 'order-%d' % self.order.id),
+                )
+                response = Response({"Result": "Success"}, status=status.HTTP_200_OK)
+            except Exception as e:
+                response = self.payment_error(e)
+        return await sync_to_async(self.finish)(response)
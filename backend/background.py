@@ -0,0 +1,50 @@
+"""
+Thread pools for the work a request hands off and doesn't wait for: payment
+jobs (backend/payments.py) and image renditions (backend/images.py).
+
+Each pool is created on first use, so every gunicorn worker gets its own
+(also with ``--preload``, threads don't survive the fork). Jobs are only
+held in memory, a worker that exits takes its queue with it.
+
+Pool threads never see request_started/request_finished, so submit() runs
+every job between two close_old_connections() calls, which applies
+``CONN_MAX_AGE`` and drops broken connections like a request would.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name, max_workers):
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return executor
+
+
+def _run(fn, args):
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+def submit(name, max_workers, fn, *args):
+    """
+    Runs ``fn(*args)`` in the pool ``name`` of ``max_workers`` threads.
+    """
+    return get_executor(name, max_workers).submit(_run, fn, args)
+
+
+def submit_on_commit(name, max_workers, fn, *args):
+    """
+    submit() once the surrounding transaction (if any) has committed, so the
+    job sees the rows the request wrote.
+    """
+    transaction.on_commit(lambda: submit(name, max_workers, fn, *args))
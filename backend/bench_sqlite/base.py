@@ -0,0 +1,17 @@
+"""
+The SQLite backend of settings/bench.py.
+
+SQLite has no row locks, a transaction that reads first (like the
+``select_for_update`` of a payment, backend/payments.py) and then writes
+fails right away with "database is locked" when another gunicorn worker
+wrote in the meantime. Here every transaction takes the write lock up front
+(BEGIN IMMEDIATE) and concurrent ones wait for it instead, up to the
+``timeout`` option.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
@@ -0,0 +1,254 @@
+"""
+Load generator behind ``python manage.py benchmark``.
+
+A fixed number of client threads each keep one HTTP/1.1 connection open and
+pick a scenario per request from a weighted mix, like locust users without
+the think time. Every response is recorded with its latency and, when the
+server runs RequestMetricsMiddleware, the number of SQL queries taken from
+the ``Server-Timing`` header.
+
+Scenarios:
+    catalog         GET of one of the cached catalog endpoints
+    order-create    POST /api/order/<product>/create/ with a few lettering items
+    order-retrieve  GET /api/order/<id>/retrieve/
+    payment         POST /api/order-payment/<id>/ against the fake Stripe server
+"""
+import http.client
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.db import transaction
+
+from .models import Category, LetteringItemCategory, Order, Product, ProductColor, ProductVariation
+
+SERVER_TIMING_QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+DEFAULT_MIX = {'catalog': 70, 'order-create': 10, 'order-retrieve': 10, 'payment': 10}
+
+# Unpaid orders order-retrieve reads, the rest are paid by payment
+RETRIEVE_ORDERS = 50
+
+TEST_CARD = {'card_num': '4242424242424242', 'exp_month': '12', 'exp_year': '2030', 'cvc': '123'}
+
+
+def parse_mix(value):
+    """
+    "catalog=70,payment=30" -> {'catalog': 70, 'payment': 30}
+    """
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError("Unknown scenario %r, choose from %s" % (name, ', '.join(DEFAULT_MIX)))
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def seed_catalog(products=300, orders=2000):
+    """
+    Makes sure there is something to benchmark: the "Truck Sign" category,
+    ``products`` products, colors, lettering categories and ``orders`` unpaid
+    orders. Existing rows are kept and counted.
+    """
+    truck_sign = Category.objects.filter(title='Truck Sign').first() or Category.objects.create(
+        title='Truck Sign', image='uploads/categories/truck.png', base_price=45.5, max_amount_of_lettering_items=10,
+    )
+    if not ProductColor.objects.exists():
+        for i, nickname in enumerate(('Black', 'White', 'Red', 'Blue', 'Yellow')):
+            ProductColor.objects.create(color_in_hex='#%06x' % (i * 0x333333), color_nickname=nickname)
+    for title, price in (('MC', 2.5), ('USDOT', 3.0), ('VIN', 4.0), ('Company Name', 5.0)):
+        LetteringItemCategory.objects.get_or_create(title=title, defaults={'price': price})
+
+    missing = products - Product.objects.count()
+    if missing > 0:
+        Product.objects.bulk_create([
+            Product(category=truck_sign, title='Benchmark Logo %d' % i, image='uploads/products/bench.png',
+                    detail_image='uploads/products_detail/bench.png')
+            for i in range(missing)
+        ])
+
+    unpaid = Order.objects.filter(ordered=False, product__isnull=False).count()
+    product_list = list(Product.objects.all()[:orders])
+    with transaction.atomic():
+        for i in range(max(orders - unpaid, 0)):
+            variation = ProductVariation.objects.create(product=product_list[i % len(product_list)], amount=1)
+            Order.objects.create(user_email='bench%d@example.com' % i, product=variation)
+
+
+class Workload:
+    """
+    The ids the scenarios pick from, loaded once before the run.
+
+    Orders are split in two pools: retrieve reads the first
+    ``RETRIEVE_ORDERS`` unpaid orders, payment pays each of the others once
+    (an order is only paid once, a second payment is refused). Once they are
+    all paid, payment starts over and counts errors, seed more orders for
+    longer runs (``seed_catalog``).
+    """
+
+    def __init__(self):
+        self.category_ids = list(Category.objects.values_list('id', flat=True))
+        self.product_ids = list(Product.objects.filter(is_uploaded=False).values_list('id', flat=True))
+        self.lettering_titles = list(LetteringItemCategory.objects.values_list('title', flat=True))
+        self.color_ids = list(ProductColor.objects.values_list('id', flat=True))
+        order_ids = list(
+            Order.objects.filter(ordered=False, product__isnull=False).order_by('id').values_list('id', flat=True)
+        )
+        self.retrieve_order_ids = order_ids[:RETRIEVE_ORDERS]
+        self.payment_order_ids = itertools.cycle(order_ids[RETRIEVE_ORDERS:] or order_ids)
+        self.lock = threading.Lock()
+        if not (self.product_ids and self.retrieve_order_ids):
+            raise ValueError("Nothing to benchmark, run with --seed first")
+
+    def catalog(self, rng):
+        path = rng.choice((
+            '/api/categories/',
+            '/api/products/',
+            '/api/product-color/',
+            '/api/lettering-item-categories/',
+            '/api/truck-logo-list/',
+            '/api/comments/',
+            '/api/product-detail/%d/' % rng.choice(self.product_ids),
+            '/api/product-category/%d/' % rng.choice(self.category_ids),
+        ))
+        return 'GET', path, None
+
+    def order_create(self, rng):
+        body = {
+            'order': {'user_email': 'bench@example.com', 'address1': 'Benchmark Road 1'},
+            'product_color_id': rng.choice(self.color_ids) if self.color_ids else None,
+            'lettering_items': [
+                {'title': title, 'text': 'Line %d' % i}
+                for i, title in enumerate(rng.sample(self.lettering_titles, min(3, len(self.lettering_titles))))
+            ],
+        }
+        return 'POST', '/api/order/%d/create/' % rng.choice(self.product_ids), body
+
+    def order_retrieve(self, rng):
+        return 'GET', '/api/order/%d/retrieve/' % rng.choice(self.retrieve_order_ids), None
+
+    def payment(self, rng):
+        body = dict(TEST_CARD, order={'user_first_name': 'Bench'})
+        with self.lock:
+            order_id = next(self.payment_order_ids)
+        return 'POST', '/api/order-payment/%d/' % order_id, body
+
+    def request_for(self, scenario, rng):
+        return getattr(self, scenario.replace('-', '_'))(rng)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.recording = False
+
+    def add(self, scenario, status, latency, queries):
+        if self.recording:
+            with self.lock:
+                self.samples[scenario].append((status, latency, queries))
+
+
+def _client(base_url, timeout):
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.hostname, parts.port, timeout=timeout)
+
+
+def _worker(base_url, workload, mix, recorder, stop, seed, timeout):
+    rng = random.Random(seed)
+    scenarios, weights = zip(*mix.items())
+    connection = _client(base_url, timeout)
+    while not stop.is_set():
+        scenario = rng.choices(scenarios, weights)[0]
+        method, path, body = workload.request_for(scenario, rng)
+        headers = {'Accept': 'application/json'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing') or '')
+        except (OSError, http.client.HTTPException):
+            # Connection reset or timeout, count it as an error and reconnect
+            connection.close()
+            connection = _client(base_url, timeout)
+            status, match = 0, None
+        latency = time.perf_counter() - start
+        recorder.add(scenario, status, latency, int(match.group(1)) if match else None)
+    connection.close()
+
+
+def run_load(base_url, workload, mix, concurrency=10, duration=30.0, warmup=3.0, timeout=30.0, seed=0):
+    """
+    Runs ``concurrency`` client threads for ``warmup`` + ``duration`` seconds
+    and returns {scenario: [(status, latency, queries), ...]} for the
+    measured part together with the measured wall time.
+    """
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_worker, args=(base_url, workload, mix, recorder, stop, seed + i, timeout), daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    recorder.recording = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join(timeout + 1)
+    return dict(recorder.samples), elapsed
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """
+    RPS, latency percentiles (ms), error count and queries per request, per
+    scenario and for all requests together.
+    """
+    def stats(rows):
+        latencies = sorted(latency for status, latency, queries in rows)
+        queries = [queries for status, latency, queries in rows if queries is not None]
+        errors = sum(1 for status, latency, queries in rows if not 200 <= status < 400)
+        return {
+            'requests': len(rows),
+            'errors': errors,
+            'rps': round(len(rows) / elapsed, 2) if elapsed else None,
+            'p50_ms': _ms(_percentile(latencies, 0.50)),
+            'p95_ms': _ms(_percentile(latencies, 0.95)),
+            'p99_ms': _ms(_percentile(latencies, 0.99)),
+            'max_ms': _ms(latencies[-1] if latencies else None),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+    summary = {scenario: stats(rows) for scenario, rows in sorted(samples.items())}
+    summary['total'] = stats([row for rows in samples.values() for row in rows])
+    return summary
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
@@ -0,0 +1,293 @@
+"""
+Cache backends used in front of / instead of the shared Redis or Memcached
+server. See ``CACHE_BACKEND`` in ``settings/production_docker.py``.
+
+FakeSharedCache
+    An in-process stand-in for a cache server, used in CI and local runs.
+    Values are pickled on the way in and out like they would be over the
+    wire, and every cache alias pointing at the same LOCATION talks to the
+    same "server".
+
+TwoTierCache
+    A small per-worker LRU in front of the shared cache. Only keys that are
+    immutable by construction (generation stamped keys, see
+    ``backend.caching``) are kept locally, everything else, including the
+    generation counters themselves, always goes to the shared cache.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class FakeCacheServer:
+    """
+    Process-wide key/value store emulating a memcached/redis server.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.store = {}
+        self.stats = {'get_hits': 0, 'get_misses': 0, 'sets': 0}
+
+    def _alive(self, key):
+        item = self.store.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self.store[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self.lock:
+            item = self._alive(key)
+            if item is None:
+                self.stats['get_misses'] += 1
+                return None
+            self.stats['get_hits'] += 1
+            return item[0]
+
+    def set(self, key, value, expires):
+        with self.lock:
+            self.stats['sets'] += 1
+            self.store[key] = (value, expires)
+
+    def add(self, key, value, expires):
+        with self.lock:
+            if self._alive(key) is not None:
+                return False
+            self.stats['sets'] += 1
+            self.store[key] = (value, expires)
+            return True
+
+    def touch(self, key, expires):
+        with self.lock:
+            item = self._alive(key)
+            if item is None:
+                return False
+            self.store[key] = (item[0], expires)
+            return True
+
+    def incr(self, key, delta):
+        with self.lock:
+            item = self._alive(key)
+            if item is None:
+                return None
+            value = pickle.loads(item[0]) + delta
+            self.store[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), item[1])
+            return value
+
+    def delete(self, key):
+        with self.lock:
+            return self.store.pop(key, None) is not None
+
+    def flush(self):
+        with self.lock:
+            self.store.clear()
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_fake_server(location):
+    with _servers_lock:
+        if location not in _servers:
+            _servers[location] = FakeCacheServer()
+        return _servers[location]
+
+
+class FakeSharedCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.server = get_fake_server(location or 'default')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self.server.add(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = self.server.get(key)
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self.server.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self.server.touch(key, self.get_backend_timeout(timeout))
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = self.server.incr(key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self.server.delete(key)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def clear(self):
+        self.server.flush()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Per-worker LRU in front of a shared cache alias.
+
+    OPTIONS:
+        SHARED_ALIAS: alias of the shared cache in CACHES (default 'shared')
+        LOCAL_MAX_ENTRIES: size of the per-worker LRU (default 500)
+        LOCAL_TIMEOUT: upper bound in seconds for a local entry (default 60)
+        LOCAL_KEY_PREFIXES: only keys starting with one of these are kept locally
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self.shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self.local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 500))
+        self.local_timeout = int(options.get('LOCAL_TIMEOUT', 60))
+        self.local_key_prefixes = tuple(options.get('LOCAL_KEY_PREFIXES', ('response:',)))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _is_local(self, key):
+        return key.startswith(self.local_key_prefixes)
+
+    def _local_key(self, key, version):
+        return self.make_key(key, version=version)
+
+    def _local_get(self, key, version):
+        local_key = self._local_key(key, version)
+        with self._lock:
+            item = self._local.get(local_key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.time():
+                del self._local[local_key]
+                return None
+            self._local.move_to_end(local_key)
+        return pickle.loads(value)
+
+    def _local_set(self, key, value, timeout, version):
+        timeout = self.get_backend_timeout(timeout)
+        local_timeout = self.local_timeout if timeout is None else min(timeout - time.time(), self.local_timeout)
+        if local_timeout <= 0:
+            return
+        local_key = self._local_key(key, version)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[local_key] = (pickled, time.time() + local_timeout)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, key, version):
+        with self._lock:
+            self._local.pop(self._local_key(key, version), None)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self._is_local(key):
+            self._local_set(key, value, timeout, version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        if self._is_local(key):
+            value = self._local_get(key, version)
+            if value is not None:
+                return value
+        value = self.shared.get(key, version=version)
+        if value is None:
+            return default
+        if self._is_local(key):
+            self._local_set(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._local_get(key, version) if self._is_local(key) else None
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            shared_values = self.shared.get_many(missing, version=version)
+            for key, value in shared_values.items():
+                if self._is_local(key):
+                    self._local_set(key, value, DEFAULT_TIMEOUT, version)
+            found.update(shared_values)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self._is_local(key):
+            self._local_set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if self._is_local(key) and key not in (failed or []):
+                self._local_set(key, value, timeout, version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(key, version)
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._local_delete(key, version)
+        return self.shared.decr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(key, version)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(key, version)
+        return self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self._is_local(key) and self._local_get(key, version) is not None:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
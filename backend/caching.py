@@ -0,0 +1,264 @@
+"""
+Response-level caching for the read-only catalog endpoints.
+
+The views used to cache only the list of primary keys, so every request still
+ran an ``id__in=[...]`` query and a full serializer pass. The mixin below
+stores the finished JSON bytes instead, so a cache hit is served without any
+database query or serializer work.
+
+Every cache key embeds the generation counter of the models the response is
+built from. ``backend.signals`` bumps those counters on save/delete, so stale
+entries are simply never looked up again and expire on their own. The same
+counters double as cheap version stamps for ETag / Last-Modified.
+
+Pages rendered from templates alone (the homepage) are cached whole by
+``cached_page``, versioned by the template sources instead.
+"""
+import functools
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.template.loader import get_template
+from django.template.loaders.cached import Loader as CachedLoader
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.autoreload import file_changed
+from django.utils.http import http_date, quote_etag, urlencode
+
+from .db_routing import recently_modified, replica_reads
+from .metrics import record_cache, serializer_timer
+
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 6  # 6 hours, invalidation is signal driven
+PAGE_CACHE_MAX_AGE = 5 * 60
+
+
+def _generation_key(model):
+    return 'generation:%s' % model._meta.label_lower
+
+
+def _modified_key(model):
+    return 'generation:%s:modified' % model._meta.label_lower
+
+
+def _initial_generation():
+    # Start from a timestamp instead of 0, so a counter that got evicted never
+    # comes back with a value that was already used for older cache entries.
+    return int(time.time() * 1000)
+
+
+def get_version_stamps(models):
+    """
+    Returns the current generation of each model, in the given order, and the
+    most recent modification time (unix timestamp) across all of them.
+    """
+    keys = [_generation_key(model) for model in models]
+    modified_keys = [_modified_key(model) for model in models]
+    stamps = cache.get_many(keys + modified_keys)
+    for key, modified_key in zip(keys, modified_keys):
+        if key not in stamps:
+            cache.add(key, _initial_generation(), None)
+            stamps[key] = cache.get(key, _initial_generation())
+        if modified_key not in stamps:
+            # Unknown after an eviction or a fresh cache, assume it just changed
+            stamps[modified_key] = int(time.time())
+            cache.add(modified_key, stamps[modified_key], None)
+    last_modified = max([stamps[key] for key in modified_keys], default=0)
+    return [stamps[key] for key in keys], last_modified
+
+
+def get_generations(models):
+    """
+    Returns the current generation of each model, in the given order.
+    """
+    return get_version_stamps(models)[0]
+
+
+def bump_generation(model):
+    """
+    Invalidates every cache entry built from ``model``.
+    """
+    key = _generation_key(model)
+    if not cache.add(key, _initial_generation(), None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, _initial_generation(), None)
+    cache.set(_modified_key(model), int(time.time()), None)
+
+
+def _join_generations(generations):
+    return '.'.join(str(generation) for generation in generations)
+
+
+def generation_cache_key(prefix, models, *parts):
+    return ':'.join([prefix, _join_generations(get_generations(models))] + [str(part) for part in parts])
+
+
+def cache_variant(request, media_type):
+    # Image URLs are absolute, so the host is part of the variant
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    raw = '|'.join([
+        media_type,
+        request.scheme,
+        request.get_host(),
+        request.path,
+        query,
+    ])
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def get_cache_state(prefix, models, variant):
+    """
+    Returns the ETag, the Last-Modified timestamp and the cache key of the
+    cached response ``prefix`` / ``variant`` built from ``models``.
+    """
+    generations, last_modified = get_version_stamps(models)
+    version = _join_generations(generations)
+    etag = quote_etag(hashlib.md5(('%s:%s:%s' % (prefix, version, variant)).encode('utf-8')).hexdigest())
+    return etag, last_modified, 'response:%s:%s:%s' % (prefix, version, variant)
+
+
+def finish_cached_response(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the body but have to revalidate before using it
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Caches the rendered JSON body of a list or detail view per endpoint and
+    query variant, and answers conditional GETs.
+
+    ``cache_models`` lists every model the response is built from, a save or
+    delete on any of them invalidates the cached body. The ETag is derived
+    from the same generation counters, so a matching ``If-None-Match`` gets a
+    304 without touching the database, the serializers or the cached body.
+    Only JSON responses are cached, the browsable API is always rendered fresh.
+    A miss is read from the replica database, when there is one.
+    """
+    cache_key_prefix = None
+    cache_models = ()
+    cache_timeout = RESPONSE_CACHE_TIMEOUT
+
+    def get_cache_variant(self, request):
+        return cache_variant(request, request.accepted_media_type)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            with replica_reads():
+                return handler(request, *args, **kwargs)
+
+        etag, last_modified, cache_key = get_cache_state(
+            self.cache_key_prefix, self.cache_models, self.get_cache_variant(request),
+        )
+        # 304 for a matching If-None-Match / If-Modified-Since, None otherwise
+        conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if conditional is None:
+            content = cache.get(cache_key)
+            record_cache(content is not None)
+            if content is None:
+                # A change the replica may not have yet is read from the primary, see backend/db_routing.py
+                with replica_reads(allowed=not recently_modified(last_modified)):
+                    response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                with serializer_timer():
+                    content = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+                cache.set(cache_key, content, self.cache_timeout)
+            response = HttpResponse(content, content_type=renderer.media_type)
+        else:
+            record_cache(True)
+            response = conditional
+        return finish_cached_response(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+# template names -> version, while the cached template loader is active
+_template_versions = {}
+
+
+def uses_cached_loader():
+    return any(
+        isinstance(loader, CachedLoader)
+        for engine in engines.all() if isinstance(engine, DjangoTemplates)
+        for loader in engine.engine.template_loaders
+    )
+
+
+def template_version(template_names):
+    """
+    Hash of the sources of ``template_names``. With the cached template
+    loader that is the source compiled by this process, so it is computed
+    once per process and changes with a deploy of new templates. Without
+    it (dev.py) it is computed per request and changes with every edit.
+    """
+    version = _template_versions.get(template_names)
+    if version is None:
+        digest = hashlib.md5()
+        for name in template_names:
+            digest.update(get_template(name).template.source.encode('utf-8'))
+        version = digest.hexdigest()
+        if uses_cached_loader():
+            _template_versions[template_names] = version
+    return version
+
+
+@receiver(setting_changed, dispatch_uid='backend.caching.templates_changed')
+@receiver(file_changed, dispatch_uid='backend.caching.file_changed')
+def reset_template_versions(setting='TEMPLATES', **kwargs):
+    # New template settings, or runserver reset the cached loader after an edit
+    if setting == 'TEMPLATES':
+        _template_versions.clear()
+
+
+def cached_page(*template_names, timeout=RESPONSE_CACHE_TIMEOUT, max_age=PAGE_CACHE_MAX_AGE):
+    """
+    Caches the whole rendered page of a view that only depends on
+    ``template_names`` (the template and the ones it extends or includes).
+
+    The cache key and the ETag are versioned by template_version(), so new
+    templates are served as soon as they are deployed and old pages expire
+    on their own. A hit is served from the cache without rendering anything,
+    a matching ``If-None-Match`` gets a 304.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            version = template_version(template_names)
+            etag = quote_etag(version)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                cache_key = 'page:%s:%s' % (view.__name__, version)
+                cached = cache.get(cache_key)
+                record_cache(cached is not None)
+                if cached is None:
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    cached = (response.content, response['Content-Type'])
+                    cache.set(cache_key, cached, timeout)
+                response = HttpResponse(cached[0], content_type=cached[1])
+            else:
+                record_cache(True)
+            response['ETag'] = etag
+            patch_cache_control(response, public=True, max_age=max_age)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,294 @@
+"""
+Bulk catalog import and export, see ``manage.py import_catalog`` and
+``manage.py export_catalog``.
+
+A catalog file is CSV or JSON lines, one row per category, lettering item
+category, color or product. The ``type`` column says which (or the command
+line gives one type for the whole file), the other columns are the fields
+in ``CATALOG_TYPES``. Products name their category by title, so a file can
+create both in one go as long as the category comes first.
+
+Rows are matched to existing ones by natural key (``Category.title``,
+``ProductColor.color_nickname``, ...). Matches are updated, the rest is
+created, in batches of ``batch_size`` rows with one ``bulk_update`` and one
+``bulk_create`` each. Rows that would not change are not written. Memory stays the same whatever the size of the file,
+only the current batch is held. Empty columns are left alone on update.
+
+Bulk queries send no signals, the cache generations of the written models
+are bumped once at the end instead.
+"""
+import csv
+import json
+import os
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+
+from .caching import bump_generation
+from .models import Category, LetteringItemCategory, Product, ProductColor
+
+
+class CatalogType:
+
+    def __init__(self, name, model, key, fields):
+        self.name = name
+        self.model = model
+        self.key = key
+        self.fields = fields
+
+    @property
+    def image_fields(self):
+        return [name for name in self.fields if name in ('image', 'detail_image')]
+
+
+# In dependency order, a batch of products is only written after the pending categories
+CATALOG_TYPES = [
+    CatalogType('category', Category, ('title',),
+                ('title', 'image', 'base_price', 'max_amount_of_lettering_items', 'height', 'width')),
+    CatalogType('lettering-category', LetteringItemCategory, ('title',), ('title', 'price')),
+    CatalogType('color', ProductColor, ('color_nickname',), ('color_nickname', 'color_in_hex')),
+    CatalogType('product', Product, ('category', 'title'),
+                ('category', 'title', 'image', 'detail_image', 'is_uploaded')),
+]
+CATALOG_TYPES_BY_NAME = {catalog_type.name: catalog_type for catalog_type in CATALOG_TYPES}
+
+FORMATS = ('csv', 'jsonl')
+
+# Accepted in boolean columns besides what BooleanField itself takes
+BOOLEAN_VALUES = {'true': True, 'yes': True, 'y': True, 'false': False, 'no': False, 'n': False}
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(f, file_format):
+    """
+    Yields (line number, row dict) from a text file.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(f, 1):
+            if line.strip():
+                yield line_num, json.loads(line)
+
+
+def columns(catalog_types):
+    names = ['type']
+    for catalog_type in catalog_types:
+        names.extend(name for name in catalog_type.fields if name not in names)
+    return names
+
+
+def export_rows(catalog_type, chunk_size=2000):
+    """
+    Yields every row of ``catalog_type`` as a dict, read ``chunk_size`` at a time.
+    """
+    lookups = ['category__title' if name == 'category' else name for name in catalog_type.fields]
+    queryset = catalog_type.model.objects.order_by('pk').values_list(*lookups)
+    for values in queryset.iterator(chunk_size=chunk_size):
+        row = dict(zip(catalog_type.fields, values))
+        row['type'] = catalog_type.name
+        yield row
+
+
+def write_rows(f, file_format, catalog_types, rows):
+    """
+    Writes ``rows`` and returns how many there were.
+    """
+    count = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(f, columns(catalog_types), restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+            count += 1
+    return count
+
+
+class CatalogImporter:
+    """
+    Upserts catalog rows in batches, call add() for every row and finish()
+    at the end. ``on_error(line number, message)`` is called for every row
+    that is skipped.
+    """
+
+    def __init__(self, batch_size=500, images_dir=None, default_type=None, on_error=None, on_batch=None):
+        self.batch_size = batch_size
+        self.images_dir = images_dir
+        self.default_type = default_type
+        self.on_error = on_error or (lambda line, message: None)
+        self.on_batch = on_batch or (lambda catalog_type, count: None)
+        # Per type: natural key -> (line number, values)
+        self.pending = {catalog_type.name: {} for catalog_type in CATALOG_TYPES}
+        self.written = set()
+        self.stats = Counter()
+
+    def add(self, line, row):
+        self.stats['rows'] += 1
+        name = row.get('type') or self.default_type
+        catalog_type = CATALOG_TYPES_BY_NAME.get(name)
+        if catalog_type is None:
+            self.error(line, "Unknown type %r" % name)
+            return
+        try:
+            values = self.clean(catalog_type, row)
+        except ValidationError as e:
+            self.error(line, '; '.join(e.messages))
+            return
+        pending = self.pending[catalog_type.name]
+        key = tuple(values[name] for name in catalog_type.key)
+        if key in pending:
+            # The same row twice in a batch, the later values win
+            values = dict(pending[key][1], **values)
+        pending[key] = (line, values)
+        if len(pending) >= self.batch_size:
+            self.flush(catalog_type)
+
+    def finish(self):
+        for catalog_type in CATALOG_TYPES:
+            self.flush(catalog_type)
+        for model in self.written:
+            bump_generation(model)
+        return self.stats
+
+    def error(self, line, message):
+        self.stats['errors'] += 1
+        self.on_error(line, message)
+
+    def clean(self, catalog_type, row):
+        values = {}
+        for name in catalog_type.fields:
+            raw = row.get(name)
+            if raw is None or raw == '' or name in catalog_type.image_fields:
+                continue
+            if name == 'category':
+                values[name] = str(raw).strip()
+                continue
+            field = catalog_type.model._meta.get_field(name)
+            if isinstance(field, models.BooleanField) and isinstance(raw, str):
+                raw = BOOLEAN_VALUES.get(raw.strip().lower(), raw)
+            try:
+                values[name] = field.clean(raw, None)
+            except ValidationError as e:
+                raise ValidationError("%s: %s" % (name, ' '.join(e.messages)))
+        missing = [name for name in catalog_type.key if name not in values]
+        if missing:
+            raise ValidationError("Missing %s" % ', '.join(missing))
+        # Last, so a row with bad values doesn't leave an image behind
+        for name in catalog_type.image_fields:
+            if row.get(name):
+                values[name] = self.attach_image(catalog_type.model, name, str(row[name]))
+        return values
+
+    def attach_image(self, model, field_name, value):
+        """
+        Copies ``value`` from the images directory into storage and returns
+        its name there. Anything not in the directory is taken as a name
+        already in storage, as written by export_catalog.
+        """
+        path = os.path.join(self.images_dir, value) if self.images_dir else None
+        if path is None or not os.path.isfile(path):
+            return value
+        name = model._meta.get_field(field_name).upload_to + os.path.basename(value)
+        # The same file imported again (every seasonal refresh) is not copied again
+        if default_storage.exists(name) and default_storage.size(name) == os.path.getsize(path):
+            return name
+        with open(path, 'rb') as f:
+            name = default_storage.save(name, File(f))
+        self.stats['images'] += 1
+        return name
+
+    def flush(self, catalog_type):
+        # Products refer to categories by title, those have to be written first
+        for earlier in CATALOG_TYPES[:CATALOG_TYPES.index(catalog_type)]:
+            if self.pending[earlier.name]:
+                self.flush(earlier)
+        rows = self.pending[catalog_type.name]
+        if not rows:
+            return
+        self.pending[catalog_type.name] = {}
+
+        with transaction.atomic():
+            if catalog_type.name == 'product':
+                rows = self.resolve_categories(rows)
+            existing = self.find_existing(catalog_type, rows)
+            created, updated, update_fields = [], [], set()
+            for key, (line, values) in rows.items():
+                instance = existing.get(key)
+                if instance is None:
+                    created.append(catalog_type.model(**values))
+                    continue
+                changed = [name for name, value in values.items() if getattr(instance, name) != value]
+                if not changed:
+                    # Most rows of a catalog refresh, no need to write them
+                    self.stats['unchanged'] += 1
+                    continue
+                for name in changed:
+                    setattr(instance, name, values[name])
+                update_fields.update(changed)
+                updated.append(instance)
+
+            catalog_type.model.objects.bulk_create(created, batch_size=self.batch_size)
+            update_fields.difference_update(catalog_type.key)
+            if updated and update_fields:
+                catalog_type.model.objects.bulk_update(updated, sorted(update_fields), batch_size=self.batch_size)
+
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+        self.written.add(catalog_type.model)
+        self.on_batch(catalog_type, len(rows))
+
+    def resolve_categories(self, rows):
+        """
+        Swaps category titles for ids, rows with an unknown category are skipped.
+        """
+        titles = {values['category'] for line, values in rows.values()}
+        category_ids = {}
+        for pk, title in Category.objects.filter(title__in=titles).order_by('-pk').values_list('pk', 'title'):
+            # Lowest pk wins if a title is not unique
+            category_ids[title] = pk
+        resolved = {}
+        for (category, title), (line, values) in rows.items():
+            if category not in category_ids:
+                self.error(line, "Unknown category %r" % category)
+                continue
+            values = dict(values)
+            del values['category']
+            values['category_id'] = category_ids[category]
+            resolved[(values['category_id'], title)] = (line, values)
+        return resolved
+
+    def find_existing(self, catalog_type, rows):
+        """
+        Existing rows by natural key, the one with the lowest pk if it's not unique.
+        """
+        model = catalog_type.model
+        if catalog_type.name == 'product':
+            queryset = model.objects.filter(
+                category_id__in={key[0] for key in rows}, title__in={key[1] for key in rows},
+            )
+            key_fields = ('category_id', 'title')
+        else:
+            key_field = catalog_type.key[0]
+            queryset = model.objects.filter(**{key_field + '__in': [key[0] for key in rows]})
+            key_fields = catalog_type.key
+        existing = {}
+        for instance in queryset.order_by('-pk'):
+            key = tuple(getattr(instance, name) for name in key_fields)
+            if key in rows:
+                existing[key] = instance
+        return existing
@@ -0,0 +1,144 @@
+"""
+Read replica routing.
+
+With a ``replica`` alias in DATABASES, the catalog endpoints
+(``CachedResponseMixin`` views) read from it on a cache miss, and
+everything else, including every write, stays on the primary (``default``).
+The catalog is all they read, so orders, payments and uploads never see a
+lagging replica.
+
+Reads go back to the primary for ``DATABASE_REPLICA_LAG`` seconds
+(read-your-writes):
+
+- for the rest of a request that wrote anything,
+- for a client that wrote anything, by the ``db_primary`` cookie set on
+  the response of its write,
+- for a catalog response whose models changed that recently, by anyone,
+  judged by the cache generation stamps (backend/caching.py). Otherwise a
+  change would be cached from a replica that hasn't seen it yet, until the
+  next change.
+
+Without a ``replica`` alias everything reads from the primary.
+"""
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = 'replica'
+PIN_COOKIE = 'db_primary'
+
+
+class RoutingState:
+    """
+    Per request: whether the request may read from the replica, and whether it wrote.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica_reads = False
+
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+def has_replica():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def replica_reads(allowed=True):
+    """
+    Lets the queries of the block read from the replica, unless the
+    request is pinned to the primary. Blocks outside a request (commands,
+    background threads) always read from the primary.
+    """
+    state = _state.get()
+    if state is None or not allowed:
+        yield
+        return
+    previous, state.replica_reads = state.replica_reads, True
+    try:
+        yield
+    finally:
+        state.replica_reads = previous
+
+
+def recently_modified(last_modified):
+    return time.time() - last_modified < settings.DATABASE_REPLICA_LAG
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from where the instance came from
+            return instance._state.db
+        state = _state.get()
+        if state is not None and state.replica_reads and not (state.pinned or state.wrote) and has_replica():
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The same data, the replica just lags behind
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scopes the routing state to the request and pins a client that wrote
+    to the primary, sync and async like RequestMetricsMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RoutingState(pinned=self.is_pinned(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=self.is_pinned(request))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.pin(state, response)
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE) or 0) > time.time()
+        except ValueError:
+            return False
+
+    def pin(self, state, response):
+        if state.wrote and has_replica():
+            until = time.time() + settings.DATABASE_REPLICA_LAG
+            response.set_cookie(
+                PIN_COOKIE, '%.0f' % until, max_age=settings.DATABASE_REPLICA_LAG, httponly=True, samesite='Lax',
+            )
+        return response
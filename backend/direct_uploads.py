@@ -0,0 +1,228 @@
+"""
+Uploads sent by the client straight to the storage backend.
+
+Going through ``UploadCustomerImage`` (or the chunked upload API) every byte
+of an image crosses the app servers twice, once in from the client and once
+out to Cloudinary. Here the app server only hands out short-lived, signed
+upload parameters and is told when the upload is done:
+
+    POST uploads/direct/                 {"filename", "size", "kind"} -> token,
+                                         method, upload_url, fields
+    <method> upload_url                  the image, sent to storage
+    POST uploads/<token>/finalize/       creates the product / comment
+
+``DIRECT_UPLOAD_BACKEND`` picks where the image goes:
+
+``cloudinary``
+    A signed Cloudinary upload (``fields`` are posted as multipart form data
+    together with ``file``). The public id is fixed by the signature, so on
+    finalize the image is looked up by it and its size, format and
+    dimensions come from Cloudinary, not from the client.
+
+``local``
+    A stand-in for an object store, for development and tests: the image is
+    PUT as the raw request body to a URL signed with ``SECRET_KEY`` and
+    streamed into ``DEFAULT_FILE_STORAGE``. It goes through Django, so it
+    saves nothing, but the client side is the same as with Cloudinary.
+
+Either way the size, format and pixel limits of the chunked uploads apply,
+checked on finalize before the row is created.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+import cloudinary.api
+import cloudinary.utils
+from PIL import Image
+
+from .models import Comment, Product, UploadSession
+from .uploads import READ_SIZE, UploadError, check_image, start_session
+
+SIGNING_SALT = 'backend.direct_uploads'
+
+# Cloudinary's format names, as PIL names them
+CLOUDINARY_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'gif': 'GIF'}
+
+
+def storage_path(session):
+    """
+    Name of the image in storage, next to the ones saved through Django.
+    """
+    model = Product if session.kind == UploadSession.PRODUCT else Comment
+    extension = os.path.splitext(session.filename)[1].lower()
+    return model._meta.get_field('image').upload_to + session.token.hex + extension
+
+
+class LocalBackend:
+
+    def upload_params(self, session, request):
+        signed = signing.dumps(str(session.token), salt=SIGNING_SALT)
+        return {
+            'method': 'PUT',
+            'upload_url': request.build_absolute_uri(
+                reverse('trucks-signs-root:direct-upload-local-api', kwargs={'signed': signed})
+            ),
+            'fields': {},
+        }
+
+    def receive(self, signed, stream, length):
+        """
+        Stores the body of the stand-in upload request, returns the session.
+        """
+        try:
+            token = signing.loads(signed, salt=SIGNING_SALT, max_age=settings.DIRECT_UPLOAD_EXPIRES)
+        except signing.SignatureExpired:
+            raise UploadError("Upload URL has expired", 403)
+        except signing.BadSignature:
+            raise UploadError("Invalid upload URL", 403)
+        session = UploadSession.objects.get(token=token, direct=True)
+        if session.status != UploadSession.OPEN:
+            raise UploadError("Upload session is %s" % session.status, 409)
+        if session.storage_name:
+            raise UploadError("Image has already been uploaded", 409)
+        if length != session.size:
+            raise UploadError("Expected %d bytes" % session.size, 400)
+
+        name = default_storage.save(storage_path(session), File(LimitedReader(stream, length)))
+        if default_storage.size(name) != session.size:
+            # Connection dropped, the client can simply send it again
+            default_storage.delete(name)
+            raise UploadError("Upload incomplete", 400)
+        session.storage_name = name
+        session.save(update_fields=['storage_name', 'updated'])
+        return session
+
+    def confirm(self, session):
+        if not session.storage_name or not default_storage.exists(session.storage_name):
+            raise UploadError("Image has not been uploaded yet", 409)
+        size = default_storage.size(session.storage_name)
+        try:
+            with default_storage.open(session.storage_name) as f, Image.open(f) as image:
+                image_format, (width, height) = image.format, image.size
+        except Image.DecompressionBombError:
+            raise UploadError("Image has too many pixels", 413)
+        except (OSError, SyntaxError, ValueError):
+            raise UploadError("Not a supported image", 415)
+        return size, image_format, width, height
+
+
+class CloudinaryBackend:
+
+    def credentials(self):
+        config = settings.CLOUDINARY_STORAGE
+        return {
+            'cloud_name': config['CLOUD_NAME'],
+            'api_key': config['API_KEY'],
+            'api_secret': config['API_SECRET'],
+        }
+
+    def public_id(self, session):
+        # The prefix MediaCloudinaryStorage puts in front of the names it stores
+        prefix = getattr(settings, 'CLOUDINARY_STORAGE', {}).get('PREFIX', settings.MEDIA_URL).strip('/')
+        return os.path.splitext(os.path.join(prefix, storage_path(session)))[0]
+
+    def upload_params(self, session, request):
+        credentials = self.credentials()
+        fields = {
+            'public_id': self.public_id(session),
+            'timestamp': int(time.time()),
+            'allowed_formats': ','.join(sorted(CLOUDINARY_FORMATS)),
+        }
+        fields['signature'] = cloudinary.utils.api_sign_request(fields, credentials['api_secret'])
+        fields['api_key'] = credentials['api_key']
+        return {
+            'method': 'POST',
+            'upload_url': cloudinary.utils.cloudinary_api_url(
+                'upload', resource_type='image', cloud_name=credentials['cloud_name'],
+            ),
+            'fields': fields,
+        }
+
+    def confirm(self, session):
+        public_id = self.public_id(session)
+        try:
+            resource = cloudinary.api.resource(public_id, **self.credentials())
+        except cloudinary.api.NotFound:
+            raise UploadError("Image has not been uploaded yet", 409)
+        session.storage_name = resource['public_id']
+        return (
+            resource['bytes'], CLOUDINARY_FORMATS.get(resource['format'], resource['format'].upper()),
+            resource['width'], resource['height'],
+        )
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'cloudinary': CloudinaryBackend,
+}
+
+
+def get_backend():
+    try:
+        return BACKENDS[settings.DIRECT_UPLOAD_BACKEND]()
+    except KeyError:
+        raise ImproperlyConfigured("Unknown DIRECT_UPLOAD_BACKEND %r" % settings.DIRECT_UPLOAD_BACKEND)
+
+
+class LimitedReader:
+    """
+    Reads at most ``length`` bytes of the request body, in READ_SIZE pieces.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(min(size, READ_SIZE))
+        self.remaining -= len(data)
+        return data
+
+
+def start_direct_session(filename, size, kind, request):
+    """
+    Returns the session and the parameters the client uploads the image with.
+    """
+    # Same checks as for chunked uploads, the session just never gets a part file
+    session = start_session(filename, size, kind, direct=True)
+    params = get_backend().upload_params(session, request)
+    params['expires'] = int(time.time()) + settings.DIRECT_UPLOAD_EXPIRES
+    return session, params
+
+
+def confirm_upload(session):
+    """
+    Checks the image the client put in storage and marks the session as
+    received, after which finish_session() creates the row.
+    """
+    if session.status != UploadSession.OPEN:
+        raise UploadError("Upload session is %s" % session.status, 409)
+    try:
+        size, image_format, width, height = get_backend().confirm(session)
+        if size != session.size:
+            raise UploadError("Expected %d bytes, storage has %d" % (session.size, size), 400)
+        check_image(image_format, width, height)
+    except UploadError as e:
+        # 409 is "not uploaded yet", the client can still send it
+        if e.status_code != 409:
+            discard_upload(session)
+            session.status = UploadSession.FAILED
+            session.save(update_fields=['status', 'storage_name', 'updated'])
+        raise
+    session.received = size
+    session.width, session.height = width, height
+    session.save(update_fields=['received', 'width', 'height', 'storage_name', 'updated'])
+
+
+def discard_upload(session):
+    if session.storage_name:
+        default_storage.delete(session.storage_name)
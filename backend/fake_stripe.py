@@ -0,0 +1,141 @@
+"""
+A tiny local stand-in for the parts of the Stripe API used by
+``backend.payments``, so the payment pipeline can be run and load tested
+offline. Point the app at it with ``STRIPE_API_BASE=http://127.0.0.1:12111``
+and start it with ``python manage.py run_fake_stripe``.
+
+Supported endpoints: ``POST /v1/tokens`` and ``POST /v1/charges``.
+Like Stripe's test mode, card 4000000000000002 is declined and
+4000000000009995 fails with insufficient funds; every other card succeeds.
+A request with an ``Idempotency-Key`` header seen before gets the first
+response again.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+DECLINED_CARDS = {
+    '4000000000000002': ('card_declined', 'generic_decline', 'Your card was declined.'),
+    '4000000000009995': ('card_declined', 'insufficient_funds', 'Your card has insufficient funds.'),
+}
+
+
+def _object_id(prefix):
+    return prefix + '_' + uuid.uuid4().hex[:24]
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        key = self.headers.get('Idempotency-Key')
+        if key:
+            self.server.idempotent.setdefault(key, (status, body))
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Request-Id', _object_id('req'))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _card_error(self, code, decline_code, message):
+        self._send(402, {'error': {
+            'type': 'card_error',
+            'code': code,
+            'decline_code': decline_code,
+            'message': message,
+            'param': '',
+        }})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._send(401, {'error': {'type': 'invalid_request_error', 'message': 'No API key provided.'}})
+
+        key = self.headers.get('Idempotency-Key')
+        if key in self.server.idempotent:
+            return self._send(*self.server.idempotent[key])
+
+        if self.path == '/v1/tokens':
+            number = params.get('card[number]', '')
+            if number in DECLINED_CARDS:
+                return self._card_error(*DECLINED_CARDS[number])
+            token_id = _object_id('tok')
+            self.server.tokens[token_id] = number
+            return self._send(200, {
+                'id': token_id,
+                'object': 'token',
+                'type': 'card',
+                'used': False,
+                'livemode': False,
+                'created': int(time.time()),
+                'card': {
+                    'id': _object_id('card'),
+                    'object': 'card',
+                    'last4': number[-4:],
+                    'exp_month': int(params.get('card[exp_month]') or 0),
+                    'exp_year': int(params.get('card[exp_year]') or 0),
+                },
+            })
+
+        if self.path == '/v1/charges':
+            source = params.get('source', '')
+            if source not in self.server.tokens:
+                return self._send(400, {'error': {
+                    'type': 'invalid_request_error',
+                    'message': 'No such token: %s' % source,
+                    'param': 'source',
+                }})
+            charge = {
+                'id': _object_id('ch'),
+                'object': 'charge',
+                'amount': int(params.get('amount') or 0),
+                'currency': params.get('currency', 'usd'),
+                'paid': True,
+                'status': 'succeeded',
+                'livemode': False,
+                'created': int(time.time()),
+                'source': {'object': 'card', 'last4': self.server.tokens.pop(source)[-4:]},
+            }
+            self.server.charges.append(charge)
+            return self._send(200, charge)
+
+        self._send(404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL.'}})
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 12111), latency=0.0, verbose=False):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.verbose = verbose
+        self.tokens = {}
+        self.charges = []
+        self.idempotent = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        """
+        Serves from a daemon thread, for use inside tests or benchmarks.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,177 @@
+"""
+Fast, read-only serialization for the hot GET endpoints.
+
+DRF walks every field of every nested serializer for every object: it
+resolves sources, wraps values in OrderedDicts and dispatches through
+``to_representation`` field by field. For the read paths that work is the
+same on every call, so it is compiled once per serializer class into a flat
+"field plan" (output name, attribute, converter) and replayed on plain dicts.
+
+The plan is built from the DRF serializer itself, so field names, order and
+value formatting stay identical to ``Serializer(instance).data``; the parity
+tests in ``backend/tests.py`` check the rendered JSON byte for byte. DRF
+serializers are still used for everything that writes.
+"""
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .metrics import serializer_timer
+
+
+def _pk_getter(attname):
+    def get(instance):
+        return getattr(instance, attname)
+    return get
+
+
+def _attr_getter(field, attr):
+    def get(instance):
+        try:
+            return getattr(instance, attr)
+        except ObjectDoesNotExist:
+            return None
+        except (AttributeError, KeyError):
+            # Let DRF decide between default, None, SkipField or the error
+            return field.get_attribute(instance)
+    return get
+
+
+def _self_getter(instance):
+    return instance
+
+
+def _file_converter(field):
+    use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+    def convert(value, request):
+        if not value:
+            return None
+        if not use_url:
+            return value.name
+        try:
+            url = value.url
+        except AttributeError:
+            return None
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return convert
+
+
+def _simple_converter(func):
+    def convert(value, request):
+        return func(value)
+    return convert
+
+
+def _field_converter(field):
+    def convert(value, request):
+        return field.to_representation(value)
+    return convert
+
+
+# Fields whose to_representation() is a plain type cast
+SIMPLE_CONVERTERS = {
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+    serializers.CharField: str,
+    serializers.EmailField: str,
+}
+
+
+class FieldPlan:
+    """
+    Flat, precompiled list of (name, getter, converter) for one serializer.
+    """
+
+    def __init__(self, serializer):
+        self.steps = [self.compile_field(field) for field in serializer._readable_fields]
+
+    def compile_field(self, field):
+        if field.source == '*':
+            getter = _self_getter
+        elif isinstance(field, PrimaryKeyRelatedField) and field.use_pk_only_optimization():
+            # Read the FK column instead of loading the related object
+            model_field = field.parent.Meta.model._meta.get_field(field.source)
+            getter = _pk_getter(model_field.attname)
+        elif len(field.source_attrs) == 1:
+            getter = _attr_getter(field, field.source_attrs[0])
+        else:
+            getter = lambda instance, field=field: field.get_attribute(instance)
+
+        if isinstance(field, serializers.ListSerializer):
+            child = FieldPlan(field.child)
+            converter = lambda value, request, child=child: child.serialize_many(value, request)
+        elif isinstance(field, serializers.BaseSerializer):
+            child = FieldPlan(field)
+            converter = child.serialize
+        elif isinstance(field, serializers.SerializerMethodField):
+            method = getattr(field.parent, field.method_name)
+            converter = lambda value, request, method=method: method(value)
+        elif isinstance(field, serializers.FileField):
+            converter = _file_converter(field)
+        elif type(field) in SIMPLE_CONVERTERS:
+            converter = _simple_converter(SIMPLE_CONVERTERS[type(field)])
+        else:
+            converter = _field_converter(field)
+        return field.field_name, getter, converter
+
+    def serialize(self, instance, request=None):
+        data = {}
+        for name, getter, converter in self.steps:
+            try:
+                value = getter(instance)
+            except SkipField:
+                continue
+            data[name] = None if value is None else converter(value, request)
+        return data
+
+    def serialize_many(self, instances, request=None):
+        if isinstance(instances, models.Manager):
+            instances = instances.all()
+        serialize = self.serialize
+        return [serialize(instance, request) for instance in instances]
+
+
+_plans = {}
+
+
+def get_field_plan(serializer_class):
+    plan = _plans.get(serializer_class)
+    if plan is None:
+        plan = _plans[serializer_class] = FieldPlan(serializer_class())
+    return plan
+
+
+class FastSerializerMixin:
+    """
+    Serves list() and retrieve() through the compiled field plan of
+    ``serializer_class`` instead of instantiating the DRF serializer.
+    """
+
+    def get_field_plan(self):
+        return get_field_plan(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_field_plan()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            with serializer_timer():
+                data = plan.serialize_many(page, request)
+            return self.get_paginated_response(data)
+        # The queryset is evaluated inside the timer, its queries are counted as db time too
+        with serializer_timer():
+            data = plan.serialize_many(queryset, request)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        with serializer_timer():
+            data = self.get_field_plan().serialize(instance, request)
+        return Response(data)
@@ -0,0 +1,209 @@
+"""
+Idempotent order creation and payment.
+
+Clients retry ``order/<id>/create/`` and ``order-payment/<id>/`` when a
+request times out, which used to create a second order or charge the card
+twice. A client that sends an ``Idempotency-Key`` header (any string unique
+to the order or payment it is making, e.g. a UUID, the same on every retry)
+gets the response of the first request back instead, with an
+``Idempotent-Replayed: true`` header, and nothing is created or charged again.
+
+The first request commits an ``IdempotencyKey`` row as in progress, runs
+the handler outside of that transaction (no row stays locked and no
+connection sits in a transaction while it waits on Stripe) and then stores
+its response there. A retry that arrives while the first request is still
+running gets a 409 right away, so a retry storm during Stripe slowness
+doesn't pile up behind one charge. A key left in progress by a process that
+died is taken over after ``STALE_AFTER``. Stored responses are also put in
+the cache, where most retries find them without a query.
+
+The same key with different request data is refused (422). Responses with
+a 5xx status or marked ``retryable`` (Stripe unreachable or rate limiting)
+are not stored, a retry with the same key runs again. The charge itself is
+also sent to Stripe with an idempotency key derived from the header, by the
+request or by the payment job it queued (``Prefer: respond-async``).
+
+Async views (backend/async_views.py) call begin() and finish() themselves,
+the decorator does the same around a sync handler.
+
+Keys are kept ``IDEMPOTENCY_KEY_TTL`` seconds, ``manage.py
+clean_idempotency_keys`` removes older ones.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+# Longer than a payment can take (two Stripe calls of at most 80s each)
+STALE_AFTER = timedelta(minutes=5)
+
+
+def get_key(request):
+    return request.META.get(HEADER) or None
+
+
+def _cache_key(path, key):
+    return 'idempotency:%s' % hashlib.md5(('%s|%s' % (path, key)).encode('utf-8')).hexdigest()
+
+
+def fingerprint(request):
+    # Keyed, the data contains card numbers
+    data = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return salted_hmac('backend.idempotency', request.method + request.path + data).hexdigest()
+
+
+def stripe_key(request, suffix):
+    """
+    The idempotency key Stripe gets for a request with an Idempotency-Key
+    header, None without one.
+    """
+    key = get_key(request)
+    if key is None:
+        return None
+    return '%s:%s' % (hashlib.sha256(('%s|%s' % (request.path, key)).encode('utf-8')).hexdigest(), suffix)
+
+
+def _mismatch():
+    return Response(
+        {"Result": "Idempotency-Key was already used for a different request"},
+        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+
+def replay(stored, request_fingerprint):
+    fingerprint, status_code, content, location = stored
+    if fingerprint != request_fingerprint:
+        return _mismatch()
+    headers = {'Idempotent-Replayed': 'true'}
+    if location:
+        headers['Location'] = location
+    return Response(json.loads(content), status=status_code, headers=headers)
+
+
+def _check_key(key):
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {"Result": "Idempotency-Key is longer than %d characters" % MAX_KEY_LENGTH},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return None
+
+
+def _in_progress():
+    return Response(
+        {"Result": "A request with this Idempotency-Key is still being processed"},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def _replay_record(record, cache_key, request_fingerprint):
+    stored = (record.fingerprint, record.status_code, record.response, record.location)
+    transaction.on_commit(lambda: cache.set(cache_key, stored, settings.IDEMPOTENCY_KEY_TTL))
+    return replay(stored, request_fingerprint)
+
+
+def _store(record, response, cache_key):
+    if response.status_code >= 500 or getattr(response, 'retryable', False) or not hasattr(response, 'data'):
+        record.delete()
+        return
+    record.status_code = response.status_code
+    record.response = json.dumps(response.data, cls=JSONEncoder)
+    record.location = response.get('Location', '')[:512]
+    record.save(update_fields=['status_code', 'response', 'location'])
+    stored = (record.fingerprint, record.status_code, record.response, record.location)
+    transaction.on_commit(lambda: cache.set(cache_key, stored, settings.IDEMPOTENCY_KEY_TTL))
+
+
+def _get_or_create(key, path, request_fingerprint):
+    """
+    The record of the key, locked, and whether it was created. (None, False)
+    when the record of a concurrent request with the key was removed (its
+    response was not stored) while this request was inserting its own.
+    """
+    try:
+        return IdempotencyKey.objects.select_for_update().get_or_create(
+            key=key, path=path, defaults={'fingerprint': request_fingerprint},
+        )
+    except IntegrityError:
+        return None, False
+
+
+def idempotent(method):
+    """
+    Makes a POST handler of an APIView idempotent per Idempotency-Key header,
+    requests without one are handled as before.
+    """
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        response, record = begin(request)
+        if response is not None:
+            return response
+        if record is None:
+            return method(self, request, *args, **kwargs)
+        try:
+            response = method(self, request, *args, **kwargs)
+        except Exception:
+            # Not stored, a retry with the key runs again
+            record.delete()
+            raise
+        finish(record, response)
+        return response
+
+    return wrapper
+
+
+def begin(request):
+    """
+    The first half of ``idempotent``, also called by async views. Returns
+    (response, None) when the request is answered here (replay, conflict,
+    bad key), otherwise (None, record) with the key committed as in
+    progress, or (None, None) without a key. Pass the response to finish()
+    afterwards.
+    """
+    key = get_key(request)
+    if key is None:
+        return None, None
+    error = _check_key(key)
+    if error is not None:
+        return error, None
+    path = request.path[:255]
+    request_fingerprint = fingerprint(request)
+    cache_key = _cache_key(path, key)
+    stored = cache.get(cache_key)
+    if stored is not None:
+        return replay(stored, request_fingerprint), None
+
+    with transaction.atomic():
+        record, created = _get_or_create(key, path, request_fingerprint)
+        if record is None:
+            return _in_progress(), None
+        if not created:
+            if record.status_code is not None:
+                return _replay_record(record, cache_key, request_fingerprint), None
+            if record.created > timezone.now() - STALE_AFTER:
+                return _in_progress(), None
+            if record.fingerprint != request_fingerprint:
+                return _mismatch(), None
+            record.created = timezone.now()
+            record.save(update_fields=['created'])
+    return None, record
+
+
+def finish(record, response):
+    """
+    Stores the response of a request begin() returned a record for.
+    """
+    _store(record, response, _cache_key(record.path, record.key))
@@ -0,0 +1,118 @@
+"""
+Background resizing of uploaded images.
+
+Customer uploads (``UploadCustomerImage``) and comment images are stored as
+they come in, often multi-megabyte phone photos. After the upload has been
+committed a pool of ``IMAGE_WORKERS`` threads builds three small renditions
+of the image:
+
+    thumbnail   160 x 160   list thumbnails
+    list        480 x 480   catalog and comment lists
+    detail     1200 x 1200  product detail page
+
+Renditions are WebP (JPEG where Pillow was built without WebP), rotated
+according to the EXIF orientation and written without any EXIF data, so
+camera, GPS and date tags of customer photos are not published. Their paths
+are stored on the model with ``save(update_fields=...)``, which bumps the
+cache generation like any other save.
+
+The upload request does not wait for any of it, the rendition fields stay
+empty until the worker is done. ``manage.py build_image_renditions`` builds
+missing renditions synchronously, e.g. for images uploaded before.
+"""
+import io
+import logging
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from PIL import Image, ImageOps, features
+
+from .background import submit_on_commit
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> bounding box, the image keeps its aspect ratio inside it
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'list': (480, 480),
+    'detail': (1200, 1200),
+}
+RENDITION_QUALITY = 80
+
+
+def rendition_format():
+    return 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def rendition_field(name):
+    return 'image_' + name
+
+
+def make_rendition(image, size, image_format=None):
+    """
+    Returns the encoded bytes of ``image`` scaled down to fit ``size``,
+    without EXIF data.
+    """
+    image_format = image_format or rendition_format()
+    # Returns a copy, rotated upright if the EXIF orientation says so
+    rendition = ImageOps.exif_transpose(image)
+    if rendition.mode == 'P':
+        rendition = rendition.convert('RGBA')
+    # WebP keeps transparency, JPEG can't
+    mode = 'RGBA' if image_format == 'WEBP' and 'A' in rendition.getbands() else 'RGB'
+    if rendition.mode != mode:
+        rendition = rendition.convert(mode)
+    # In place, never scales up
+    rendition.thumbnail(size, Image.LANCZOS)
+    output = io.BytesIO()
+    # No exif= argument, so none of the original metadata is written
+    rendition.save(output, image_format, quality=RENDITION_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def build_renditions(instance, field_name='image'):
+    """
+    Builds and stores all renditions of ``instance.<field_name>`` and saves
+    their paths on the instance.
+    """
+    source = getattr(instance, field_name)
+    if not source:
+        return
+    image_format = rendition_format()
+    extension = '.webp' if image_format == 'WEBP' else '.jpg'
+    with source.open('rb') as f:
+        image = Image.open(f)
+        image.load()
+
+    base_name = os.path.splitext(os.path.basename(source.name))[0]
+    update_fields = []
+    for name, size in RENDITIONS.items():
+        field = getattr(instance, rendition_field(name))
+        if field:
+            # Replace the rendition of an earlier image
+            field.delete(save=False)
+        content = ContentFile(make_rendition(image, size, image_format))
+        field.save('%s-%s%s' % (base_name, name, extension), content, save=False)
+        update_fields.append(rendition_field(name))
+    instance.save(update_fields=update_fields)
+
+
+def enqueue_renditions(instance):
+    """
+    Builds the renditions in the worker pool once the surrounding transaction
+    (if any) has committed.
+    """
+    submit_on_commit(
+        'images', getattr(settings, 'IMAGE_WORKERS', 2), run_renditions_job, instance._meta.label, instance.pk,
+    )
+
+
+def run_renditions_job(label, pk):
+    try:
+        instance = apps.get_model(label).objects.get(pk=pk)
+        build_renditions(instance)
+    except Exception:
+        logger.exception("Building image renditions for %s %s failed", label, pk)
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.utils import timezone
+
+from backend.models import LetteringItemVariation, Order, ProductVariation
+
+
+class Command(BaseCommand):
+    help = "Stores the price snapshot of product variations and orders created before prices were frozen at checkout"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--unpaid-only', action='store_true',
+                            help="Leave paid orders alone (their price may have changed since)")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        batch_size = options['batch_size']
+        variations = ProductVariation.objects.filter(total__isnull=True)
+        if options['unpaid_only']:
+            variations = variations.exclude(order__ordered=True)
+
+        count = 0
+        while True:
+            # Every batch is gone from the filter once written, so no offset is needed
+            with transaction.atomic():
+                batch = list(variations.select_related('product__category').prefetch_related(
+                    'lettering_item_variation_set__lettering_item_category',
+                ).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                items = []
+                for variation in batch:
+                    lettering_items = list(variation.lettering_item_variation_set.all())
+                    variation.set_price_snapshot(lettering_items)
+                    items.extend(lettering_items)
+                ProductVariation.objects.bulk_update(batch, ['base_price', 'unit_price', 'total'])
+                LetteringItemVariation.objects.bulk_update(items, ['price'], batch_size=batch_size)
+                # The orders of the batch take the total of their variation, in one UPDATE
+                Order.objects.filter(product__in=batch, total__isnull=True).update(
+                    total=models.Subquery(
+                        ProductVariation.objects.filter(pk=models.OuterRef('product_id')).values('total')[:1]
+                    ),
+                    priced_at=timezone.now(),
+                )
+            count += len(batch)
+            self.stdout.write("%d product variations" % count)
+
+        self.stdout.write("Stored %d price snapshots in %.1fs" % (count, time.monotonic() - started))
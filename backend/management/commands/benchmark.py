@@ -0,0 +1,205 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmark import DEFAULT_MIX, Workload, parse_mix, run_load, seed_catalog, summarize
+from backend.fake_stripe import FakeStripeServer
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.ROOT_BASE_DIR, stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the API: starts a fake Stripe server and a local gunicorn (unless --url is given), "
+        "runs a weighted mix of catalog, order and payment requests and reports RPS, p50/p95/p99 "
+        "latency and queries per request. Results are saved as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Benchmark an already running server instead of starting gunicorn")
+        parser.add_argument('--concurrency', type=int, default=10, help="Number of concurrent clients")
+        parser.add_argument('--duration', type=float, default=30.0, help="Measured seconds")
+        parser.add_argument('--warmup', type=float, default=3.0, help="Seconds of unmeasured load before")
+        parser.add_argument('--mix', default=','.join('%s=%d' % item for item in DEFAULT_MIX.items()),
+                            help="Scenario weights, e.g. catalog=70,order-create=10,order-retrieve=10,payment=10")
+        parser.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+        parser.add_argument('--worker-class', default='sync',
+                            help="gunicorn worker class, several separated by commas to compare them, "
+                                 "e.g. sync,gthread,gevent,uvicorn (uvicorn serves asgi.py)")
+        parser.add_argument('--threads', type=int,
+                            help="gunicorn threads per worker, default 4 for gthread and 1 otherwise")
+        parser.add_argument('--worker-connections', type=int, default=100,
+                            help="Concurrent requests per gevent worker")
+        parser.add_argument('--stripe-latency', type=float, default=0.0,
+                            help="Seconds the fake Stripe server waits per call")
+        parser.add_argument('--seed', action='store_true', help="Create products and orders to benchmark against")
+        parser.add_argument('--output', help="JSON file for the results (default benchmark-<timestamp>.json)")
+        parser.add_argument('--compare', help="Earlier results JSON to print the difference to")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        if options['seed']:
+            seed_catalog()
+        try:
+            workload = Workload()
+        except ValueError as e:
+            raise CommandError(e)
+
+        worker_classes = [name.strip() for name in options['worker_class'].split(',') if name.strip()]
+        if options['url'] and len(worker_classes) > 1:
+            raise CommandError("--url benchmarks one running server, it can't compare worker classes")
+
+        modes = {}
+        for worker_class in worker_classes:
+            threads = options['threads'] or (4 if worker_class == 'gthread' else 1)
+            stripe_server = gunicorn = None
+            base_url = options['url']
+            try:
+                if not base_url:
+                    stripe_server = FakeStripeServer(('127.0.0.1', 0), latency=options['stripe_latency'])
+                    stripe_server.start()
+                    base_url, gunicorn = self.start_gunicorn(options, stripe_server.url, worker_class, threads)
+
+                self.stdout.write("Benchmarking %s%s with %d clients for %ss ..." % (
+                    base_url, '' if options['url'] else ' (%s)' % worker_class,
+                    options['concurrency'], options['duration']))
+                samples, elapsed = run_load(
+                    base_url, workload, mix,
+                    concurrency=options['concurrency'], duration=options['duration'], warmup=options['warmup'],
+                )
+            finally:
+                if gunicorn is not None:
+                    gunicorn.terminate()
+                    gunicorn.wait(10)
+                if stripe_server is not None:
+                    stripe_server.shutdown()
+                    stripe_server.server_close()
+            modes[worker_class] = {'threads': threads, 'scenarios': summarize(samples, elapsed)}
+            self.print_results(modes[worker_class]['scenarios'])
+
+        first = modes[worker_classes[0]]
+        results = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'settings': os.environ.get('DJANGO_SETTINGS_MODULE'),
+            'config': {
+                'url': options['url'],
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'mix': mix,
+                'workers': None if options['url'] else options['workers'],
+                'worker_class': None if options['url'] else worker_classes[0],
+                'threads': None if options['url'] else first['threads'],
+                'worker_connections': None if options['url'] else options['worker_connections'],
+                'stripe_latency': None if options['url'] else options['stripe_latency'],
+            },
+            # The first worker class, the one --compare looks at
+            'scenarios': first['scenarios'],
+        }
+        if len(modes) > 1:
+            results['modes'] = modes
+            self.print_modes(modes)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f)['scenarios'], results['scenarios'])
+
+        output = options['output'] or 'benchmark-%s.json' % datetime.now().strftime('%Y%m%d-%H%M%S')
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write("Results saved to %s" % output)
+
+    def start_gunicorn(self, options, stripe_url, worker_class, threads):
+        port = _free_port()
+        # Same settings module and database as this process
+        env = dict(os.environ, STRIPE_API_BASE=stripe_url, REQUEST_METRICS='True')
+        if worker_class == 'uvicorn':
+            worker_class, app = 'uvicorn.workers.UvicornWorker', 'truck_signs_designs.asgi:application'
+            env['ASYNC_VIEWS'] = 'True'
+        else:
+            app = 'truck_signs_designs.wsgi:application'
+        # gunicorn.conf.py for everything else (max requests, keepalive, gevent psycopg2 support)
+        command = [
+            sys.executable, '-m', 'gunicorn', app,
+            '-c', os.path.join(settings.ROOT_BASE_DIR, 'gunicorn.conf.py'),
+            '--bind', '127.0.0.1:%d' % port,
+            '--workers', str(options['workers']),
+            '--worker-class', worker_class,
+            '--threads', str(threads),
+            '--worker-connections', str(options['worker_connections']),
+            '--log-level', 'warning',
+        ]
+        gunicorn = subprocess.Popen(command, cwd=settings.ROOT_BASE_DIR, env=env)
+        base_url = 'http://127.0.0.1:%d' % port
+
+        deadline = time.monotonic() + 30
+        while True:
+            if gunicorn.poll() is not None:
+                raise CommandError("gunicorn exited with status %s" % gunicorn.returncode)
+            try:
+                urllib.request.urlopen(base_url + '/api/', timeout=1).read()
+                return base_url, gunicorn
+            except OSError:
+                if time.monotonic() > deadline:
+                    gunicorn.terminate()
+                    raise CommandError("gunicorn did not answer on %s within 30s" % base_url)
+                time.sleep(0.2)
+
+    def print_results(self, scenarios):
+        self.stdout.write('%-16s %9s %7s %9s %9s %9s %9s %9s' % (
+            'scenario', 'requests', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for name, row in scenarios.items():
+            self.stdout.write('%-16s %9d %7d %9s %9s %9s %9s %9s' % (
+                name, row['requests'], row['errors'], row['rps'],
+                row['p50_ms'], row['p95_ms'], row['p99_ms'], row['queries_per_request']))
+
+    def print_modes(self, modes):
+        self.stdout.write("\nWorker classes side by side (rps / p95 ms):")
+        names = list(modes)
+        self.stdout.write('%-16s ' % 'scenario' + ' '.join('%20s' % name for name in names))
+        scenarios = []
+        for mode in modes.values():
+            scenarios.extend(name for name in mode['scenarios'] if name not in scenarios)
+        for scenario in scenarios:
+            cells = []
+            for name in names:
+                row = modes[name]['scenarios'].get(scenario)
+                cells.append('%20s' % ('%s / %s' % (row['rps'], row['p95_ms']) if row else '-'))
+            self.stdout.write('%-16s ' % scenario + ' '.join(cells))
+
+    def print_comparison(self, before, after):
+        self.stdout.write("\nCompared to the earlier run (after / before):")
+        for name, row in after.items():
+            old = before.get(name)
+            if not old:
+                continue
+            changes = []
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+                if row[key] is not None and old[key]:
+                    changes.append('%s %.2fx' % (key, row[key] / old[key]))
+            self.stdout.write('%-16s %s' % (name, ', '.join(changes)))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from backend.images import build_renditions
+from backend.models import Comment, Product
+
+
+class Command(BaseCommand):
+    help = "Builds the thumbnail/list/detail renditions of product and comment images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Rebuild every rendition, not only the missing ones")
+
+    def handle(self, *args, **options):
+        for model in (Product, Comment):
+            queryset = model.objects.exclude(image='').order_by('pk')
+            if not options['all']:
+                queryset = queryset.filter(image_thumbnail='')
+            built = failed = 0
+            for instance in queryset.iterator():
+                try:
+                    build_renditions(instance)
+                    built += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write("%s %s: %s" % (model.__name__, instance.pk, e))
+            self.stdout.write("%s: %d built, %d failed" % (model._meta.verbose_name_plural, built, failed))
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Removes stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL"
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        count, _ = IdempotencyKey.objects.filter(created__lt=cutoff).delete()
+        self.stdout.write("Removed %d idempotency keys" % count)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import UploadSession
+from backend.direct_uploads import discard_upload
+from backend.uploads import discard_file, expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Removes chunked uploads that were never finished (older than UPLOAD_SESSION_TTL)"
+
+    def handle(self, *args, **options):
+        count = 0
+        for session in expired_sessions().iterator():
+            discard_file(session)
+            discard_upload(session)
+            UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.FAILED)
+            count += 1
+        self.stdout.write("Removed %d unfinished uploads" % count)
@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from backend.metrics import cache_is_shared, histogram, percentile
+
+
+def _format_bound(bound):
+    return '>5000' if bound == float('inf') else str(bound)
+
+
+class Command(BaseCommand):
+    help = "Prints the per-endpoint request histogram collected by RequestMetricsMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Print JSON instead of a table")
+        parser.add_argument('--reset', action='store_true', help="Clear the collected metrics afterwards")
+
+    def summarize(self, stats):
+        count = stats['count']
+        lookups = stats['cache_hits'] + stats['cache_misses']
+        return {
+            'count': count,
+            'avg_ms': round(stats['total_ms'] / count, 2),
+            'p50_ms': percentile(stats['buckets'], 0.50),
+            'p95_ms': percentile(stats['buckets'], 0.95),
+            'p99_ms': percentile(stats['buckets'], 0.99),
+            'queries_per_request': round(stats['queries'] / count, 2),
+            'db_ms_per_request': round(stats['db_ms'] / count, 2),
+            'cache_hit_ratio': round(stats['cache_hits'] / lookups, 3) if lookups else None,
+            'serializer_ms_per_request': round(stats['serializer_ms'] / count, 2),
+        }
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            self.stderr.write(
+                "The default cache is per process, this only shows the requests of this process. "
+                "Set CACHE_BACKEND to redis or memcached to collect the metrics of all workers."
+            )
+        # Whatever this process collected itself (e.g. called from a shell)
+        histogram.flush()
+        summary = {
+            endpoint: self.summarize(stats)
+            for endpoint, stats in sorted(histogram.read().items())
+            if stats['count']
+        }
+
+        if options['json']:
+            # float('inf') is not valid JSON
+            for row in summary.values():
+                for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                    if row[key] == float('inf'):
+                        row[key] = None
+            self.stdout.write(json.dumps(summary, indent=2))
+        elif not summary:
+            self.stdout.write("No requests recorded, is REQUEST_METRICS enabled?")
+        else:
+            header = '%-45s %8s %9s %7s %7s %7s %8s %8s %6s %8s' % (
+                'endpoint', 'count', 'avg ms', 'p50', 'p95', 'p99', 'queries', 'db ms', 'hit %', 'ser ms')
+            self.stdout.write(header)
+            for endpoint, row in summary.items():
+                ratio = row['cache_hit_ratio']
+                self.stdout.write('%-45s %8d %9.2f %7s %7s %7s %8.2f %8.2f %6s %8.2f' % (
+                    endpoint, row['count'], row['avg_ms'],
+                    _format_bound(row['p50_ms']), _format_bound(row['p95_ms']), _format_bound(row['p99_ms']),
+                    row['queries_per_request'], row['db_ms_per_request'],
+                    '-' if ratio is None else '%.1f' % (ratio * 100),
+                    row['serializer_ms_per_request'],
+                ))
+
+        if options['reset']:
+            histogram.reset()
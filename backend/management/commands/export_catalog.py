@@ -0,0 +1,35 @@
+import sys
+import time
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+
+from backend.catalog_io import CATALOG_TYPES, CATALOG_TYPES_BY_NAME, FORMATS, export_rows, guess_format, write_rows
+
+
+class Command(BaseCommand):
+    help = "Writes categories, lettering item categories, colors and products as CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="File to write, - for stdout")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, csv for stdout")
+        parser.add_argument('--type', action='append', choices=sorted(CATALOG_TYPES_BY_NAME),
+                            help="Only export this type, can be given more than once")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows fetched from the database at a time")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        file_format = options['format'] or ('csv' if path == '-' else guess_format(path))
+        catalog_types = [t for t in CATALOG_TYPES if not options['type'] or t.name in options['type']]
+        rows = chain.from_iterable(export_rows(t, options['batch_size']) for t in catalog_types)
+
+        started = time.monotonic()
+        f = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            count = write_rows(f, file_format, catalog_types, rows)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        elapsed = time.monotonic() - started
+        # stderr, stdout may be the export itself
+        self.stderr.write("%d rows in %.1fs (%d rows/s)" % (count, elapsed, count / max(elapsed, 1e-6)))
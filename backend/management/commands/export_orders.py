@@ -0,0 +1,60 @@
+import sys
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from backend.models import Order
+from backend.order_export import FORMATS, iter_export
+
+
+def _parse_date(value):
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise CommandError("Dates are YYYY-MM-DD, got %r" % value)
+    return timezone.make_aware(day) if settings.USE_TZ else day
+
+
+class Command(BaseCommand):
+    help = "Writes orders with product, lettering, payment and total price as CSV, JSON lines or columnar JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="File to write, - for stdout")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--since', help="Orders from this date on (YYYY-MM-DD)")
+        parser.add_argument('--until', help="Orders before this date (YYYY-MM-DD)")
+        parser.add_argument('--paid', action='store_true', help="Only orders that were paid")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Orders fetched from the database at a time")
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options['since']:
+            queryset = queryset.filter(ordered_date__gte=_parse_date(options['since']))
+        if options['until']:
+            queryset = queryset.filter(ordered_date__lt=_parse_date(options['until']))
+        if options['paid']:
+            queryset = queryset.filter(ordered=True)
+
+        path = options['output']
+        started = time.monotonic()
+        count = 0
+
+        def on_chunk(rows):
+            nonlocal count
+            count += rows
+            if options['verbosity'] > 1:
+                self.stderr.write("%d orders, %d orders/s so far" % (count, count / max(time.monotonic() - started, 1e-6)))
+
+        f = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            for part in iter_export(queryset, options['format'], options['chunk_size'], on_chunk):
+                f.write(part)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        elapsed = time.monotonic() - started
+        # stderr, stdout may be the export itself
+        self.stderr.write("%d orders in %.1fs (%d orders/s)" % (count, elapsed, count / max(elapsed, 1e-6)))
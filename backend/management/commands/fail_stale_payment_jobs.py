@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend.models import PaymentJob
+from backend.payments import STALE_JOB_AFTER
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks payment jobs that were left pending or processing by a worker that died "
+        "as failed, so polling clients submit the payment again"
+    )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - STALE_JOB_AFTER
+        count = PaymentJob.objects.filter(
+            status__in=[PaymentJob.PENDING, PaymentJob.PROCESSING], updated__lt=cutoff,
+        ).update(status=PaymentJob.FAILED, result="Payment was interrupted, please try again", updated=timezone.now())
+        self.stdout.write("Failed %d stale payment jobs" % count)
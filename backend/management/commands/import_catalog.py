@@ -0,0 +1,62 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.catalog_io import CATALOG_TYPES_BY_NAME, FORMATS, CatalogImporter, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Creates or updates categories, lettering item categories, colors and products from CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON lines file, - for stdin")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, csv for stdin")
+        parser.add_argument('--type', choices=sorted(CATALOG_TYPES_BY_NAME),
+                            help="Type of rows without a type column")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per bulk_create/bulk_update")
+        parser.add_argument('--images', metavar='DIR',
+                            help="Directory the image and detail_image columns are relative to")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path == '-' else guess_format(path))
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        def on_error(line, message):
+            self.stderr.write("line %s: %s" % (line, message))
+
+        def on_batch(catalog_type, count):
+            if options['verbosity'] > 1:
+                self.stdout.write("%s: wrote %d rows, %d rows/s so far" % (
+                    catalog_type.name, count, importer.stats['rows'] / max(time.monotonic() - started, 1e-6)))
+
+        importer = CatalogImporter(
+            batch_size=options['batch_size'], images_dir=options['images'], default_type=options['type'],
+            on_error=on_error, on_batch=on_batch,
+        )
+        started = time.monotonic()
+        try:
+            f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(e)
+        try:
+            for line, row in read_rows(f, file_format):
+                importer.add(line, row)
+        except (ValueError, OSError) as e:
+            raise CommandError("%s: %s" % (path, e))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        stats = importer.finish()
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(
+            "%d rows in %.1fs (%d rows/s): %d created, %d updated, %d unchanged, %d images copied, %d errors" % (
+                stats['rows'], elapsed, stats['rows'] / max(elapsed, 1e-6),
+                stats['created'], stats['updated'], stats['unchanged'], stats['images'], stats['errors'],
+            )
+        )
+        if stats['images']:
+            self.stdout.write("Run manage.py build_image_renditions to build the renditions of new images")
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from backend.reporting import rebuild
+
+
+def _date(value):
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise CommandError("Dates are YYYY-MM-DD, got %r" % value)
+    return day
+
+
+class Command(BaseCommand):
+    help = "Recomputes the daily sales rollups from the paid orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=_date, help="First day to rebuild (YYYY-MM-DD), default all")
+        parser.add_argument('--until', type=_date, help="Day after the last one to rebuild (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild(options['since'], options['until'])
+        self.stdout.write("Wrote %d rollup rows in %.1fs" % (count, time.monotonic() - started))
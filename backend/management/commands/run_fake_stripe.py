@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from backend.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Runs a local fake Stripe API for offline payment and load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Seconds to wait before every response, to emulate Stripe round trips")
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer((options['host'], options['port']), latency=options['latency'],
+                                  verbose=options['verbosity'] > 1)
+        self.stdout.write("Fake Stripe listening on %s (set STRIPE_API_BASE to this URL)" % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
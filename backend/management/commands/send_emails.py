@@ -0,0 +1,35 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from backend.outbox import deliver
+
+
+class Command(BaseCommand):
+    help = "Sends the queued purchase emails, in batches over one SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Emails per batch, default EMAIL_OUTBOX_BATCH_SIZE")
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to wait for new emails when the outbox is empty")
+        parser.add_argument('--once', action='store_true', help="Send what is due and exit")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        try:
+            while True:
+                sent, failed = deliver(connection, options['batch_size'])
+                if sent or failed:
+                    self.stdout.write("Sent %d emails, %d failed" % (sent, failed))
+                    continue
+                # Nothing due, the mail server shouldn't see an idle connection for long
+                connection.close()
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                # A long running worker, apply CONN_MAX_AGE and drop broken connections like a request would
+                close_old_connections()
+        finally:
+            connection.close()
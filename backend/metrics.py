@@ -0,0 +1,285 @@
+"""
+Per-request instrumentation: DB query count and time, cache hits and misses,
+serializer time and total latency.
+
+Opt in by adding ``backend.metrics.RequestMetricsMiddleware`` at the top of
+MIDDLEWARE (``REQUEST_METRICS=True`` in production_docker.py). Every response
+then carries a ``Server-Timing`` header, every request logs one JSON line on
+the ``backend.metrics`` logger, and a latency histogram per endpoint is kept
+in the default cache. ``python manage.py dump_request_metrics`` prints it.
+
+The histogram of every worker only adds up when the default cache is a
+server all processes share (``CACHE_BACKEND`` redis or memcached). With a
+per-process cache (locmem, the default) each worker keeps its own and
+``dump_request_metrics``, a process of its own, sees none of them; it warns
+about that.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .cache_backends import FakeSharedCache, TwoTierCache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds, the last bucket catches everything slower
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+ENDPOINTS_KEY = 'metrics:endpoints'
+COUNTERS = ('count', 'queries', 'db_ms', 'cache_hits', 'cache_misses', 'serializer_ms', 'total_ms')
+# Cache backends that keep their data in the process that wrote it
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache, FakeSharedCache)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serializer_time = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def current_metrics():
+    return _current.get()
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+@contextmanager
+def serializer_timer():
+    metrics = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.serializer_time += time.perf_counter() - start
+
+
+def bucket_for(milliseconds):
+    for bound in LATENCY_BUCKETS:
+        if milliseconds <= bound:
+            return bound
+
+
+def _bucket_label(bound):
+    return 'inf' if bound == float('inf') else str(bound)
+
+
+def metric_key(endpoint, name):
+    return 'metrics:%s:%s' % (endpoint, name)
+
+
+def cache_is_shared():
+    """
+    Whether the histogram cache is shared between processes.
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(backend, TwoTierCache):
+        # The metric keys always go to the shared tier
+        backend = backend.shared
+    return not isinstance(backend, PROCESS_LOCAL_CACHES)
+
+
+class Histogram:
+    """
+    Per-worker aggregate, flushed to the shared cache with incr() every
+    REQUEST_METRICS_FLUSH_INTERVAL seconds so requests don't pay for it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(float)
+        self.endpoints = set()
+        self.last_flush = time.monotonic()
+
+    def add(self, endpoint, metrics, total_ms):
+        with self.lock:
+            self.pending[metric_key(endpoint, 'count')] += 1
+            self.pending[metric_key(endpoint, 'queries')] += metrics.queries
+            self.pending[metric_key(endpoint, 'db_ms')] += metrics.db_time * 1000
+            self.pending[metric_key(endpoint, 'cache_hits')] += metrics.cache_hits
+            self.pending[metric_key(endpoint, 'cache_misses')] += metrics.cache_misses
+            self.pending[metric_key(endpoint, 'serializer_ms')] += metrics.serializer_time * 1000
+            self.pending[metric_key(endpoint, 'total_ms')] += total_ms
+            self.pending[metric_key(endpoint, 'bucket_' + _bucket_label(bucket_for(total_ms)))] += 1
+            self.endpoints.add(endpoint)
+            due = time.monotonic() - self.last_flush >= getattr(settings, 'REQUEST_METRICS_FLUSH_INTERVAL', 10)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(float)
+            endpoints, self.endpoints = self.endpoints, set()
+            self.last_flush = time.monotonic()
+        # The index can lose a concurrent update, the next flush adds it again
+        known = set(cache.get(ENDPOINTS_KEY) or ())
+        if not endpoints <= known:
+            cache.set(ENDPOINTS_KEY, sorted(known | endpoints), None)
+        for key, value in pending.items():
+            # Counters are stored as integers, milliseconds are rounded
+            value = int(round(value))
+            if not cache.add(key, value, None):
+                try:
+                    cache.incr(key, value)
+                except ValueError:
+                    cache.set(key, value, None)
+
+    def read(self):
+        """
+        Returns {endpoint: {counter: value, 'buckets': [(bound, count), ...]}} from the shared cache.
+        """
+        result = {}
+        for endpoint in cache.get(ENDPOINTS_KEY) or ():
+            names = list(COUNTERS) + ['bucket_' + _bucket_label(bound) for bound in LATENCY_BUCKETS]
+            values = cache.get_many([metric_key(endpoint, name) for name in names])
+            stats = {name: values.get(metric_key(endpoint, name), 0) for name in COUNTERS}
+            stats['buckets'] = [
+                (bound, values.get(metric_key(endpoint, 'bucket_' + _bucket_label(bound)), 0))
+                for bound in LATENCY_BUCKETS
+            ]
+            result[endpoint] = stats
+        return result
+
+    def reset(self):
+        names = list(COUNTERS) + ['bucket_' + _bucket_label(bound) for bound in LATENCY_BUCKETS]
+        for endpoint in cache.get(ENDPOINTS_KEY) or ():
+            cache.delete_many([metric_key(endpoint, name) for name in names])
+        cache.delete(ENDPOINTS_KEY)
+
+
+histogram = Histogram()
+
+
+def percentile(buckets, fraction):
+    """
+    Upper bound of the bucket holding the given fraction of requests.
+    """
+    total = sum(count for bound, count in buckets)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in buckets:
+        seen += count
+        if seen >= total * fraction:
+            return bound
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return request.method + ':<unresolved>'
+    # Both URL namespaces map to the same views, report them together
+    return request.method + ':' + (match.url_name or match.view_name)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.execute_wrapper(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class RequestMetricsMiddleware:
+    """
+    Sync and async (under ASGI the async views aren't run through a sync
+    middleware, which would hold the sync thread while they await).
+    Queries are recorded by a wrapper on every connection into the metrics
+    of the current context, which also reaches the sync thread of an async
+    view.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        connection_created.connect(install_query_recorder, dispatch_uid='backend.metrics')
+        for connection in connections.all():
+            install_query_recorder(connection)
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        # The histogram flush writes to the cache
+        return await sync_to_async(self.finish, thread_sensitive=False)(request, response, metrics, start)
+
+    def finish(self, request, response, metrics, start):
+        total_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.2f;desc="%d queries"' % (metrics.db_time * 1000, metrics.queries),
+            'cache;desc="%d hit %d miss"' % (metrics.cache_hits, metrics.cache_misses),
+            'ser;dur=%.2f' % (metrics.serializer_time * 1000),
+            'total;dur=%.2f' % total_ms,
+        ])
+
+        endpoint = endpoint_name(request)
+        logger.info(json.dumps({
+            'endpoint': endpoint,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'serializer_ms': round(metrics.serializer_time * 1000, 2),
+            'total_ms': round(total_ms, 2),
+        }))
+        histogram.add(endpoint, metrics, total_ms)
+        return response
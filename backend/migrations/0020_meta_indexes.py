@@ -0,0 +1,45 @@
+# Generated by Django 2.2.8 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0019_remove_product_color_default_safe'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['title'], name='backend_cat_title_a977d7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['visible'], name='backend_com_visible_543eb0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='letteringitemvariation',
+            index=models.Index(fields=['product_variation'], name='backend_let_product_3e343b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_email'], name='backend_ord_user_em_b90114_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered_date'], name='backend_ord_ordered_6f29dc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'is_uploaded'], name='backend_pro_categor_123b11_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category'], name='backend_pro_categor_2233ae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariation',
+            index=models.Index(fields=['product'], name='backend_pro_product_daac24_idx'),
+        ),
+    ]
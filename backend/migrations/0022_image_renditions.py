@@ -0,0 +1,43 @@
+# Generated by Django 2.2.8 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0021_paymentjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='image_detail',
+            field=models.ImageField(blank=True, upload_to='uploads/renditions/comments/'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='image_list',
+            field=models.ImageField(blank=True, upload_to='uploads/renditions/comments/'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, upload_to='uploads/renditions/comments/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_detail',
+            field=models.ImageField(blank=True, upload_to='uploads/renditions/products/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_list',
+            field=models.ImageField(blank=True, upload_to='uploads/renditions/products/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, upload_to='uploads/renditions/products/'),
+        ),
+    ]
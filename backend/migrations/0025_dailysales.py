@@ -0,0 +1,37 @@
+# Generated by Django 2.2.8 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0024_uploadsession_direct'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('category', 'Category'), ('product', 'Product'), ('color', 'Color'), ('lettering-category', 'Lettering item category')], max_length=32)),
+                ('key_id', models.PositiveIntegerField(default=0)),
+                ('label', models.CharField(blank=True, max_length=256)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.FloatField(default=0.0)),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailysales',
+            index=models.Index(fields=['dimension', 'day'], name='backend_dai_dimensi_6d16d2_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailysales',
+            unique_together={('day', 'dimension', 'key_id')},
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.8 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0025_dailysales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letteringitemvariation',
+            name='price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='priced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='base_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='total',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='unit_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
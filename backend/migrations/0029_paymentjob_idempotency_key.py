@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0028_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentjob',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0029_paymentjob_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_started',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.text import slugify
 import re
+import uuid
 from django.core.validators import RegexValidator
 
 COLOR_VALIDATOR = RegexValidator(r'^#(?:[0-9a-fA-F]{3}){1,2}$', 'only valid hex color code is accepted')
@@ -53,6 +56,10 @@ class Product(models.Model):
     image = models.ImageField(upload_to='uploads/products/', blank=True)
     detail_image = models.ImageField(upload_to='uploads/products_detail', blank=True)
     is_uploaded = models.BooleanField(default=False)
+    # Small WebP/JPEG versions of image, built in the background (backend/images.py)
+    image_thumbnail = models.ImageField(upload_to='uploads/renditions/products/', blank=True)
+    image_list = models.ImageField(upload_to='uploads/renditions/products/', blank=True)
+    image_detail = models.ImageField(upload_to='uploads/renditions/products/', blank=True)
 
     class Meta:
         indexes = [
@@ -65,11 +72,47 @@ class Product(models.Model):
 
 
 
+def total_price_expression(variation='pk', prefix=''):
+    """
+    SQL for (base price + sum of lettering item prices) * amount of a product
+    variation. ``variation`` references the variation's pk from the outer
+    query, ``prefix`` is the lookup path from the outer model to the variation.
+    """
+    lettering_price = LetteringItemVariation.objects.filter(
+        product_variation=models.OuterRef(variation),
+    ).order_by().values('product_variation').annotate(
+        price=models.Sum('lettering_item_category__price'),
+    ).values('price')
+    return models.ExpressionWrapper(
+        (
+            Coalesce(models.F(prefix + 'product__category__base_price'), models.Value(0.0))
+            + Coalesce(models.Subquery(lettering_price, output_field=models.FloatField()), models.Value(0.0))
+        ) * models.F(prefix + 'amount'),
+        output_field=models.FloatField(),
+    )
+
+
+class ProductVariationQuerySet(models.QuerySet):
+
+    def with_total_price(self):
+        """
+        Annotates ``total_price`` in the same query: the price snapshot, or
+        for rows without one the current price, see total_price_expression().
+        """
+        return self.annotate(total_price=Coalesce(models.F('total'), total_price_expression()))
+
+
 class ProductVariation(models.Model):
 
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     product_color = models.ForeignKey(ProductColor, on_delete=models.SET_NULL, null=True, blank=True)
     amount = models.IntegerField(default=1)
+    # Prices frozen at checkout, see set_price_snapshot(). Null for rows from before.
+    base_price = models.FloatField(null=True, blank=True)
+    unit_price = models.FloatField(null=True, blank=True)
+    total = models.FloatField(null=True, blank=True)
+
+    objects = ProductVariationQuerySet.as_manager()
 
     class Meta:
         indexes = [
@@ -79,14 +122,38 @@ class ProductVariation(models.Model):
     def get_all_lettering_items(self):
         return self.lettering_item_variation_set.all()
 
+    def set_price_snapshot(self, lettering_items):
+        """
+        Freezes the current price of the category and of ``lettering_items``
+        (this variation's, with their categories loaded) on the variation and
+        the items, so later price changes don't re-price the order. Saving
+        is up to the caller.
+        """
+        for item in lettering_items:
+            category = item.lettering_item_category
+            item.price = category.price if category is not None else 0.0
+        self.base_price = self.product.category.base_price if self.product is not None else 0.0
+        self.unit_price = self.base_price + sum(item.price for item in lettering_items)
+        self.total = self.unit_price * self.amount
+
     def get_total_price(self):
-        # Optimize: Use select_related to avoid N+1 queries
-        # Prefetch lettering items to avoid additional queries
-        items = self.lettering_item_variation_set.select_related('lettering_item_category').all()
-        price = self.product.category.base_price
-        for item in items:
-            price += item.lettering_item_category.price
-        price = price * self.amount
+        if self.total is not None:
+            return self.total
+        # Annotated by ProductVariation.objects.with_total_price()
+        if hasattr(self, 'total_price'):
+            return self.total_price
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'lettering_item_variation_set' in prefetched:
+            lettering_price = sum(
+                item.lettering_item_category.price
+                for item in prefetched['lettering_item_variation_set']
+                if item.lettering_item_category is not None
+            )
+        else:
+            lettering_price = self.lettering_item_variation_set.aggregate(
+                price=Coalesce(models.Sum('lettering_item_category__price'), models.Value(0.0)),
+            )['price']
+        price = (self.product.category.base_price + lettering_price) * self.amount
         return price
 
     def __str__(self):
@@ -98,6 +165,8 @@ class ProductVariation(models.Model):
 class LetteringItemVariation(models.Model):
     lettering_item_category = models.ForeignKey(LetteringItemCategory, on_delete=models.SET_NULL, null=True, blank=True)
     lettering = models.CharField(max_length=256)
+    # Price of the category at checkout
+    price = models.FloatField(null=True, blank=True)
     product_variation = models.ForeignKey(ProductVariation, on_delete=models.SET_NULL, null=True, blank=True,related_name="lettering_item_variation_set")
 
     class Meta:
@@ -123,6 +192,16 @@ class Payment(models.Model):
 
 
 
+class OrderQuerySet(models.QuerySet):
+
+    def with_total_price(self):
+        """
+        Annotates ``total_price`` of the ordered product variation in the same
+        query, the snapshot if the order has one.
+        """
+        return self.annotate(total_price=Coalesce(models.F('total'), total_price_expression('product', 'product__')))
+
+
 class Order(models.Model):
     ordered_date = models.DateTimeField(auto_now_add=True, blank=True,null=True)
     user_email = models.CharField(max_length=256)
@@ -135,6 +214,13 @@ class Order(models.Model):
     product = models.ForeignKey(ProductVariation, on_delete=models.SET_NULL, null=True, blank=True)
     comment = models.TextField(blank=True)
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)
+    # Total of the product variation frozen at checkout (or payment, for older orders)
+    total = models.FloatField(null=True, blank=True)
+    priced_at = models.DateTimeField(null=True, blank=True)
+    # Set while a payment of the order talks to Stripe, see backend/payments.py
+    payment_started = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         indexes = [
@@ -145,15 +231,205 @@ class Order(models.Model):
     def __str__(self):
         return self.user_email + '-' + self.ordered_date.strftime("%b. %-d, %Y, %-I:%M %p")
 
+    def set_price_snapshot(self):
+        """
+        Freezes the total of the product variation, see
+        ProductVariation.set_price_snapshot(). Saving is up to the caller.
+        """
+        self.total = self.product.total
+        self.priced_at = timezone.now()
+
     def get_total_price(self):
+        if self.total is not None:
+            return self.total
+        # Annotated by Order.objects.with_total_price()
+        if hasattr(self, 'total_price'):
+            return self.total_price
         return self.product.get_total_price()
 
 
+class PaymentJob(models.Model):
+    """
+    A payment processed in the background, see backend/payments.py.
+    Card details are never stored, they only live in the worker's memory.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    # Sent to Stripe with the charge, derived from the request's Idempotency-Key header if any
+    idempotency_key = models.CharField(max_length=255, blank=True)
+    result = models.CharField(max_length=256, blank=True)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.order_id) + " - " + self.status
+
+
+class OutboxEmail(models.Model):
+    """
+    An email written when a payment commits and sent by ``manage.py
+    send_emails``, see backend/outbox.py.
+    """
+    PURCHASE = 'purchase'
+    ADMIN_PURCHASE = 'admin-purchase'
+    KIND_CHOICES = [
+        (PURCHASE, 'Purchase confirmation'),
+        (ADMIN_PURCHASE, 'Purchase notification to the admin'),
+    ]
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    to_email = models.CharField(max_length=256)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='emails')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Not before then: after a failure the retry, while being sent the end of the worker's lease
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=512, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt']),  # Für send_emails: fällige E-Mails
+        ]
+
+    def __str__(self):
+        return self.to_email + " - " + self.kind + " - " + self.status
+
+
+class DailySales(models.Model):
+    """
+    Paid orders of one day, per category, product, color or lettering item
+    category. Kept up to date on every payment, see backend/reporting.py.
+    """
+    CATEGORY = 'category'
+    PRODUCT = 'product'
+    COLOR = 'color'
+    LETTERING = 'lettering-category'
+    DIMENSION_CHOICES = [
+        (CATEGORY, 'Category'),
+        (PRODUCT, 'Product'),
+        (COLOR, 'Color'),
+        (LETTERING, 'Lettering item category'),
+    ]
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=32, choices=DIMENSION_CHOICES)
+    # Id of the category, product, ... 0 for orders without one (e.g. no color)
+    key_id = models.PositiveIntegerField(default=0)
+    # Title at the time of the last sale
+    label = models.CharField(max_length=256, blank=True)
+    orders = models.PositiveIntegerField(default=0)
+    # Signs sold (order amounts), for lettering categories lettering items times amount
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name_plural = 'daily sales'
+        unique_together = [('day', 'dimension', 'key_id')]
+        indexes = [
+            models.Index(fields=['dimension', 'day']),  # Für Berichte eines Zeitraums
+        ]
+
+    def __str__(self):
+        return "%s %s %s" % (self.day, self.dimension, self.label)
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a POST sent with an ``Idempotency-Key`` header, replayed
+    when the client sends it again, see backend/idempotency.py.
+    """
+    key = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    # HMAC of the request data, the same key with another request is refused
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still being handled
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.TextField(blank=True)
+    location = models.CharField(max_length=512, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('key', 'path')]
+        indexes = [
+            models.Index(fields=['created']),  # Für clean_idempotency_keys
+        ]
+
+    def __str__(self):
+        return self.path + " - " + self.key
+
+
+class UploadSession(models.Model):
+    """
+    A chunked image upload in progress, see backend/uploads.py.
+    """
+    PRODUCT = 'product'
+    COMMENT = 'comment'
+    KIND_CHOICES = [
+        (PRODUCT, 'Customer product image'),
+        (COMMENT, 'Comment image'),
+    ]
+    OPEN = 'open'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (OPEN, 'Open'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    ]
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, default=PRODUCT)
+    filename = models.CharField(max_length=256)
+    size = models.PositiveIntegerField()
+    received = models.PositiveIntegerField(default=0)
+    # Read from the image header as soon as it has arrived
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=OPEN)
+    # Sent by the client straight to storage (backend/direct_uploads.py), not in chunks
+    direct = models.BooleanField(default=False)
+    storage_name = models.CharField(max_length=512, blank=True)
+    # The Product or Comment created on finalize
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.filename + " - " + self.status
+
+
 class Comment(models.Model):
     user_email = models.CharField(max_length=256)
     image = models.ImageField(upload_to='uploads/comments/')
     text = models.TextField(blank=True)
     visible = models.BooleanField(default=False)
+    # Small WebP/JPEG versions of image, built in the background (backend/images.py)
+    image_thumbnail = models.ImageField(upload_to='uploads/renditions/comments/', blank=True)
+    image_list = models.ImageField(upload_to='uploads/renditions/comments/', blank=True)
+    image_detail = models.ImageField(upload_to='uploads/renditions/comments/', blank=True)
 
     class Meta:
         indexes = [
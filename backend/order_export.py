@@ -0,0 +1,150 @@
+"""
+Streaming order export for accounting, see the "Export" actions of
+OrderAdmin and ``manage.py export_orders``.
+
+One row per order with its product variation, product, category, color,
+lettering items and payment. The total price is the price snapshot of the
+order, computed in SQL for older orders without one
+(``Order.objects.with_total_price()``), the lettering items of a chunk of
+orders are fetched with one query per chunk, so the number of queries grows
+with the number of chunks, not of orders.
+
+Rows are read in pages of ``chunk_size`` orders by primary key (``WHERE id
+> <last id of the previous page> ORDER BY id LIMIT chunk_size``), each page
+a separate statement well within ``statement_timeout``. No transaction or
+cursor stays open between chunks, so a client that goes away halfway
+through a streamed export leaves nothing behind, and it works the same
+behind PgBouncer (``DB_PGBOUNCER``). Memory holds one chunk, whatever the
+number of orders.
+
+Formats:
+    csv       one line per order
+    jsonl     one JSON object per order
+    columnar  one JSON object per chunk of orders: the column names once and
+              one array of values per column, like a Parquet row group.
+              Smaller than jsonl and quick to load into a dataframe.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from django.db.models.functions import Coalesce
+
+from .models import LetteringItemVariation
+
+COLUMNS = [
+    ('order_id', 'id'),
+    ('ordered_date', 'ordered_date'),
+    ('ordered', 'ordered'),
+    ('user_email', 'user_email'),
+    ('user_first_name', 'user_first_name'),
+    ('user_last_name', 'user_last_name'),
+    ('address1', 'address1'),
+    ('address2', 'address2'),
+    ('comment', 'comment'),
+    ('product_variation_id', 'product_id'),
+    ('amount', 'product__amount'),
+    ('product_id', 'product__product_id'),
+    ('product_title', 'product__product__title'),
+    ('category', 'product__product__category__title'),
+    ('base_price', 'product__product__category__base_price'),
+    ('color', 'product__product_color__color_nickname'),
+    ('total_price', 'total_price'),
+    ('priced_at', 'priced_at'),
+    ('payment_id', 'payment_id'),
+    ('stripe_charge_id', 'payment__stripe_charge_id'),
+    # Stripe amount, in cents
+    ('payment_amount', 'payment__amount'),
+    ('payment_timestamp', 'payment__timestamp'),
+]
+# Filled in per chunk from LetteringItemVariation
+LETTERING_COLUMNS = ['lettering', 'lettering_price']
+COLUMN_NAMES = [name for name, lookup in COLUMNS] + LETTERING_COLUMNS
+
+FORMATS = ('csv', 'jsonl', 'columnar')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'columnar': 'application/x-ndjson',
+}
+EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'columnar': 'columnar.jsonl'}
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_chunks(queryset, chunk_size=2000, on_chunk=None):
+    """
+    Yields lists of up to ``chunk_size`` export rows (dicts) for the orders
+    in ``queryset``. ``on_chunk(number of rows)`` is called for each.
+    """
+    if 'total_price' not in queryset.query.annotations:
+        queryset = queryset.with_total_price()
+    rows = queryset.order_by('pk').values_list(*[lookup for name, lookup in COLUMNS])
+
+    last = None
+    while True:
+        page = list((rows if last is None else rows.filter(pk__gt=last))[:chunk_size])
+        if page:
+            if on_chunk:
+                on_chunk(len(page))
+            yield add_lettering([dict(zip((name for name, lookup in COLUMNS), map(_value, values))) for values in page])
+        if len(page) < chunk_size:
+            return
+        # The primary key is the first column
+        last = page[-1][0]
+
+
+def add_lettering(chunk):
+    """
+    Adds the lettering items of every order in ``chunk``, with one query.
+    """
+    variation_ids = {row['product_variation_id'] for row in chunk if row['product_variation_id'] is not None}
+    lettering = {}
+    items = LetteringItemVariation.objects.filter(product_variation_id__in=variation_ids).order_by(
+        'product_variation_id', 'pk',
+    ).values_list('product_variation_id', 'lettering_item_category__title', 'lettering',
+                  Coalesce('price', 'lettering_item_category__price'))
+    for variation_id, title, text, price in items:
+        texts, total = lettering.get(variation_id, ([], 0.0))
+        texts.append('%s: %s' % (title or '---', text))
+        lettering[variation_id] = (texts, total + (price or 0.0))
+    for row in chunk:
+        texts, total = lettering.get(row['product_variation_id'], ([], 0.0))
+        row['lettering'] = ' | '.join(texts)
+        row['lettering_price'] = total
+    return chunk
+
+
+def iter_export(queryset, file_format, chunk_size=2000, on_chunk=None):
+    """
+    Yields the export of ``queryset`` as strings, one chunk of orders at a
+    time, for a StreamingHttpResponse or a file.
+    """
+    if file_format not in FORMATS:
+        raise ValueError("Unknown format %r, choose from %s" % (file_format, ', '.join(FORMATS)))
+    if file_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, COLUMN_NAMES)
+        writer.writeheader()
+        for chunk in iter_chunks(queryset, chunk_size, on_chunk):
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # The header alone when there are no orders
+        yield buffer.getvalue()
+    elif file_format == 'jsonl':
+        for chunk in iter_chunks(queryset, chunk_size, on_chunk):
+            yield ''.join(json.dumps(row) + '\n' for row in chunk)
+    else:
+        for chunk in iter_chunks(queryset, chunk_size, on_chunk):
+            yield json.dumps({
+                'rows': len(chunk),
+                'columns': COLUMN_NAMES,
+                'data': [[row[name] for row in chunk] for name in COLUMN_NAMES],
+            }) + '\n'
@@ -0,0 +1,188 @@
+"""
+Purchase emails, sent in the background from an outbox table.
+
+``charge_order`` writes the purchase confirmation (and the notification to
+``EMAIL_ADMIN``) as ``OutboxEmail`` rows in the transaction that marks the
+order as paid, so they exist exactly when the payment does and checkout
+never waits for the mail server. ``manage.py send_emails`` picks up due
+rows, renders ``purchase-made.html`` / ``admin-purchase-made.html`` and
+sends a batch over one SMTP connection, reused across batches while there
+is work. Each template is rendered once per batch with placeholders
+(``PreparedTemplate``), the emails of the batch only fill in their values.
+
+A batch is claimed by moving ``next_attempt`` of its rows ``LEASE`` into
+the future (with SKIP LOCKED where the database has it), so several workers
+don't send the same email, and the rows of a worker that died are picked up
+again once the lease ran out. A failed email is retried after
+``EMAIL_OUTBOX_RETRY_DELAY`` seconds, doubling with every attempt, and
+given up on (``failed``) after ``EMAIL_OUTBOX_MAX_ATTEMPTS``.
+"""
+import logging
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import connection as db_connection, models, transaction
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import escape, strip_tags
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+# Long enough for a batch over a slow SMTP server
+LEASE = timedelta(minutes=10)
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+# Template, subject and the names of its context, see get_context()
+TEMPLATES = {
+    OutboxEmail.PURCHASE: ('purchase-made.html', "Purchase made.", ('user', 'image', 'amount_of_product', 'total_amount')),
+    OutboxEmail.ADMIN_PURCHASE: ('admin-purchase-made.html', "Purchase made.", ('user', 'order', 'current_admin_domain')),
+}
+
+# Rendered in place of a context value, the "&" after it tells whether the template escaped it
+PLACEHOLDER = '\x00%s\x00&'
+PLACEHOLDER_RE = re.compile('\x00(\\w+)\x00(&amp;|&)')
+
+
+class PreparedTemplate:
+    """
+    A template rendered once with placeholders for the context ``names``,
+    render() then only joins the parts with the values of an email. A
+    template that does more with a value than print it (a filter or a tag)
+    mangles its placeholder and is rendered in full for every email.
+    """
+
+    def __init__(self, template_name, names):
+        self.template = get_template(template_name)
+        html = self.template.render({name: PLACEHOLDER % name for name in names})
+        self.html_parts = self.split(html)
+        self.text_parts = self.split(strip_tags(html))
+
+    @staticmethod
+    def split(rendered):
+        # [text, name, escaped, text, name, escaped, ..., text]
+        parts = PLACEHOLDER_RE.split(rendered)
+        if any('\x00' in text for text in parts[::3]):
+            return None
+        return parts
+
+    @staticmethod
+    def fill(parts, context):
+        filled = []
+        for i in range(0, len(parts) - 1, 3):
+            value = str(context[parts[i + 1]])
+            filled.append(parts[i])
+            filled.append(escape(value) if parts[i + 2] == '&amp;' else value)
+        filled.append(parts[-1])
+        return ''.join(filled)
+
+    def render(self, context):
+        """
+        Returns the HTML and the plain text version.
+        """
+        if self.html_parts is None or self.text_parts is None:
+            html = self.template.render(context)
+            return html, strip_tags(html).strip()
+        return self.fill(self.html_parts, context), self.fill(self.text_parts, context).strip()
+
+
+def queue_purchase_emails(order):
+    """
+    Writes the emails for a paid order, call it in the transaction that
+    marks the order as paid. One query.
+    """
+    emails = [OutboxEmail(kind=OutboxEmail.PURCHASE, to_email=order.user_email, order=order)]
+    admin_email = getattr(settings, 'EMAIL_ADMIN', None)
+    if admin_email:
+        emails.append(OutboxEmail(kind=OutboxEmail.ADMIN_PURCHASE, to_email=admin_email, order=order))
+    OutboxEmail.objects.bulk_create(emails)
+
+
+def get_context(email):
+    order = email.order
+    if email.kind == OutboxEmail.ADMIN_PURCHASE:
+        return {
+            'user': order.user_email,
+            'order': order.id,
+            'current_admin_domain': getattr(settings, 'CURRENT_ADMIN_DOMAIN', ''),
+        }
+    variation = order.product
+    return {
+        'user': order.user_email,
+        'image': variation.product.image if variation is not None and variation.product is not None else None,
+        'amount_of_product': str(variation.amount if variation is not None else 0),
+        'total_amount': "{:.2f}".format(order.get_total_price() if variation is not None else 0.0),
+    }
+
+
+def render_email(email, templates, connection=None):
+    """
+    ``templates`` keeps the PreparedTemplate of each kind, pass the same
+    dict for all emails of a batch.
+    """
+    template_name, subject, names = TEMPLATES[email.kind]
+    if email.kind not in templates:
+        templates[email.kind] = PreparedTemplate(template_name, names)
+    html, text = templates[email.kind].render(get_context(email))
+    message = EmailMultiAlternatives(subject, text, to=[email.to_email], connection=connection)
+    message.attach_alternative(html, "text/html")
+    return message
+
+
+def retry_delay(attempts):
+    return min(settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def claim(batch_size):
+    """
+    Leases up to ``batch_size`` due emails to this worker and returns them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt__lte=now).order_by('next_attempt')
+        if db_connection.features.has_select_for_update_skip_locked:
+            # Rows another worker is claiming right now are left to it
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        OutboxEmail.objects.filter(pk__in=ids).update(attempts=models.F('attempts') + 1, next_attempt=now + LEASE)
+    return list(OutboxEmail.objects.filter(pk__in=ids).select_related(
+        'order__product__product__category',
+    ).order_by('pk'))
+
+
+def deliver(connection, batch_size=None):
+    """
+    Sends one batch of due emails over ``connection`` (an open email
+    backend) and returns (sent, failed).
+    """
+    emails = claim(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    sent, failed = [], []
+    templates = {}
+    for email in emails:
+        try:
+            # No-op while the connection is open, reconnects after a failure
+            connection.open()
+            connection.send_messages([render_email(email, templates, connection)])
+        except Exception as exc:
+            logger.warning("Email %s to %s failed: %r", email.pk, email.to_email, exc)
+            # The next email starts over with a fresh connection
+            connection.close()
+            email.last_error = repr(exc)[:512]
+            if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                email.status = OutboxEmail.FAILED
+            else:
+                email.next_attempt = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+            failed.append(email)
+        else:
+            sent.append(email.pk)
+
+    if sent:
+        OutboxEmail.objects.filter(pk__in=sent).update(status=OutboxEmail.SENT, sent=timezone.now(), last_error='')
+    if failed:
+        OutboxEmail.objects.bulk_update(failed, ['status', 'next_attempt', 'last_error'])
+    return len(sent), len(failed)
@@ -0,0 +1,36 @@
+"""
+Pagination for the listings that grow with the catalog.
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key.
+
+    Every page is a single ``WHERE id > cursor ORDER BY id LIMIT n`` query,
+    so response time and memory stay flat however many products customers
+    upload. Off by default, existing clients expect the full list: clients
+    opt in with ``?paginate=true`` (kept in the next/previous links), or
+    everyone with ``CATALOG_PAGINATION = True``, when ``?paginate=false``
+    still gets the full list.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    opt_out_query_param = 'paginate'
+
+    def is_enabled(self, request):
+        value = request.query_params.get(self.opt_out_query_param, '').lower()
+        if value in ('1', 'true', 'yes'):
+            return True
+        if value in ('0', 'false', 'no'):
+            return False
+        return getattr(settings, 'CATALOG_PAGINATION', False)
+
+    def get_page_size(self, request):
+        if not self.is_enabled(request):
+            return None
+        self.page_size = getattr(settings, 'CATALOG_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'CATALOG_MAX_PAGE_SIZE', 200)
+        return super().get_page_size(request)
@@ -0,0 +1,262 @@
+"""
+Stripe payment processing.
+
+``charge_order`` is the payment itself and is used by both modes of
+``PaymentView``:
+
+- sync (default): the request thread talks to Stripe and answers 200/400.
+- async (``PAYMENT_ASYNC = True`` or a ``Prefer: respond-async`` header): the
+  request stores a ``PaymentJob``, answers 202 with a status URL, and a pool
+  of ``PAYMENT_WORKERS`` threads talks to Stripe, so gunicorn workers are
+  not parked on the Stripe round trip during checkout spikes.
+
+Under ASGI (truck_signs_designs/asgi.py) the sync mode runs
+``acharge_order`` instead, which awaits Stripe on the event loop.
+
+Card details are passed to the pool in memory and never written anywhere,
+so a job can't be picked up again by another process: the pool lives in
+the gunicorn worker, and a job that was queued or running when that worker
+died or restarted stays ``pending``/``processing``. ``manage.py
+fail_stale_payment_jobs`` marks such jobs as failed after
+``STALE_JOB_AFTER``, and the client submits the payment again. With the same
+Idempotency-Key header Stripe gets the same idempotency key, so a charge
+that went through before the worker died is not made twice.
+
+Every charge, whichever path it comes from, first claims the order with a
+conditional UPDATE (``claim_order``) before Stripe is called: an order that
+is already paid is refused with ``OrderAlreadyPaid``, one another payment is
+running for with ``PaymentInProgress``. No lock is held during the Stripe
+calls. The claim is dropped when the charge fails, and taken to be from a
+process that died after ``STALE_JOB_AFTER``. ``mark_paid`` locks the order
+and checks it again.
+"""
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import stripe
+
+from . import async_stripe
+from .background import submit_on_commit
+from .models import LetteringItemVariation, Order, Payment, PaymentJob, ProductVariation
+from .outbox import queue_purchase_emails
+from .reporting import record_sale
+
+logger = logging.getLogger(__name__)
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+# Points the client at the local fake Stripe server (manage.py run_fake_stripe)
+if getattr(settings, 'STRIPE_API_BASE', None):
+    stripe.api_base = settings.STRIPE_API_BASE
+
+CARD_FIELDS = ('card_num', 'exp_month', 'exp_year', 'cvc')
+
+# Longer than a job can take (two Stripe calls of at most 80s each)
+STALE_JOB_AFTER = timedelta(minutes=5)
+
+
+class OrderAlreadyPaid(Exception):
+    pass
+
+
+class PaymentInProgress(Exception):
+    pass
+
+
+PAYMENT_ERRORS = [
+    (OrderAlreadyPaid, "Order is already paid"),
+    (PaymentInProgress, "A payment of this order is already in progress"),
+    (stripe.error.CardError, "Error with card during payment"),
+    (stripe.error.RateLimitError, "Rate Limit error during payment"),
+    (stripe.error.InvalidRequestError, "Invalid request error during payment"),
+    (stripe.error.AuthenticationError, "Authentication error during payment"),
+    (stripe.error.APIConnectionError, "API connection error during payment"),
+    (stripe.error.StripeError, "Something went wrong during payment"),
+]
+
+# Stripe didn't get to decide on the charge, the same payment may be tried again
+RETRYABLE_ERRORS = (PaymentInProgress, stripe.error.RateLimitError, stripe.error.APIConnectionError)
+
+
+def payment_error_message(exc):
+    for error_class, message in PAYMENT_ERRORS:
+        if isinstance(exc, error_class):
+            return message
+    return "Error during payment"
+
+
+def get_card(data):
+    """
+    Extracts the card details from the request data, raises KeyError if one is missing.
+    """
+    return {field: data[field] for field in CARD_FIELDS}
+
+
+def card_params(card):
+    return {
+        "number": card['card_num'],
+        "exp_month": int(card['exp_month']),
+        "exp_year": int(card['exp_year']),
+        "cvc": card['cvc']
+    }
+
+
+def get_amount(order):
+    """
+    The amount to charge, in cents.
+    """
+    if order.total is None and order.product_id is not None:
+        # Ordered before prices were frozen at checkout, frozen now at the price charged
+        freeze_price(order)
+    return int(order.get_total_price() * 100)
+
+
+def check_unpaid(order):
+    """
+    Locks the order row until the end of the transaction and raises
+    OrderAlreadyPaid if the order was paid in the meantime.
+    """
+    if Order.objects.select_for_update().filter(pk=order.pk, ordered=True).exists():
+        raise OrderAlreadyPaid(order.pk)
+
+
+def claim_order(order):
+    """
+    Marks the payment of the order as started, raises OrderAlreadyPaid or
+    PaymentInProgress if it can't be charged now. One query when it can.
+    """
+    now = timezone.now()
+    claimed = Order.objects.filter(
+        Q(payment_started__isnull=True) | Q(payment_started__lt=now - STALE_JOB_AFTER),
+        pk=order.pk, ordered=False,
+    ).update(payment_started=now)
+    if not claimed:
+        if Order.objects.filter(pk=order.pk, ordered=True).exists():
+            raise OrderAlreadyPaid(order.pk)
+        raise PaymentInProgress(order.pk)
+    order.payment_started = now
+
+
+def release_order(order):
+    """
+    Drops the claim of claim_order() after a failed charge.
+    """
+    Order.objects.filter(pk=order.pk, payment_started=order.payment_started).update(payment_started=None)
+    order.payment_started = None
+
+
+def charge_order(order, card, idempotency_key=None):
+    """
+    Charges the order total on the card and marks the order as paid.
+    With ``idempotency_key`` Stripe answers a repeated call with the token and
+    charge of the first one instead of charging again.
+    """
+    claim_order(order)
+    try:
+        token = stripe.Token.create(
+            card=card_params(card),
+            idempotency_key=idempotency_key and idempotency_key + ':token',
+        )
+        amount = get_amount(order)
+        charge = stripe.Charge.create(
+            amount=amount,
+            currency="usd",
+            source=token,
+            idempotency_key=idempotency_key and idempotency_key + ':charge',
+        )
+    except Exception:
+        release_order(order)
+        raise
+    return mark_paid(order, charge['id'], amount)
+
+
+async def acharge_order(order, card, idempotency_key=None):
+    """
+    charge_order() for async views: the event loop waits for Stripe instead
+    of a thread, the queries still run in the sync thread.
+    """
+    await sync_to_async(claim_order)(order)
+    try:
+        token = await async_stripe.create_token(
+            card_params(card),
+            idempotency_key=idempotency_key and idempotency_key + ':token',
+        )
+        amount = await sync_to_async(get_amount)(order)
+        charge = await async_stripe.create_charge(
+            amount=amount,
+            currency="usd",
+            source=token['id'],
+            idempotency_key=idempotency_key and idempotency_key + ':charge',
+        )
+    except Exception:
+        await sync_to_async(release_order)(order)
+        raise
+    return await sync_to_async(mark_paid)(order, charge['id'], amount)
+
+
+def mark_paid(order, stripe_charge_id, amount):
+    with transaction.atomic():
+        check_unpaid(order)
+        payment = Payment(user_email=order.user_email, stripe_charge_id=stripe_charge_id, amount=amount)
+        payment.save()
+        order.ordered = True
+        order.payment = payment
+        order.payment_started = None
+        order.save()
+        record_sale(order, payment)
+        # Sent by manage.py send_emails, checkout doesn't wait for the mail server
+        queue_purchase_emails(order)
+    return payment
+
+
+def freeze_price(order):
+    """
+    Stores the price snapshot of an order created without one, from the
+    current prices of its category and lettering items.
+    """
+    variation = order.product = ProductVariation.objects.select_related('product__category').get(pk=order.product_id)
+    lettering_items = list(variation.lettering_item_variation_set.select_related('lettering_item_category'))
+    variation.set_price_snapshot(lettering_items)
+    with transaction.atomic():
+        variation.save(update_fields=['base_price', 'unit_price', 'total'])
+        LetteringItemVariation.objects.bulk_update(lettering_items, ['price'])
+        order.set_price_snapshot()
+        order.save(update_fields=['total', 'priced_at'])
+
+
+def enqueue_payment(order, card, idempotency_key=None):
+    """
+    Stores a pending job for the order and hands it to the worker pool once
+    the surrounding transaction (if any) has committed. The job charges with
+    ``idempotency_key``, or one of its own without.
+    """
+    job = PaymentJob(order=order)
+    job.idempotency_key = idempotency_key or 'payment-job-%s' % job.token
+    job.save()
+    submit_on_commit('payment', getattr(settings, 'PAYMENT_WORKERS', 4), run_payment_job, job.pk, card)
+    return job
+
+
+def run_payment_job(job_id, card):
+    try:
+        PaymentJob.objects.filter(pk=job_id).update(status=PaymentJob.PROCESSING)
+        job = PaymentJob.objects.get(pk=job_id)
+        order = Order.objects.get(pk=job.order_id)
+        try:
+            payment = charge_order(order, card, idempotency_key=job.idempotency_key)
+        except Exception as exc:
+            logger.warning("Payment job %s failed: %r", job_id, exc)
+            job.status = PaymentJob.FAILED
+            job.result = payment_error_message(exc)
+        else:
+            job.status = PaymentJob.SUCCEEDED
+            job.result = "Success"
+            job.payment = payment
+        job.save()
+    except Exception:
+        logger.exception("Payment job %s crashed", job_id)
@@ -0,0 +1,216 @@
+"""
+Sales reporting from precomputed daily rollups.
+
+``DailySales`` has one row per day and category, product, color or lettering
+item category with the number of paid orders, units and revenue. Reports
+read those rows, a few hundred for a year of one dimension, instead of
+walking Order -> ProductVariation -> LetteringItemVariation.
+
+The rows are kept up to date by ``record_sale``, which ``charge_order``
+calls in the transaction that marks the order as paid: the rows of the day
+are created if missing, locked, and updated with one bulk_update.
+``manage.py rebuild_sales_rollups`` recomputes them from the orders with a
+few GROUP BY queries, after orders were changed in the admin or to backfill.
+
+Revenue is what Stripe was charged (``Payment.amount`` is in cents); orders
+marked as paid without a payment count with their price snapshot (or the
+current total price, for orders from before snapshots). Lettering revenue
+uses the price of the items at checkout where it was stored. The day is the
+day of the payment.
+"""
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, TruncDate
+
+from .models import DailySales, LetteringItemVariation, Order, ProductVariation, total_price_expression
+
+
+def sale_rows(order, payment):
+    """
+    The rollup increments for one paid order: a list of
+    (dimension, key id, label, orders, units, revenue). Two queries, the
+    payment itself only loads the order.
+    """
+    revenue = payment.amount / 100.0
+    variation = ProductVariation.objects.filter(pk=order.product_id).values(
+        'amount', 'product_id', 'product__title', 'product__category_id', 'product__category__title',
+        'product_color_id', 'product_color__color_nickname',
+    ).first() if order.product_id is not None else None
+    variation = variation or {}
+    units = variation.get('amount') or 0
+    rows = [
+        (DailySales.CATEGORY, variation.get('product__category_id') or 0, variation.get('product__category__title') or '',
+         1, units, revenue),
+        (DailySales.PRODUCT, variation.get('product_id') or 0, variation.get('product__title') or '', 1, units, revenue),
+        (DailySales.COLOR, variation.get('product_color_id') or 0, variation.get('product_color__color_nickname') or '',
+         1, units, revenue),
+    ]
+    lettering = defaultdict(lambda: ['', 0, 0.0])
+    items = LetteringItemVariation.objects.filter(product_variation_id=order.product_id).values_list(
+        'lettering_item_category_id', 'lettering_item_category__title', 'price', 'lettering_item_category__price',
+    ) if order.product_id is not None else []
+    for category_id, title, price, category_price in items:
+        totals = lettering[category_id or 0]
+        totals[0] = title or ''
+        totals[1] += units
+        if price is None:
+            price = category_price or 0.0
+        totals[2] += price * units
+    for key_id, (label, lettering_units, lettering_revenue) in lettering.items():
+        rows.append((DailySales.LETTERING, key_id, label, 1, lettering_units, lettering_revenue))
+    return rows
+
+
+def record_sale(order, payment):
+    """
+    Adds a paid order to the rollups, call it in the transaction that marks
+    the order as paid. Five queries, however many rows are affected.
+    """
+    day = payment.timestamp.date()
+    increments = {}
+    for dimension, key_id, label, orders, units, revenue in sale_rows(order, payment):
+        increments[(dimension, key_id)] = (label, orders, units, revenue)
+    keys = sorted(increments)
+
+    # Creates the rows missing for the day, a concurrent payment doing the same waits for us
+    DailySales.objects.bulk_create(
+        [DailySales(day=day, dimension=dimension, key_id=key_id) for dimension, key_id in keys],
+        ignore_conflicts=True,
+    )
+    # Locked in a fixed order, so concurrent payments can't deadlock each other
+    condition = models.Q()
+    for dimension, key_id in keys:
+        condition |= models.Q(dimension=dimension, key_id=key_id)
+    rollups = list(DailySales.objects.select_for_update().filter(condition, day=day).order_by('pk'))
+    for rollup in rollups:
+        label, orders, units, revenue = increments[(rollup.dimension, rollup.key_id)]
+        rollup.label = label
+        rollup.orders += orders
+        rollup.units += units
+        rollup.revenue += revenue
+    DailySales.objects.bulk_update(rollups, ['label', 'orders', 'units', 'revenue'])
+
+
+def paid_orders():
+    return Order.objects.filter(ordered=True).annotate(
+        day=Coalesce(TruncDate('payment__timestamp'), TruncDate('ordered_date')),
+    )
+
+
+def order_revenue():
+    return models.Sum(Coalesce(
+        models.ExpressionWrapper(models.F('payment__amount') / 100.0, output_field=models.FloatField()),
+        models.F('total'),
+        total_price_expression('product', 'product__'),
+    ))
+
+
+def rebuild(since=None, until=None):
+    """
+    Recomputes the rollups of the days in [since, until) from the orders and
+    returns the number of rows written.
+    """
+    orders = paid_orders()
+    lettering = LetteringItemVariation.objects.filter(product_variation__order__ordered=True).annotate(
+        day=Coalesce(
+            TruncDate('product_variation__order__payment__timestamp'),
+            TruncDate('product_variation__order__ordered_date'),
+        ),
+    )
+    existing = DailySales.objects.all()
+    if since:
+        orders, lettering, existing = orders.filter(day__gte=since), lettering.filter(day__gte=since), existing.filter(day__gte=since)
+    if until:
+        orders, lettering, existing = orders.filter(day__lt=until), lettering.filter(day__lt=until), existing.filter(day__lt=until)
+
+    groups = [
+        (DailySales.CATEGORY, 'product__product__category_id', 'product__product__category__title'),
+        (DailySales.PRODUCT, 'product__product_id', 'product__product__title'),
+        (DailySales.COLOR, 'product__product_color_id', 'product__product_color__color_nickname'),
+    ]
+    rollups = []
+    for dimension, key, label in groups:
+        rows = orders.order_by().values('day', key, label).annotate(
+            num_orders=models.Count('pk'),
+            num_units=Coalesce(models.Sum('product__amount'), models.Value(0)),
+            total=order_revenue(),
+        )
+        for row in rows:
+            rollups.append(DailySales(
+                day=row['day'], dimension=dimension, key_id=row[key] or 0, label=row[label] or '',
+                orders=row['num_orders'], units=row['num_units'], revenue=row['total'] or 0.0,
+            ))
+    rows = lettering.order_by().values('day', 'lettering_item_category_id', 'lettering_item_category__title').annotate(
+        num_orders=models.Count('product_variation__order', distinct=True),
+        num_units=Coalesce(models.Sum('product_variation__amount'), models.Value(0)),
+        total=models.Sum(
+            Coalesce(models.F('price'), models.F('lettering_item_category__price'), models.Value(0.0))
+            * models.F('product_variation__amount'),
+            output_field=models.FloatField(),
+        ),
+    )
+    for row in rows:
+        rollups.append(DailySales(
+            day=row['day'], dimension=DailySales.LETTERING, key_id=row['lettering_item_category_id'] or 0,
+            label=row['lettering_item_category__title'] or '', orders=row['num_orders'], units=row['num_units'],
+            revenue=row['total'] or 0.0,
+        ))
+
+    with transaction.atomic():
+        existing.delete()
+        DailySales.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
+
+
+def sum_rollups(rollups, group):
+    """
+    Sums ``rollups`` over days, per ``group`` fields, best selling first.
+    """
+    totals = rollups.order_by().values(*group).annotate(
+        # Any one of the titles if it was renamed in between
+        last_label=models.Max('label'),
+        total_orders=models.Sum('orders'),
+        total_units=models.Sum('units'),
+        total_revenue=models.Sum('revenue'),
+    ).order_by('-total_revenue')
+    return [
+        dict(
+            {name: row[name] for name in group},
+            label=row['last_label'], orders=row['total_orders'], units=row['total_units'],
+            revenue=row['total_revenue'],
+        )
+        for row in totals
+    ]
+
+
+def report(dimension, since=None, until=None, by_day=False):
+    """
+    Sales per category/product/... of the days in [since, until), summed over
+    the whole range or per day.
+    """
+    rollups = DailySales.objects.filter(dimension=dimension)
+    if since:
+        rollups = rollups.filter(day__gte=since)
+    if until:
+        rollups = rollups.filter(day__lt=until)
+    if by_day:
+        return list(rollups.order_by('day', '-revenue').values(
+            'day', 'key_id', 'label', 'orders', 'units', 'revenue',
+        ))
+    return sum_rollups(rollups, ['key_id'])
+
+
+def summarize(rollups, top=10):
+    """
+    The ``top`` best selling categories, products, ... among ``rollups``,
+    as [(dimension label, rows)], with one query.
+    """
+    by_dimension = defaultdict(list)
+    for row in sum_rollups(rollups, ['dimension', 'key_id']):
+        by_dimension[row['dimension']].append(row)
+    return [
+        (label, by_dimension[dimension][:top])
+        for dimension, label in DailySales.DIMENSION_CHOICES
+        if by_dimension[dimension]
+    ]
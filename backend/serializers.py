@@ -33,7 +33,7 @@ class LetteringItemVariationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = LetteringItemVariation
-        fields = ('lettering_item_category', 'lettering', 'id')
+        fields = ('lettering_item_category', 'lettering', 'price', 'id')
 
 
 class LetteringItemVariationSimpleSerializer(serializers.ModelSerializer):
@@ -61,6 +61,10 @@ class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     image = serializers.ImageField(use_url=True)
     detail_image = serializers.ImageField(use_url=True)
+    # Filled in by the image worker after the upload, null until then
+    image_thumbnail = serializers.ImageField(use_url=True, read_only=True)
+    image_list = serializers.ImageField(use_url=True, read_only=True)
+    image_detail = serializers.ImageField(use_url=True, read_only=True)
 
     class Meta:
         model = Product
@@ -77,16 +81,15 @@ class ProductVariationSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField('get_total_price')
 
     def get_total_price(self, obj):
-        items = obj.get_all_lettering_items()
-        price = obj.product.category.base_price
-        for item in items:
-            price += item.lettering_item_category.price
-        price = price * obj.amount
-        return price
+        # The price snapshot, or for older rows the SQL annotation from
+        # with_total_price() or the prefetched items
+        return obj.get_total_price()
 
     class Meta:
         model = ProductVariation
         fields = '__all__'
+        # Price snapshot, set at checkout
+        read_only_fields = ('base_price', 'unit_price', 'total')
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -107,7 +110,10 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = '__all__'
+        # Internal to the payment, see backend/payments.py
+        exclude = ('payment_started',)
+        # Price snapshot, set at checkout
+        read_only_fields = ('total', 'priced_at')
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -115,6 +121,10 @@ class CommentSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(required=True)
     image = serializers.ImageField(use_url=True)
     text = serializers.CharField(required=False)
+    # Filled in by the image worker after the upload, null until then
+    image_thumbnail = serializers.ImageField(use_url=True, read_only=True)
+    image_list = serializers.ImageField(use_url=True, read_only=True)
+    image_detail = serializers.ImageField(use_url=True, read_only=True)
 
     class Meta:
         model = Comment
@@ -0,0 +1,43 @@
+"""
+Cache invalidation for the catalog models.
+
+Any save or delete, whether it comes from the admin, a customer upload or a
+management command, bumps the generation counter of the model. Cache keys
+built with ``backend.caching.generation_cache_key`` change with it.
+
+Note that ``QuerySet.update()`` and ``bulk_create()`` do not send signals,
+code using them has to call ``bump_generation`` itself.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from .caching import bump_generation
+from .models import Category, Product, ProductColor, LetteringItemCategory, Comment
+
+
+CACHED_MODELS = (Category, Product, ProductColor, LetteringItemCategory, Comment)
+
+
+def invalidate_model_cache(sender, **kwargs):
+    # Wait for the commit, otherwise a concurrent request could cache the old
+    # rows again under the new generation.
+    transaction.on_commit(lambda: bump_generation(sender))
+
+
+def invalidate_m2m_cache(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_generation(instance.__class__))
+        transaction.on_commit(lambda: bump_generation(model))
+
+
+def connect_cache_signals():
+    for model in CACHED_MODELS:
+        uid = 'backend.cache.%s' % model._meta.label_lower
+        post_save.connect(invalidate_model_cache, sender=model, dispatch_uid=uid + '.save')
+        post_delete.connect(invalidate_model_cache, sender=model, dispatch_uid=uid + '.delete')
+        for field in model._meta.many_to_many:
+            m2m_changed.connect(
+                invalidate_m2m_cache,
+                sender=field.remote_field.through,
+                dispatch_uid='%s.%s.m2m' % (uid, field.name),
+            )
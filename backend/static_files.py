@@ -0,0 +1,37 @@
+"""
+WhiteNoise for both entry points.
+
+WhiteNoise's middleware is sync only, and Django runs everything below a
+sync middleware synchronously: under ASGI the async views would hold the
+sync thread of the process while they await Stripe, one checkout at a
+time. This one is sync and async, the static file lookup is the same.
+"""
+import asyncio
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks for the file on disk
+            response = await sync_to_async(self.process_request, thread_sensitive=False)(request)
+        else:
+            response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
@@ -1,3 +1,1135 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+import stripe
+from PIL import Image
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.template.loader import get_template, render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from . import async_stripe, background
+from .async_views import AsyncPaymentView, async_catalog_view
+from .caching import _modified_key, bump_generation, reset_template_versions, template_version
+from .catalog_io import CATALOG_TYPES, FORMATS, export_rows
+from .db_routing import PIN_COOKIE, REPLICA_DB_ALIAS
+from .fake_stripe import FakeStripeServer
+from .fast_serializers import get_field_plan
+from .metrics import cache_is_shared, histogram, percentile
+from .images import RENDITIONS, build_renditions, make_rendition, rendition_field, rendition_format
+from .models import *
+from .order_export import COLUMN_NAMES, iter_export
+from .outbox import PreparedTemplate
+from .payments import (
+    STALE_JOB_AFTER, OrderAlreadyPaid, PaymentInProgress, acharge_order, charge_order, enqueue_payment, get_card,
+    mark_paid,
+)
+from .reporting import rebuild
+from .serializers import *
+from .views import CategoryListView, ProductListView
+
+
+class FastSerializerParityTests(TestCase):
+    """
+    The compiled field plans must render exactly the same JSON as the DRF
+    serializers they replace on the read paths.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.truck_sign = Category.objects.create(
+            title='Truck Sign', image='uploads/categories/truck.png', base_price=45.5,
+            max_amount_of_lettering_items=5, height=12.0, width=24.25,
+        )
+        cls.empty_category = Category.objects.create(title='Empty', image='', base_price=0.1)
+        cls.logo = Product.objects.create(
+            category=cls.truck_sign, title='Logo', image='uploads/products/logo.png',
+            detail_image='uploads/products_detail/logo.png',
+        )
+        cls.upload = Product.objects.create(category=cls.truck_sign, title='Customer Image', is_uploaded=True)
+        cls.color = ProductColor.objects.create(color_in_hex='#ff0000', color_nickname='Red')
+        cls.mc = LetteringItemCategory.objects.create(title='MC', price=2.2)
+        cls.usdot = LetteringItemCategory.objects.create(title='USDOT', price=3.3)
+
+        cls.variation = ProductVariation.objects.create(product=cls.logo, product_color=cls.color, amount=3)
+        LetteringItemVariation.objects.create(lettering_item_category=cls.mc, lettering='MC 123', product_variation=cls.variation)
+        LetteringItemVariation.objects.create(lettering_item_category=cls.usdot, lettering='DOT 456', product_variation=cls.variation)
+        cls.bare_variation = ProductVariation.objects.create(product=cls.upload)
+        cls.order = Order.objects.create(user_email='driver@example.com', product=cls.variation, comment='Rush')
+        cls.bare_order = Order.objects.create(user_email='other@example.com', product=cls.bare_variation, address2=None)
+
+        Comment.objects.create(user_email='a@example.com', image='uploads/comments/a.png', text='Great', visible=True)
+        Comment.objects.create(user_email='b@example.com', image='uploads/comments/b.png')
+
+    def setUp(self):
+        self.request = Request(APIRequestFactory().get('/api/'))
+
+    def assertParity(self, serializer_class, instances, **kwargs):
+        for request in (self.request, None):
+            context = {'request': request} if request is not None else {}
+            expected = serializer_class(instances, context=context, **kwargs).data
+            plan = get_field_plan(serializer_class)
+            if kwargs.get('many'):
+                actual = plan.serialize_many(instances, request)
+            else:
+                actual = plan.serialize(instances, request)
+            self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_category(self):
+        queryset = Category.objects.prefetch_related('product_set')
+        self.assertParity(CategorySerializer, queryset, many=True)
+
+    def test_lettering_item_category(self):
+        self.assertParity(LetteringItemCategorySerializer, LetteringItemCategory.objects.all(), many=True)
+
+    def test_product_color(self):
+        self.assertParity(ProductColorSerializer, ProductColor.objects.all(), many=True)
+
+    def test_product(self):
+        self.assertParity(ProductSerializer, Product.objects.select_related('category'), many=True)
+        self.assertParity(ProductSerializer, self.upload)
+
+    def test_product_variation(self):
+        for variation in (self.variation, self.bare_variation):
+            self.assertParity(ProductVariationSerializer, variation)
+
+    def test_order(self):
+        for order in (self.order, self.bare_order):
+            self.assertParity(OrderSerializer, order)
+
+    def test_comment(self):
+        self.assertParity(CommentSerializer, Comment.objects.all(), many=True)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'backend.cache_backends.FakeSharedCache', 'LOCATION': 'cache-backend-tests'},
+    'same-server': {'BACKEND': 'backend.cache_backends.FakeSharedCache', 'LOCATION': 'cache-backend-tests'},
+    'other-server': {'BACKEND': 'backend.cache_backends.FakeSharedCache', 'LOCATION': 'cache-backend-tests-2'},
+    'tiered': {
+        'BACKEND': 'backend.cache_backends.TwoTierCache',
+        'OPTIONS': {'SHARED_ALIAS': 'shared', 'LOCAL_MAX_ENTRIES': 2, 'LOCAL_TIMEOUT': 60},
+    },
+})
+class CacheBackendTests(SimpleTestCase):
+    """
+    TwoTierCache and FakeSharedCache (backend/cache_backends.py). A value
+    changed behind the local tier's back shows whether it was served locally.
+    """
+
+    def setUp(self):
+        self.shared, self.tiered = caches['shared'], caches['tiered']
+        self.tiered.clear()
+
+    def test_local_lru(self):
+        self.tiered.set('response:a', 1)
+        self.tiered.set('response:b', 2)
+        self.tiered.get('response:a')
+        # The least recently used one goes
+        self.tiered.set('response:c', 3)
+        self.shared.set('response:a', 'changed')
+        self.shared.set('response:b', 'changed')
+        self.assertEqual(self.tiered.get('response:a'), 1)
+        self.assertEqual(self.tiered.get('response:b'), 'changed')
+
+    def test_local_expiry(self):
+        self.tiered.set('response:a', 1, timeout=30)
+        self.tiered.set('response:b', 1)
+        self.shared.set('response:a', 'changed', timeout=None)
+        self.shared.set('response:b', 'changed')
+        self.assertEqual((self.tiered.get('response:a'), self.tiered.get('response:b')), (1, 1))
+        # The shorter of the timeout and LOCAL_TIMEOUT
+        with mock.patch('time.time', return_value=time.time() + 31):
+            self.assertEqual((self.tiered.get('response:a'), self.tiered.get('response:b')), ('changed', 1))
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(self.tiered.get('response:b'), 'changed')
+
+    def test_only_response_keys_local(self):
+        # Generation counters and everything else always come from the shared cache
+        self.tiered.set('generation:a', 1)
+        self.shared.set('generation:a', 2)
+        self.assertEqual(self.tiered.get('generation:a'), 2)
+        self.assertEqual(self.tiered.incr('generation:a'), 3)
+        self.assertEqual(self.tiered._local, {})
+
+    def test_incr_missing_key(self):
+        for cache_alias in ('shared', 'tiered'):
+            with self.subTest(cache_alias=cache_alias), self.assertRaises(ValueError):
+                caches[cache_alias].incr('missing')
+
+    def test_aliases_share_server(self):
+        self.shared.set('key', {'value': 1})
+        self.assertEqual(caches['same-server'].get('key'), {'value': 1})
+        self.assertIsNone(caches['other-server'].get('key'))
+        caches['same-server'].delete('key')
+        self.assertIsNone(self.shared.get('key'))
+
+
+def make_catalog(products=300, orders=30, lettering_items=10, comments=100, suffix=''):
+    """
+    Seeds a realistic catalog in a handful of bulk inserts: the "Truck Sign"
+    category plus a few others, ``products`` products spread over them,
+    ``orders`` orders with ``lettering_items`` lettering items each, and
+    ``comments`` comments of which every other one is visible.
+    """
+    truck_sign = Category.objects.filter(title='Truck Sign').first() or Category.objects.create(
+        title='Truck Sign', image='uploads/categories/truck.png', base_price=45.5, max_amount_of_lettering_items=10,
+    )
+    categories = [truck_sign] + [
+        Category.objects.create(title='Category %s%d' % (suffix, i), image='uploads/categories/c.png', base_price=10 * i)
+        for i in range(1, 4)
+    ]
+    # bulk_create() only sets primary keys on PostgreSQL, rows referenced below are created one by one
+    colors = [
+        ProductColor.objects.create(color_in_hex='#%06x' % (i * 0x111111), color_nickname='Color %s%d' % (suffix, i))
+        for i in range(5)
+    ]
+    lettering_categories = [
+        LetteringItemCategory.objects.create(title='Lettering %s%d' % (suffix, i), price=1.5 * i)
+        for i in range(6)
+    ]
+    Product.objects.bulk_create([
+        Product(
+            category=categories[i % len(categories)], title='Product %s%d' % (suffix, i),
+            image='uploads/products/p%d.png' % i, detail_image='uploads/products_detail/p%d.png' % i,
+            is_uploaded=(i % 10 == 0),
+        )
+        for i in range(products)
+    ])
+    product_list = list(Product.objects.select_related('category').order_by('-id')[:products])
+
+    for i in range(orders):
+        variation = ProductVariation(
+            product=product_list[i % len(product_list)], product_color=colors[i % len(colors)], amount=i % 3 + 1,
+        )
+        items = make_lettering_items(lettering_items, lettering_categories)
+        # Priced at checkout like CreateOrder does
+        variation.set_price_snapshot(items)
+        variation.save()
+        for item in items:
+            item.product_variation = variation
+        LetteringItemVariation.objects.bulk_create(items)
+        Order.objects.create(
+            user_email='driver%s%d@example.com' % (suffix, i), product=variation,
+            total=variation.total, priced_at=timezone.now(),
+        )
+
+    Comment.objects.bulk_create([
+        Comment(user_email='c%s%d@example.com' % (suffix, i), image='uploads/comments/c%d.png' % i,
+                text='Comment %d' % i, visible=(i % 2 == 0))
+        for i in range(comments)
+    ])
+
+
+def make_lettering_items(count, lettering_categories=None):
+    lettering_categories = lettering_categories or list(LetteringItemCategory.objects.all())
+    return [
+        LetteringItemVariation(
+            lettering_item_category=lettering_categories[i % len(lettering_categories)], lettering='Line %d' % i,
+        )
+        for i in range(count)
+    ]
+
+
+def add_lettering_items(variation, count, lettering_categories=None):
+    items = make_lettering_items(count, lettering_categories)
+    for item in items:
+        item.product_variation = variation
+    LetteringItemVariation.objects.bulk_create(items)
+
+
+def make_image_file(name='image.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), '#336699').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(PAYMENT_ASYNC=False)
+class CatalogTestCase(TestCase):
+    """
+    Base for the tests against a catalog seeded by make_catalog(), with
+    uploads going to a throwaway MEDIA_ROOT and Stripe answered by a
+    FakeStripeServer.
+    """
+    # make_catalog() arguments, the feature tests get by with a small catalog
+    catalog = dict(products=30, orders=3, lettering_items=3, comments=10)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Uploaded images go to a throwaway MEDIA_ROOT
+        cls.media_root = tempfile.mkdtemp(prefix='truck-signs-tests-')
+        cls.media_override = override_settings(
+            MEDIA_ROOT=cls.media_root, UPLOAD_SESSION_DIR=os.path.join(cls.media_root, 'incoming'),
+        )
+        cls.media_override.enable()
+        cls.stripe_server = FakeStripeServer(('127.0.0.1', 0))
+        cls.stripe_server.start()
+        cls.stripe_api_base = stripe.api_base
+        stripe.api_base = cls.stripe_server.url
+
+    @classmethod
+    def tearDownClass(cls):
+        stripe.api_base = cls.stripe_api_base
+        cls.stripe_server.shutdown()
+        cls.stripe_server.server_close()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        make_catalog(**cls.catalog)
+        cls.truck_sign = Category.objects.get(title='Truck Sign')
+        cls.product = Product.objects.filter(category=cls.truck_sign).first()
+        cls.color = ProductColor.objects.first()
+        cls.order = Order.objects.select_related('product').first()
+        cls.variation = cls.order.product
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+
+    def grow(self):
+        """
+        Roughly triples the catalog and adds lettering items to the measured order.
+        """
+        make_catalog(products=600, orders=60, lettering_items=20, comments=200, suffix='x')
+        add_lettering_items(self.variation, 40)
+
+    def assertConstantQueries(self, num, request, before=None):
+        """
+        ``request`` issues exactly ``num`` queries, before and after grow().
+        ``before`` is called ahead of each measurement.
+        """
+        for grown in (False, True):
+            if grown:
+                self.grow()
+            cache.clear()
+            if before is not None:
+                before()
+            with self.assertNumQueries(num):
+                response = request()
+            self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+
+    def order_payload(self, lettering_items):
+        return {
+            'order': {'user_email': 'driver@example.com', 'address1': 'Main St 1'},
+            'product_color_id': self.color.id,
+            'lettering_items': [
+                {'title': 'Lettering %d' % (i % 6), 'text': 'Line %d' % i} for i in range(lettering_items)
+            ],
+        }
+
+    def payment_payload(self):
+        return {
+            'order': {'user_first_name': 'Dana'},
+            'card_num': '4242424242424242', 'exp_month': '12', 'exp_year': '2030', 'cvc': '123',
+        }
+
+    def pay(self, **extra):
+        return self.client.post(
+            '/api/order-payment/%d/' % self.order.id, self.payment_payload(), content_type='application/json', **extra
+        )
+
+
+class QueryCountTests(CatalogTestCase):
+    """
+    Pins the exact number of SQL queries every endpoint issues, and checks
+    the number stays the same when the catalog grows. A missing
+    select_related/prefetch_related shows up here as a failure instead of
+    as a slow page in production.
+
+    Every measurement starts from an empty cache, the cached (warm) path of
+    the catalog endpoints is pinned separately.
+    """
+    catalog = {}
+
+    def assertCachedGet(self, cold, url):
+        """
+        A catalog GET issues ``cold`` queries on a cache miss and none on a hit,
+        before and after grow().
+        """
+        self.assertConstantQueries(cold, lambda: self.client.get(url))
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_homepage(self):
+        self.assertConstantQueries(0, lambda: self.client.get('/'))
+        response = self.client.get('/')
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_template_version(self):
+        names = ('homepage.html', 'base.html')
+        reset_template_versions()
+        with mock.patch('backend.caching.get_template', wraps=get_template) as loads:
+            # Hashed once per process with the cached loader
+            self.assertEqual(template_version(names), template_version(names))
+            self.assertEqual(loads.call_count, len(names))
+            # Per request without it (dev.py)
+            loads.reset_mock()
+            options = dict(settings.TEMPLATES[0]['OPTIONS'], loaders=[
+                'django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader',
+            ])
+            with self.settings(TEMPLATES=[dict(settings.TEMPLATES[0], OPTIONS=options)]):
+                template_version(names)
+                template_version(names)
+            self.assertEqual(loads.call_count, 2 * len(names))
+
+    def test_api_root(self):
+        self.assertConstantQueries(0, lambda: self.client.get('/api/'))
+
+    def test_categories(self):
+        self.assertCachedGet(2, '/api/categories/')
+
+    def test_lettering_item_categories(self):
+        self.assertCachedGet(1, '/api/lettering-item-categories/')
+
+    def test_products(self):
+        self.assertCachedGet(1, '/api/products/')
+        self.assertCachedGet(1, '/api/products/?paginate=true')
+
+    def test_product_category(self):
+        self.assertCachedGet(1, '/api/product-category/%d/' % self.truck_sign.id)
+
+    def test_product_color(self):
+        self.assertCachedGet(1, '/api/product-color/')
+
+    def test_product_detail(self):
+        self.assertCachedGet(1, '/api/product-detail/%d/' % self.product.id)
+
+    def test_truck_logo_list(self):
+        self.assertCachedGet(2, '/api/truck-logo-list/')
+
+    def test_comments(self):
+        self.assertCachedGet(1, '/api/comments/')
+
+    def test_product_variation_retrieve(self):
+        self.assertConstantQueries(3, lambda: self.client.get('/api/product-variation-retrieve/%d/' % self.variation.id))
+
+    def test_create_order(self):
+        # The number of lettering items must not matter either. 9 includes the
+        # SAVEPOINT/RELEASE pair of transaction.atomic() inside the test transaction.
+        for lettering_items in (1, 10):
+            self.assertConstantQueries(9, lambda: self.client.post(
+                '/api/order/%d/create/' % self.product.id, self.order_payload(lettering_items),
+                content_type='application/json',
+            ))
+
+    def test_retrieve_order(self):
+        self.assertConstantQueries(3, lambda: self.client.get('/api/order/%d/retrieve/' % self.order.id))
+
+    def test_payment_get(self):
+        self.assertConstantQueries(3, lambda: self.client.get('/api/order-payment/%d/' % self.order.id))
+
+    def test_payment_post(self):
+        # The order is loaded without joins, the charge reads its price snapshot. 1 claims the order
+        # before the charge, 1 locks it to mark it paid, 5 update the sales rollups (backend/reporting.py),
+        # 1 queues the emails (backend/outbox.py), 2 are a SAVEPOINT/RELEASE pair
+        unpaid = lambda: Order.objects.filter(pk=self.order.pk).update(ordered=False)
+        self.assertConstantQueries(14, self.pay, before=unpaid)
+
+    def test_payment_post_async(self):
+        # Load the order, apply the order details, store the job
+        self.assertConstantQueries(3, lambda: self.pay(HTTP_PREFER='respond-async'))
+
+    def test_payment_status(self):
+        job = PaymentJob.objects.create(order=self.order)
+        self.assertConstantQueries(1, lambda: self.client.get(
+            '/api/order-payment/%d/status/%s/' % (self.order.id, job.token)
+        ))
+
+    def test_comment_create(self):
+        self.assertConstantQueries(1, lambda: self.client.post('/api/comment/create/', {
+            'user_email': 'new@example.com', 'text': 'Nice', 'image': make_image_file(),
+        }))
+
+    def test_upload_customer_image(self):
+        self.assertConstantQueries(4, lambda: self.client.post('/api/upload-customer-image/', {
+            'image': make_image_file(),
+        }))
+
+
+class PaginationTests(CatalogTestCase):
+    """
+    Cursor pagination of the catalog listings is opt-in (backend/pagination.py).
+    """
+
+    def test_opt_in(self):
+        products = self.client.get('/api/products/').json()
+        self.assertEqual(len(products), Product.objects.count())
+        page = self.client.get('/api/products/?paginate=true&page_size=10').json()
+        self.assertEqual(page['results'], products[:10])
+        self.assertIn('paginate=true', page['next'])
+        self.assertEqual(self.client.get(page['next']).json()['results'], products[10:20])
+
+        with self.settings(CATALOG_PAGINATION=True):
+            self.assertEqual(len(self.client.get('/api/products/?page_size=10').json()['results']), 10)
+            self.assertEqual(self.client.get('/api/products/?paginate=false').json(), products)
+
+
+@override_settings(
+    MIDDLEWARE=['backend.metrics.RequestMetricsMiddleware'] + settings.MIDDLEWARE, REQUEST_METRICS_FLUSH_INTERVAL=0,
+)
+class RequestMetricsTests(CatalogTestCase):
+    """
+    RequestMetricsMiddleware and dump_request_metrics (backend/metrics.py).
+    """
+
+    def setUp(self):
+        super().setUp()
+        histogram.flush()
+        histogram.reset()
+
+    def dump(self, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('dump_request_metrics', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_server_timing(self):
+        miss = self.client.get('/api/categories/')['Server-Timing']
+        self.assertIn('desc="2 queries"', miss)
+        self.assertIn('cache;desc="0 hit 1 miss"', miss)
+        hit = self.client.get('/api/categories/')['Server-Timing']
+        self.assertIn('desc="0 queries"', hit)
+        self.assertIn('cache;desc="1 hit 0 miss"', hit)
+
+    def test_dump(self):
+        self.client.get('/api/categories/')
+        self.client.get('/api/categories/')
+        output, warning = self.dump('--json')
+        row = json.loads(output)['GET:categories-api']
+        self.assertEqual((row['count'], row['queries_per_request'], row['cache_hit_ratio']), (2, 1.0, 0.5))
+        # The test cache is LocMemCache, other processes wouldn't see anything
+        self.assertIn('per process', warning)
+
+        self.dump('--reset')
+        self.assertEqual(self.dump()[0].strip(), "No requests recorded, is REQUEST_METRICS enabled?")
+        with self.settings(CACHES={
+            'default': {'BACKEND': 'backend.cache_backends.TwoTierCache', 'OPTIONS': {'SHARED_ALIAS': 'shared'}},
+            'shared': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'metrics_cache'},
+        }):
+            self.assertTrue(cache_is_shared())
+
+    def test_percentile(self):
+        buckets = [(5, 50), (10, 45), (25, 4), (float('inf'), 1)]
+        self.assertEqual([percentile(buckets, fraction) for fraction in (0.5, 0.95, 0.99, 1)], [5, 10, 25, float('inf')])
+        self.assertIsNone(percentile([(5, 0)], 0.5))
+
+
+class AdminChangelistTests(CatalogTestCase):
+    """
+    The admin changelists issue a constant number of queries, too.
+    """
+    catalog = {}
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        # Session, user, result count(s), page, plus list_filter choices and prefetches
+        expected = {
+            Category: 4,  # show_full_result_count = False
+            LetteringItemCategory: 5,
+            Product: 6,
+            ProductColor: 5,
+            ProductVariation: 7,
+            LetteringItemVariation: 5,
+            Payment: 5,
+            Order: 5,
+            Comment: 5,
+            DailySales: 8,  # date_hierarchy and the summary
+            OutboxEmail: 5,
+        }
+        for model, num in expected.items():
+            url = reverse('admin:backend_%s_changelist' % model._meta.model_name)
+            with self.subTest(model=model.__name__):
+                self.assertConstantQueries(num, lambda: self.client.get(url))
+
+
+class UploadTests(CatalogTestCase):
+    """
+    Resumable (backend/uploads.py) and direct-to-storage (backend/direct_uploads.py) uploads.
+    """
+
+    def test_upload_session(self):
+        image = make_image_file().read()
+
+        def upload():
+            response = self.client.post(
+                '/api/uploads/', {'filename': 'truck.png', 'size': len(image)}, content_type='application/json',
+            )
+            token = response.data['token']
+            with self.assertNumQueries(3):
+                self.client.put('/api/uploads/%s/' % token, image, content_type='application/octet-stream',
+                                HTTP_UPLOAD_OFFSET='0')
+            with self.assertNumQueries(1):
+                self.client.get('/api/uploads/%s/' % token)
+            # Including the SAVEPOINT/RELEASE pair of transaction.atomic()
+            with self.assertNumQueries(7):
+                return self.client.post('/api/uploads/%s/finalize/' % token)
+
+        self.assertConstantQueries(12, upload)
+
+    def test_direct_upload(self):
+        image = make_image_file().read()
+
+        def upload():
+            with self.assertNumQueries(1):
+                params = self.client.post(
+                    '/api/uploads/direct/', {'filename': 'truck.png', 'size': len(image)}, content_type='application/json',
+                ).data
+            self.assertEqual(params['method'], 'PUT')
+            # The local stand-in for the storage backend
+            with self.assertNumQueries(2):
+                response = self.client.put(params['upload_url'], image, content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 204)
+            # Including the SAVEPOINT/RELEASE pair of transaction.atomic()
+            with self.assertNumQueries(8):
+                response = self.client.post(params['finalize_url'])
+            self.assertEqual(response.data['Result']['image'].rsplit('/', 1)[1], params['token'].hex + '.png')
+            return response
+
+        self.assertConstantQueries(11, upload)
+
+
+class ImageRenditionTests(CatalogTestCase):
+    """
+    Renditions of uploaded images (backend/images.py).
+    """
+
+    def photo(self, size=(2000, 1000), orientation=6, image_format='JPEG'):
+        """
+        A camera photo, stored sideways with an EXIF orientation and GPS/camera tags.
+        """
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'PhoneMaker'
+        exif[0x8825] = {2: (52.0, 31.0, 0.0)}
+        buffer = io.BytesIO()
+        Image.new('RGB', size, '#336699').save(buffer, image_format, exif=exif.tobytes())
+        return buffer.getvalue()
+
+    def test_make_rendition(self):
+        photo = Image.open(io.BytesIO(self.photo()))
+        for image_format in ('WEBP', 'JPEG'):
+            rendition = Image.open(io.BytesIO(make_rendition(photo, RENDITIONS['list'], image_format)))
+            # Upright, scaled to fit the box
+            self.assertEqual((rendition.format, rendition.size), (image_format, (240, 480)))
+            self.assertEqual(len(rendition.getexif()), 0)
+            self.assertNotIn('exif', rendition.info)
+
+        # Transparency stays with WebP, never scaled up
+        logo = Image.new('P', (40, 20))
+        logo.info['transparency'] = 0
+        webp = Image.open(io.BytesIO(make_rendition(logo, RENDITIONS['detail'], 'WEBP')))
+        self.assertEqual((webp.mode, webp.size), ('RGBA', (40, 20)))
+        jpeg = Image.open(io.BytesIO(make_rendition(logo, RENDITIONS['detail'], 'JPEG')))
+        self.assertEqual(jpeg.mode, 'RGB')
+
+    def test_build_renditions(self):
+        product = Product.objects.create(
+            category=self.truck_sign, title='Upload', is_uploaded=True,
+            image=SimpleUploadedFile('truck.jpg', self.photo(orientation=1), content_type='image/jpeg'),
+        )
+        extension = 'webp' if rendition_format() == 'WEBP' else 'jpg'
+        with self.assertNumQueries(1):
+            build_renditions(product)
+        product.refresh_from_db()
+        for name, size in RENDITIONS.items():
+            field = getattr(product, rendition_field(name))
+            self.assertTrue(field.name.endswith('-%s.%s' % (name, extension)), field.name)
+            with field.open('rb') as f:
+                rendition = Image.open(f)
+                self.assertEqual(rendition.size, (size[0], size[1] // 2))
+                self.assertEqual(len(rendition.getexif()), 0)
+
+        # A new image replaces the renditions of the old one
+        old = product.image_thumbnail.path
+        product.image = SimpleUploadedFile('truck2.jpg', self.photo(size=(100, 100)), content_type='image/jpeg')
+        product.save()
+        build_renditions(product)
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual(Image.open(product.image_thumbnail.path).size, (100, 100))
+
+    def test_submit(self):
+        # Pool threads are named after their pool
+        self.assertTrue(background.submit('test', 1, lambda: threading.current_thread().name).result().startswith('test'))
+
+
+class IdempotencyTests(CatalogTestCase):
+    """
+    Idempotency-Key on order creation and payment (backend/idempotency.py).
+    """
+
+    def test_idempotency_key(self):
+        create = lambda key, lettering_items=1: self.client.post(
+            '/api/order/%d/create/' % self.product.id, self.order_payload(lettering_items),
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+        orders = Order.objects.count()
+        first = create('order-1')
+        # The retry gets the first response back, from the stored key (on_commit never fires in TestCase)
+        with self.assertNumQueries(3):
+            again = create('order-1')
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), orders + 1)
+        self.assertEqual(create('order-1', lettering_items=2).status_code, 422)
+
+        pay = lambda: self.pay(HTTP_IDEMPOTENCY_KEY='payment-1')
+        charges = len(self.stripe_server.charges)
+        self.assertEqual(pay().status_code, 200)
+        self.assertEqual(pay().status_code, 200)
+        self.assertEqual(len(self.stripe_server.charges), charges + 1)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+
+    def test_retry_while_charging(self):
+        # The key is committed as in progress before the handler talks to Stripe, a retry
+        # arriving meanwhile is answered right away instead of waiting on a lock
+        retries = []
+
+        def charge(*args, **kwargs):
+            retries.append(self.pay(HTTP_IDEMPOTENCY_KEY='payment-3').status_code)
+            return charge_order(*args, **kwargs)
+
+        with mock.patch('backend.views.charge_order', side_effect=charge):
+            self.assertEqual(self.pay(HTTP_IDEMPOTENCY_KEY='payment-3').status_code, 200)
+        self.assertEqual(retries, [409])
+        self.assertEqual(self.pay(HTTP_IDEMPOTENCY_KEY='payment-3')['Idempotent-Replayed'], 'true')
+
+    def test_key_removed_concurrently(self):
+        # The first request with the key had its record removed (a retryable response) between
+        # our lookup and insert, the insert fails on the unique key
+        charges = len(self.stripe_server.charges)
+        async_pay = async_to_sync(AsyncPaymentView.as_async_view())
+        with mock.patch('django.db.models.query.QuerySet.get_or_create', side_effect=IntegrityError):
+            self.assertEqual(self.pay(HTTP_IDEMPOTENCY_KEY='payment-2').status_code, 409)
+            response = async_pay(APIRequestFactory().post(
+                '/api/order-payment/%d/' % self.order.id, self.payment_payload(), format='json',
+                HTTP_IDEMPOTENCY_KEY='payment-2',
+            ), id=str(self.order.id))
+            self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(self.stripe_server.charges), charges)
+        self.assertEqual(self.pay(HTTP_IDEMPOTENCY_KEY='payment-2').status_code, 200)
+
+
+class PaymentTests(CatalogTestCase):
+    """
+    An order is charged once, whichever path the payment takes.
+    """
+
+    def test_paid_order(self):
+        charges = len(self.stripe_server.charges)
+        self.assertEqual(self.pay().status_code, 200)
+        response = self.pay()
+        self.assertEqual((response.status_code, response.data), (400, {"Result": "Order is already paid"}))
+        response = async_to_sync(AsyncPaymentView.as_async_view())(APIRequestFactory().post(
+            '/api/order-payment/%d/' % self.order.id, self.payment_payload(), format='json',
+        ), id=str(self.order.id))
+        self.assertEqual(response.data, {"Result": "Order is already paid"})
+        self.assertEqual(len(self.stripe_server.charges), charges + 1)
+
+    def test_concurrent_async_charges(self):
+        card = get_card(self.payment_payload())
+        charges = len(self.stripe_server.charges)
+
+        # Two requests for the same order, without an Idempotency-Key
+        orders = [Order.objects.get(pk=self.order.pk) for i in range(2)]
+
+        async def pay_twice():
+            return await asyncio.gather(*(acharge_order(order, card) for order in orders), return_exceptions=True)
+
+        first, second = async_to_sync(pay_twice)()
+        self.assertIsInstance(first, Payment)
+        self.assertIsInstance(second, PaymentInProgress)
+        self.assertEqual(len(self.stripe_server.charges), charges + 1)
+        with self.assertRaises(OrderAlreadyPaid):
+            mark_paid(Order.objects.get(pk=self.order.pk), 'ch_again', 100)
+
+        # A declined charge gives the order free again, a claim left by a dead process expires
+        unpaid = Order.objects.exclude(pk=self.order.pk).first()
+        with self.assertRaises(stripe.error.CardError):
+            charge_order(unpaid, dict(card, card_num='4000000000000002'))
+        Order.objects.filter(pk=unpaid.pk).update(payment_started=timezone.now() - STALE_JOB_AFTER * 2)
+        charge_order(unpaid, card)
+        self.assertEqual(len(self.stripe_server.charges), charges + 2)
+
+    def test_payment_job(self):
+        card = get_card(self.payment_payload())
+        # The job isn't run, on_commit never fires in TestCase
+        self.pay(HTTP_PREFER='respond-async', HTTP_IDEMPOTENCY_KEY='job-1')
+        # The job charges with the key of the request, so a retry of it isn't charged twice
+        job = PaymentJob.objects.get(order=self.order)
+        self.assertTrue(job.idempotency_key.endswith(':order-%d' % self.order.id))
+        charges = len(self.stripe_server.charges)
+        charge_order(self.order, card, idempotency_key=job.idempotency_key)
+        with self.assertRaises(OrderAlreadyPaid):
+            charge_order(self.order, card, idempotency_key=job.idempotency_key)
+        self.assertEqual(len(self.stripe_server.charges), charges + 1)
+        # Without a header it gets a key of its own
+        other = enqueue_payment(Order.objects.exclude(pk=self.order.pk).first(), card)
+        self.assertEqual(other.idempotency_key, 'payment-job-%s' % other.token)
+
+        # Left behind by a worker that died
+        PaymentJob.objects.filter(pk=other.pk).update(
+            status=PaymentJob.PROCESSING, updated=timezone.now() - STALE_JOB_AFTER * 2,
+        )
+        call_command('fail_stale_payment_jobs', stdout=io.StringIO())
+        other.refresh_from_db()
+        self.assertEqual(other.status, PaymentJob.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PaymentJob.PENDING)
+
+
+class OutboxTests(CatalogTestCase):
+    """
+    Purchase emails sent by manage.py send_emails (backend/outbox.py).
+    """
+
+    @override_settings(EMAIL_ADMIN='admin@example.com')
+    def test_send_emails(self):
+        self.pay()
+        self.assertEqual(len(mail.outbox), 0)
+        # Claim, load, mark as sent, whatever the batch size, then find nothing left
+        # (SAVEPOINT/RELEASE included)
+        # --once keeps the connection, it may be inside a transaction
+        with self.assertNumQueries(9), mock.patch('backend.management.commands.send_emails.close_old_connections') as close:
+            call_command('send_emails', '--once', stdout=io.StringIO())
+        close.assert_not_called()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['admin@example.com', self.order.user_email])
+        self.assertIn("{:.2f}".format(self.order.get_total_price()), mail.outbox[0].alternatives[0][0] + mail.outbox[1].alternatives[0][0])
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).exists())
+        # Rendered once per batch and filled in, the same as a full render
+        context = {'user': 'a&b@example.com', 'image': '', 'amount_of_product': '2', 'total_amount': '12.50'}
+        html, text = PreparedTemplate('purchase-made.html', context).render(context)
+        self.assertEqual(html, render_to_string('purchase-made.html', context))
+
+        # A failure is retried later, not right away
+        email = OutboxEmail.objects.create(kind='unknown', to_email='x@example.com', order=self.order)
+        call_command('send_emails', '--once', stdout=io.StringIO())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt, timezone.now())
+
+
+class AsyncViewTests(CatalogTestCase):
+    """
+    The ASGI views (backend/async_views.py) answer like the DRF views.
+    """
+
+    def test_async_views(self):
+        # Served under ASGI (truck_signs_designs/asgi.py), answering like the DRF views
+        factory = APIRequestFactory()
+        products = async_to_sync(async_catalog_view(ProductListView))
+        expected = self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            response = products(factory.get('/api/products/'))
+        self.assertEqual((response.content, response['ETag']), (expected.content, expected['ETag']))
+        self.assertEqual(products(factory.get('/api/products/', HTTP_IF_NONE_MATCH=expected['ETag'])).status_code, 304)
+
+        pay = lambda payload, key, order=self.order: async_to_sync(AsyncPaymentView.as_async_view())(factory.post(
+            '/api/order-payment/%d/' % order.id, payload, format='json', HTTP_IDEMPOTENCY_KEY=key,
+        ), id=str(order.id)).render()
+        charges = len(self.stripe_server.charges)
+        self.assertEqual(pay(self.payment_payload(), 'async-1').status_code, 200)
+        self.assertEqual(pay(self.payment_payload(), 'async-1')['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.stripe_server.charges), charges + 1)
+        self.assertEqual(Payment.objects.filter(order=self.order).count(), 1)
+        unpaid = Order.objects.exclude(pk=self.order.pk).first()
+        declined = pay(dict(self.payment_payload(), card_num='4000000000000002'), 'async-2', unpaid)
+        self.assertEqual(declined.data, {"Result": "Error with card during payment"})
+
+
+class AsyncStripeTests(SimpleTestCase):
+    """
+    backend/async_stripe.py gives the same results as stripe-python, which
+    guards its use of stripe-python internals across upgrades.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stripe_server = FakeStripeServer(('127.0.0.1', 0))
+        cls.stripe_server.start()
+        cls.stripe_api_base = stripe.api_base
+        stripe.api_base = cls.stripe_server.url
+
+    @classmethod
+    def tearDownClass(cls):
+        stripe.api_base = cls.stripe_api_base
+        cls.stripe_server.shutdown()
+        cls.stripe_server.server_close()
+        super().tearDownClass()
+
+    def test_encode(self):
+        self.assertEqual(
+            async_stripe.encode({'amount': 100, 'card': {'number': '4242', 'exp_month': 12}}),
+            'amount=100&card%5Bnumber%5D=4242&card%5Bexp_month%5D=12',
+        )
+
+    def test_decode(self):
+        card = {'number': '4242424242424242', 'exp_month': 12, 'exp_year': 2030, 'cvc': '123'}
+        expected = stripe.Token.create(card=card)
+        token = async_to_sync(async_stripe.create_token)(card)
+        self.assertEqual((type(token), type(token.card)), (type(expected), type(expected.card)))
+        self.assertEqual((token.object, token.card.last4), (expected.object, expected.card.last4))
+        charge = async_to_sync(async_stripe.create_charge)(amount=1250, currency='usd', source=token.id)
+        self.assertEqual((type(charge), charge.amount, charge.paid), (stripe.Charge, 1250, True))
+
+        declined = dict(card, number='4000000000000002')
+        with self.assertRaises(stripe.error.CardError) as expected_error:
+            stripe.Token.create(card=declined)
+        with self.assertRaises(stripe.error.CardError) as error:
+            async_to_sync(async_stripe.create_token)(declined)
+        self.assertEqual(
+            (error.exception.code, error.exception.http_status),
+            (expected_error.exception.code, expected_error.exception.http_status),
+        )
+
+    def test_client_closed_with_loop(self):
+        self.assertTrue(async_to_sync(async_stripe.get_client)().is_closed)
+        self.assertTrue(asyncio.run(async_stripe.get_client()).is_closed)
+
+
+class SalesReportTests(CatalogTestCase):
+    """
+    Daily sales rollups (backend/reporting.py).
+    """
+
+    def test_sales_report(self):
+        self.pay()
+        # The incremental rollups match the ones rebuilt from the orders
+        fields = ('day', 'dimension', 'key_id', 'label', 'orders', 'units', 'revenue')
+        incremental = sorted(DailySales.objects.values_list(*fields))
+        rebuild()
+        self.assertEqual(sorted(DailySales.objects.values_list(*fields)), incremental)
+
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/reports/sales/?dimension=product&by=day')
+        self.assertEqual(response.data['Result'][0]['revenue'], self.order.get_total_price())
+        # Session, user, rollups
+        self.assertConstantQueries(3, lambda: self.client.get('/api/reports/sales/?dimension=lettering-category'))
+
+
+class PriceSnapshotTests(CatalogTestCase):
+    """
+    Prices are frozen at checkout.
+    """
+
+    def test_price_snapshot(self):
+        total = self.order.get_total_price()
+        LetteringItemCategory.objects.update(price=100.0)
+        Category.objects.update(base_price=100.0)
+        # Price changes after checkout don't change what the order costs
+        response = self.client.get('/api/order/%d/retrieve/' % self.order.id)
+        self.assertEqual(response.data['product']['total_price'], total)
+        self.assertEqual(response.data['total'], total)
+
+        # Orders from before snapshots are frozen by the backfill, at today's prices
+        legacy = ProductVariation.objects.create(product=self.product, amount=2)
+        add_lettering_items(legacy, 3)
+        legacy_order = Order.objects.create(user_email='legacy@example.com', product=legacy)
+        call_command('backfill_price_snapshots', stdout=io.StringIO())
+        legacy_order.refresh_from_db()
+        self.assertEqual(legacy_order.total, (100.0 + 3 * 100.0) * 2)
+        self.assertEqual(list(legacy.lettering_item_variation_set.values_list('price', flat=True)), [100.0] * 3)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, total)
+
+        # Or when they are paid
+        unpriced = Order.objects.create(user_email='legacy@example.com', product=legacy)
+        Order.objects.filter(pk=unpriced.pk).update(total=None)
+        response = self.client.post(
+            '/api/order-payment/%d/' % unpriced.id, self.payment_payload(), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        unpriced.refresh_from_db()
+        self.assertEqual((unpriced.total, unpriced.payment.amount), (800.0, 80000))
+
+
+class OrderExportTests(CatalogTestCase):
+    """
+    The order export (backend/order_export.py) in every format, read back.
+    """
+
+    def export(self, file_format):
+        return ''.join(iter_export(Order.objects.all(), file_format, chunk_size=2))
+
+    def test_formats(self):
+        self.pay()
+        order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+        # A page of orders and one query for their lettering items per chunk
+        with self.assertNumQueries(4):
+            rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+        self.assertEqual(list(rows[0]), COLUMN_NAMES)
+        self.assertEqual([int(row['order_id']) for row in rows], order_ids)
+        paid = rows[order_ids.index(self.order.pk)]
+        self.assertEqual((paid['ordered'], paid['stripe_charge_id'][:3]), ('True', 'ch_'))
+        self.assertEqual(float(paid['total_price']), self.order.get_total_price())
+        self.assertEqual(len(paid['lettering'].split(' | ')), self.variation.lettering_item_variation_set.count())
+
+        jsonl = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual([{name: '' if value is None else str(value) for name, value in row.items()} for row in jsonl], rows)
+
+        chunks = [json.loads(line) for line in self.export('columnar').splitlines()]
+        self.assertEqual([chunk['rows'] for chunk in chunks], [2, 1])
+        columnar = [
+            dict(zip(chunk['columns'], values)) for chunk in chunks for values in zip(*chunk['data'])
+        ]
+        self.assertEqual(columnar, jsonl)
+
+        # Without orders the CSV is the header alone
+        self.assertEqual(''.join(iter_export(Order.objects.none(), 'csv')).strip(), ','.join(COLUMN_NAMES))
+
+    def test_command(self):
+        self.pay()
+        path = os.path.join(self.media_root, 'orders.jsonl')
+        call_command('export_orders', '-o', path, '--format', 'jsonl', '--paid', stderr=io.StringIO())
+        with open(path) as f:
+            self.assertEqual([json.loads(line)['order_id'] for line in f], [self.order.pk])
+
+
+class CatalogImportTests(CatalogTestCase):
+    """
+    import_catalog and export_catalog (backend/catalog_io.py).
+    """
+    catalog = dict(products=6, orders=1, lettering_items=0, comments=0)
+
+    def write(self, name, content):
+        path = os.path.join(self.media_root, name)
+        with open(path, 'w', newline='') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_catalog', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue().splitlines()
+
+    def snapshot(self):
+        return {
+            catalog_type.name: list(export_rows(catalog_type)) for catalog_type in CATALOG_TYPES
+        }
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        for file_format in FORMATS:
+            path = os.path.join(self.media_root, 'catalog.%s' % file_format)
+            call_command('export_catalog', '-o', path, stderr=io.StringIO())
+            output, errors = self.run_import(path)
+            # Nothing changed, so nothing is written
+            self.assertIn("0 created, 0 updated, %d unchanged" % sum(map(len, before.values())), output)
+            self.assertEqual(errors, [])
+            self.assertEqual(self.snapshot(), before)
+
+    def test_upsert(self):
+        images = os.path.join(self.media_root, 'import-images')
+        os.makedirs(images)
+        Image.new('RGB', (8, 8)).save(os.path.join(images, 'new.png'))
+        path = self.write('upsert.csv', (
+            "type,title,base_price,image,category,is_uploaded,color_nickname,color_in_hex\n"
+            "category,New Category,12.5,new.png,,,,\n"
+            "product,New Product,,new.png,New Category,yes,,\n"
+            "product,Product 0,,,Truck Sign,no,,\n"
+            "color,,,,,,Color 1,#abcdef\n"
+            "color,,,,,,Color 1,#fedcba\n"
+        ))
+        old_image = Product.objects.get(title='Product 0').image.name
+        output, errors = self.run_import(path, '--images', images, '--batch-size', '2')
+        self.assertEqual(errors, [])
+        self.assertIn("2 created, 2 updated, 0 unchanged, 2 images copied", output)
+
+        category = Category.objects.get(title='New Category')
+        self.assertEqual((category.base_price, category.image.name), (12.5, 'uploads/categories/new.png'))
+        product = Product.objects.get(title='New Product')
+        self.assertEqual((product.category, product.is_uploaded), (category, True))
+        self.assertEqual(product.image.name, 'uploads/products/new.png')
+        self.assertTrue(os.path.isfile(os.path.join(self.media_root, product.image.name)))
+        # Empty columns are left alone, the later of two rows wins
+        updated = Product.objects.get(title='Product 0')
+        self.assertEqual((updated.is_uploaded, updated.image.name), (False, old_image))
+        self.assertEqual(ProductColor.objects.get(color_nickname='Color 1').color_in_hex, '#fedcba')
+
+        # The same file again writes nothing, not even the images
+        output, errors = self.run_import(path, '--images', images)
+        self.assertIn("0 created, 0 updated, 4 unchanged, 0 images copied", output)
+
+    def test_bad_rows(self):
+        path = self.write('bad.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'type': 'category', 'title': 'Good Category', 'base_price': '3'},
+            {'type': 'sticker', 'title': 'Unknown'},
+            {'type': 'category', 'title': 'Bad Price', 'base_price': 'cheap'},
+            {'type': 'lettering-category', 'price': '2'},
+            {'type': 'product', 'title': 'Orphan', 'category': 'No Such Category'},
+            {'type': 'product', 'title': 'Good Product', 'category': 'Good Category'},
+        ]))
+        output, errors = self.run_import(path)
+        self.assertIn("2 created, 0 updated", output)
+        self.assertIn("4 errors", output)
+        self.assertEqual([error.split(':')[0] for error in errors], ['line 2', 'line 3', 'line 4', 'line 5'])
+        self.assertIn("Unknown type 'sticker'", errors[0])
+        self.assertIn("base_price", errors[1])
+        self.assertIn("Missing title", errors[2])
+        self.assertIn("Unknown category 'No Such Category'", errors[3])
+        self.assertFalse(Category.objects.filter(title='Bad Price').exists())
+        self.assertTrue(Product.objects.filter(title='Good Product', category__title='Good Category').exists())
+
+
+@skipUnless(REPLICA_DB_ALIAS in settings.DATABASES, "needs a second database as the replica alias")
+class ReplicaRoutingTests(TestCase):
+    """
+    The replica is a second, separate database here, so whichever one a
+    response was read from shows in its content.
+    """
+    databases = {'default', REPLICA_DB_ALIAS}
+
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(title='On the primary')
+        Category.objects.using(REPLICA_DB_ALIAS).create(title='On the replica')
+        # The catalog last changed long ago
+        for model in CategoryListView.cache_models:
+            cache.set(_modified_key(model), 0, None)
+
+    def titles(self, query):
+        return [category['title'] for category in self.client.get('/api/categories/?' + query).json()]
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_read_your_writes(self):
+        with self.assertNumQueries(0, using='default'):
+            self.assertEqual(self.titles('a'), ['On the replica'])
+
+        # A client that wrote reads from the primary for a while
+        response = self.client.post('/api/comment/create/', {
+            'user_email': 'new@example.com', 'text': 'Nice', 'image': make_image_file(),
+        })
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.titles('b'), ['On the primary'])
+        self.client.cookies.clear()
+        self.assertEqual(self.titles('c'), ['On the replica'])
+
+        # So does everyone right after the catalog changed
+        bump_generation(Category)
+        self.assertEqual(self.titles('d'), ['On the primary'])
+        # Orders, payments and everything else always use the primary
+        self.assertEqual(Category.objects.get().title, 'On the primary')
 
-# Create your tests here.
@@ -0,0 +1,223 @@
+"""
+Resumable, chunked image uploads.
+
+``UploadCustomerImage`` and ``CommentCreateView`` take the whole image in one
+multipart request, a slow mobile upload holds a sync worker for as long as
+it takes. The upload session API splits it into small requests:
+
+    POST uploads/                        {"filename", "size", "kind"} -> token
+    PUT  uploads/<token>/                raw bytes, "Upload-Offset: <n>" header
+    GET  uploads/<token>/                how much has arrived, to resume
+    POST uploads/<token>/finalize/       creates the product / comment
+
+Chunks are streamed to a file in ``UPLOAD_SESSION_DIR`` in 64 KB pieces, so
+memory stays bounded whatever the chunk size. The declared size is checked
+against ``UPLOAD_MAX_SIZE`` before anything is stored, and as soon as the
+image header has arrived its format and pixel count are checked against
+``UPLOAD_ALLOWED_FORMATS`` and ``UPLOAD_MAX_PIXELS``, so a decompression bomb
+or a PDF is refused after the first chunk instead of after the last.
+
+Images that skip the app servers altogether are in backend/direct_uploads.py,
+they share the sessions and finalize step with these.
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from PIL import Image
+
+from .images import enqueue_renditions
+from .models import Category, Product, UploadSession
+from .serializers import CommentSerializer
+
+READ_SIZE = 64 * 1024
+# Bytes after which an image whose header can't be parsed is given up on
+PROBE_SIZE = 256 * 1024
+
+
+class UploadError(Exception):
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def session_dir():
+    path = getattr(settings, 'UPLOAD_SESSION_DIR', None) or os.path.join(tempfile.gettempdir(), 'truck_signs_uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def session_path(session):
+    return os.path.join(session_dir(), '%s.part' % session.token)
+
+
+def start_session(filename, size, kind, direct=False):
+    if kind not in dict(UploadSession.KIND_CHOICES):
+        raise UploadError("Unknown upload kind %r" % kind, 400)
+    if size <= 0:
+        raise UploadError("Upload size must be positive", 400)
+    if size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError("Upload exceeds the maximum size of %d bytes" % settings.UPLOAD_MAX_SIZE, 413)
+    session = UploadSession.objects.create(
+        filename=os.path.basename(filename)[:256] or 'upload', size=size, kind=kind, direct=direct,
+    )
+    if not direct:
+        open(session_path(session), 'wb').close()
+    return session
+
+
+def fail_session(session, message, status_code):
+    session.status = UploadSession.FAILED
+    session.save(update_fields=['status', 'updated'])
+    discard_file(session)
+    raise UploadError(message, status_code)
+
+
+def discard_file(session):
+    try:
+        os.remove(session_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Appends ``length`` bytes read from ``stream`` at ``offset`` and returns
+    the new number of received bytes.
+    """
+    if session.status != UploadSession.OPEN:
+        raise UploadError("Upload session is %s" % session.status, 409)
+    if session.direct:
+        raise UploadError("Upload goes straight to storage, not in chunks", 409)
+    if offset != session.received:
+        raise UploadError("Expected Upload-Offset %d" % session.received, 409)
+    if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError("Chunks are limited to %d bytes" % settings.UPLOAD_MAX_CHUNK_SIZE, 413)
+    if offset + length > session.size:
+        raise UploadError("Chunk goes past the declared size of %d bytes" % session.size, 413)
+
+    written = 0
+    with open(session_path(session), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+        # A chunk cut short by a dropped connection is resumed from here
+        f.truncate(offset + written)
+
+    # Compare and set, a concurrent PUT at the same offset loses
+    updated = UploadSession.objects.filter(pk=session.pk, received=offset, status=UploadSession.OPEN).update(
+        received=offset + written, updated=timezone.now(),
+    )
+    if not updated:
+        raise UploadError("Upload session changed concurrently, ask for the current offset", 409)
+    session.received = offset + written
+
+    if session.width is None:
+        probe_image(session)
+    return session.received
+
+
+def probe_image(session):
+    """
+    Checks format and dimensions as soon as the image header is readable.
+    """
+    try:
+        with Image.open(session_path(session)) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        fail_session(session, "Image has too many pixels", 413)
+    except (OSError, SyntaxError, ValueError):
+        # Header not complete yet, or not an image
+        if session.received >= min(PROBE_SIZE, session.size):
+            fail_session(session, "Not a supported image", 415)
+        return
+
+    try:
+        check_image(image_format, width, height)
+    except UploadError as e:
+        fail_session(session, e.args[0], e.status_code)
+    session.width, session.height = width, height
+    session.save(update_fields=['width', 'height'])
+
+
+def check_image(image_format, width, height):
+    if image_format not in settings.UPLOAD_ALLOWED_FORMATS:
+        raise UploadError("Image format %s is not supported" % image_format, 415)
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        raise UploadError("Image has too many pixels (%dx%d)" % (width, height), 413)
+
+
+def finish_session(session, **extra):
+    """
+    Turns the complete upload into a customer product or a comment and
+    returns it.
+    """
+    with transaction.atomic():
+        # A second finalize of the same session waits here and then sees it complete
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != UploadSession.OPEN:
+            raise UploadError("Upload session is %s" % session.status, 409)
+        if session.received != session.size:
+            raise UploadError("Upload incomplete, %d of %d bytes received" % (session.received, session.size), 409)
+
+        if session.direct:
+            # Already in storage, only the name is recorded
+            instance = create_object(session, session.storage_name, **extra)
+        else:
+            with open(session_path(session), 'rb') as f:
+                instance = create_object(session, File(f, name=session.filename), **extra)
+
+        session.status = UploadSession.COMPLETE
+        session.object_id = instance.pk
+        session.save(update_fields=['status', 'object_id', 'updated'])
+        enqueue_renditions(instance)
+    discard_file(session)
+    return instance
+
+
+def create_object(session, image, **extra):
+    if session.kind == UploadSession.PRODUCT:
+        return create_customer_product(image)
+    return create_comment(image, **extra)
+
+
+def create_customer_product(image):
+    """
+    ``image`` is a File to copy into storage or the name of a file already there.
+    """
+    category = Category.objects.get(title="Truck Sign")
+    product = Product(category=category, title="Customer-Image-" + str(datetime.now()), is_uploaded=True)
+    if isinstance(image, File):
+        # Copied into storage in chunks, not read into memory
+        product.image.save(image.name, image, save=False)
+    else:
+        product.image = image
+    product.detail_image = product.image
+    product.save()
+    return product
+
+
+def create_comment(image, user_email=None, text=''):
+    # The image was checked chunk by chunk already, only validate the rest
+    data = {'user_email': user_email}
+    if text:
+        data['text'] = text
+    serializer = CommentSerializer(data=data, partial=True)
+    if not serializer.is_valid():
+        raise UploadError(serializer.errors, 400)
+    return serializer.save(image=image)
+
+
+def expired_sessions():
+    ttl = timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    return UploadSession.objects.filter(status=UploadSession.OPEN, updated__lt=timezone.now() - ttl)
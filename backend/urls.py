@@ -2,23 +2,32 @@ from django.contrib import admin
 from django.conf.urls import url,include
 # from .views import PricesPageAPI,HowToAPIView, CreateOrderAPI, OrderSummaryAPIView, RetrieveAllProductColorsAPI
 from .views import *
+# Async under ASGI (truck_signs_designs/asgi.py), the DRF views otherwise
+from .async_views import catalog_view, payment_view
 
 app_name = 'trucks_signs_app'
 
 urlpatterns = [
     url(r'^$', api_root, name='api-root'),
-    url(r'^categories/$', CategoryListView.as_view(), name='categories-api'),
-    url(r'^lettering-item-categories/$', LetteringItemCategoryListView.as_view(), name='lettering-item-categories-api'),
-    url(r'^products/$', ProductListView.as_view(), name='products-api'),
-    url(r'^product-category/(?P<id>[0-9]+)/$', ProductFromCategoryListView.as_view(), name='product-category-api'),
+    url(r'^categories/$', catalog_view(CategoryListView), name='categories-api'),
+    url(r'^lettering-item-categories/$', catalog_view(LetteringItemCategoryListView), name='lettering-item-categories-api'),
+    url(r'^products/$', catalog_view(ProductListView), name='products-api'),
+    url(r'^product-category/(?P<id>[0-9]+)/$', catalog_view(ProductFromCategoryListView), name='product-category-api'),
     url(r'^product-variation-retrieve/(?P<id>[0-9]+)/$', ProductVariationRetrieveView.as_view(), name='product-category-api'),
-    url(r'^product-color/$', ProductColorListView.as_view(), name='product-color-api'),
-    url(r'^product-detail/(?P<id>[0-9]+)/$', ProductDetail.as_view(), name='product-detail-api'),
-    url(r'^truck-logo-list/$', LogoListView.as_view(), name='truck-logo-list-api'),
+    url(r'^product-color/$', catalog_view(ProductColorListView), name='product-color-api'),
+    url(r'^product-detail/(?P<id>[0-9]+)/$', catalog_view(ProductDetail), name='product-detail-api'),
+    url(r'^truck-logo-list/$', catalog_view(LogoListView), name='truck-logo-list-api'),
     url(r'^order/(?P<id>[0-9]+)/create/$', CreateOrder.as_view(), name='create-order-api'),
     url(r'^order/(?P<id>[0-9]+)/retrieve/$', RetrieveOrder.as_view(), name='retrieve-order-api'),
-    url(r'^order-payment/(?P<id>[0-9]+)/$', PaymentView.as_view(), name='order-payment-api'),
-    url(r'^comments/$', CommentsView.as_view(), name='comments-api'),
+    url(r'^order-payment/(?P<id>[0-9]+)/$', payment_view(), name='order-payment-api'),
+    url(r'^order-payment/(?P<id>[0-9]+)/status/(?P<token>[0-9a-f-]+)/$', PaymentStatusView.as_view(), name='order-payment-status-api'),
+    url(r'^comments/$', catalog_view(CommentsView), name='comments-api'),
     url(r'^comment/create/$', CommentCreateView.as_view(), name='comment-create-api'),
     url(r'^upload-customer-image/$', UploadCustomerImage.as_view(), name='upload-customer-image-api'),
+    url(r'^uploads/$', UploadSessionCreateView.as_view(), name='upload-session-create-api'),
+    url(r'^uploads/direct/$', DirectUploadCreateView.as_view(), name='direct-upload-create-api'),
+    url(r'^uploads/direct/local/(?P<signed>[\w:.-]+)/$', DirectUploadLocalView.as_view(), name='direct-upload-local-api'),
+    url(r'^uploads/(?P<token>[0-9a-f-]+)/$', UploadSessionView.as_view(), name='upload-session-api'),
+    url(r'^uploads/(?P<token>[0-9a-f-]+)/finalize/$', UploadSessionFinalizeView.as_view(), name='upload-session-finalize-api'),
+    url(r'^reports/sales/$', SalesReportView.as_view(), name='sales-report-api'),
 ]
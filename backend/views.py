@@ -10,6 +10,7 @@ from django.core.mail import EmailMultiAlternatives
 
 import json
 from datetime import datetime
+from django.utils.dateparse import parse_date
 
 from rest_framework.response import Response
 from rest_framework import status
@@ -17,19 +18,26 @@ from rest_framework.generics import *
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 from rest_framework.reverse import reverse
+from rest_framework.permissions import IsAdminUser
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 
 from .models import *
 from .serializers import *
-
-import stripe
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-# admin_email = settings.EMAIL_ADMIN
-# current_admin_domain = settings.CURRENT_ADMIN_DOMAIN
+from .fast_serializers import FastSerializerMixin, get_field_plan
+from .pagination import CatalogCursorPagination
+from .caching import CachedResponseMixin, RESPONSE_CACHE_TIMEOUT, cached_page, generation_cache_key
+from .payments import RETRYABLE_ERRORS, charge_order, enqueue_payment, get_card, payment_error_message
+from .idempotency import idempotent, stripe_key
+from .images import enqueue_renditions
+from .uploads import UploadError, finish_session, start_session, write_chunk
+from .direct_uploads import LocalBackend, confirm_upload, start_direct_session
+from .reporting import report
 
 # Create your views here.
 
+@cached_page('homepage.html', 'base.html')
 def homepage(request):
     """
     Landing page view for the website
@@ -52,111 +60,97 @@ def api_root(request):
         'upload_customer_image': reverse('trucks-signs-root:upload-customer-image-api', request=request),
     })
 
-class CategoryListView(ListAPIView):
+class CategoryListView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = CategorySerializer
     model = Category
-    
+    cache_key_prefix = 'categories_list'
+    cache_models = (Category, Product)
+
     def get_queryset(self):
-        cache_key = 'categories_list_ids'
-        category_ids = cache.get(cache_key)
-        if category_ids is None:
-            queryset = Category.objects.all().prefetch_related('product_set')
-            category_ids = list(queryset.values_list('id', flat=True))
-            cache.set(cache_key, category_ids, 300)  # Cache for 5 minutes
-        return Category.objects.filter(id__in=category_ids).prefetch_related('product_set')
-
-class LetteringItemCategoryListView(ListAPIView):
+        return Category.objects.all().prefetch_related('product_set')
+
+class LetteringItemCategoryListView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = LetteringItemCategorySerializer
     model = LetteringItemCategory
-    
+    cache_key_prefix = 'lettering_item_categories_list'
+    cache_models = (LetteringItemCategory,)
+
     def get_queryset(self):
-        cache_key = 'lettering_item_categories_list_queryset'
-        queryset_ids = cache.get(cache_key)
-        if queryset_ids is None:
-            queryset = LetteringItemCategory.objects.all()
-            queryset_ids = list(queryset.values_list('id', flat=True))
-            cache.set(cache_key, queryset_ids, 300)  # Cache for 5 minutes
-        return LetteringItemCategory.objects.filter(id__in=queryset_ids)
-
-class ProductListView(ListAPIView):
+        return LetteringItemCategory.objects.all()
+
+class ProductListView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = ProductSerializer
     model = Product
-    
+    cache_key_prefix = 'products_list'
+    cache_models = (Product, Category)
+    pagination_class = CatalogCursorPagination
+
     def get_queryset(self):
-        cache_key = 'products_list_queryset'
-        queryset_ids = cache.get(cache_key)
-        if queryset_ids is None:
-            queryset = Product.objects.all().select_related('category')
-            queryset_ids = list(queryset.values_list('id', flat=True))
-            cache.set(cache_key, queryset_ids, 300)  # Cache for 5 minutes
-        return Product.objects.filter(id__in=queryset_ids).select_related('category')
-
-class ProductFromCategoryListView(ListAPIView):
+        return Product.objects.all().select_related('category')
+
+class ProductFromCategoryListView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = ProductSerializer
     model = Product
     lookup_url_kwarg = 'id'
+    cache_key_prefix = 'product_category_list'
+    cache_models = (Product, Category)
+    pagination_class = CatalogCursorPagination
 
     def get_queryset(self):
         category_id = self.kwargs.get(self.lookup_url_kwarg)
         return Product.objects.filter(category__id=category_id).select_related('category')
 
 
-class ProductColorListView(ListAPIView):
+class ProductColorListView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = ProductColorSerializer
     model = ProductColor
-    
+    cache_key_prefix = 'product_colors_list'
+    cache_models = (ProductColor,)
+
     def get_queryset(self):
-        cache_key = 'product_colors_list_queryset'
-        queryset_ids = cache.get(cache_key)
-        if queryset_ids is None:
-            queryset = ProductColor.objects.all()
-            queryset_ids = list(queryset.values_list('id', flat=True))
-            cache.set(cache_key, queryset_ids, 300)  # Cache for 5 minutes
-        return ProductColor.objects.filter(id__in=queryset_ids)
+        return ProductColor.objects.all()
 
 
-class LogoListView(ListAPIView):
+class LogoListView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = ProductSerializer
     model = Product
-    
+    cache_key_prefix = 'logo_list'
+    cache_models = (Product, Category)
+    pagination_class = CatalogCursorPagination
+
     def get_queryset(self):
         # Cache the category lookup to avoid filtering by title
-        cache_key = 'truck_sign_category_id'
+        cache_key = generation_cache_key('truck_sign_category_id', (Category,))
         category_id = cache.get(cache_key)
         if category_id is None:
             try:
                 category = Category.objects.get(title='Truck Sign')
                 category_id = category.id
-                cache.set(cache_key, category_id, 3600)  # Cache for 1 hour
+                cache.set(cache_key, category_id, RESPONSE_CACHE_TIMEOUT)
             except Category.DoesNotExist:
                 return Product.objects.none()
-        
-        cache_key_products = f'logo_list_{category_id}'
-        queryset_ids = cache.get(cache_key_products)
-        if queryset_ids is None:
-            queryset = Product.objects.filter(category_id=category_id, is_uploaded=False).select_related('category')
-            queryset_ids = list(queryset.values_list('id', flat=True))
-            cache.set(cache_key_products, queryset_ids, 300)  # Cache for 5 minutes
-        return Product.objects.filter(id__in=queryset_ids, category_id=category_id, is_uploaded=False).select_related('category')
+        return Product.objects.filter(category_id=category_id, is_uploaded=False).select_related('category')
 
 
-class ProductDetail(RetrieveAPIView):
+class ProductDetail(CachedResponseMixin, FastSerializerMixin, RetrieveAPIView):
     authentication_classes = []
     serializer_class = ProductSerializer
     model = Product
     lookup_field = 'id'
+    cache_key_prefix = 'product_detail'
+    cache_models = (Product, Category)
     queryset = Product.objects.all().select_related('category')
 
 
 
 
-class ProductVariationRetrieveView(RetrieveAPIView):
+class ProductVariationRetrieveView(FastSerializerMixin, RetrieveAPIView):
     authentication_classes = []
     serializer_class = ProductVariationSerializer
     model = ProductVariation
@@ -178,47 +172,76 @@ class CreateOrder(GenericAPIView):
     authentication_classes = []
     serializer_class = OrderSerializer
 
+    @idempotent
     def post(self, request, id, format=None):
         data = request.data
 
-        product = Product.objects.get(id=id)
+        product = Product.objects.select_related('category').get(id=id)
 
-        product_variation = ProductVariation(product=product)
-        product_variation.save()
+        order_serializer = OrderSerializer(data=data['order'])
+        order_serializer.is_valid(raise_exception=True)
 
-        lettering_items = data['lettering_items']
-        for custom_lettering_item in lettering_items:
-            if custom_lettering_item['text'] and custom_lettering_item['text'].strip():
-                item_category = LetteringItemCategory.objects.get(title=custom_lettering_item['title'])
-                item_category.save()
-                lettering_item = LetteringItemVariation(lettering_item_category=item_category, lettering=custom_lettering_item['text'], product_variation=product_variation)
-                lettering_item.save()
+        # Resolve every lettering category with a single query
+        lettering_items = [
+            custom_lettering_item for custom_lettering_item in data.get('lettering_items') or []
+            if custom_lettering_item['text'] and custom_lettering_item['text'].strip()
+        ]
+        titles = set(custom_lettering_item['title'] for custom_lettering_item in lettering_items)
+        item_categories = {
+            item_category.title: item_category
+            for item_category in LetteringItemCategory.objects.filter(title__in=titles)
+        }
+        unknown_titles = titles - set(item_categories)
+        if unknown_titles:
+            return Response(
+                {"Result": "Unknown lettering item categories: " + ", ".join(sorted(unknown_titles))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
         try:
             product_color = ProductColor.objects.get(id=data['product_color_id'])
         except:
             product_color = None
-        product_variation.product_color = product_color
-        product_variation.amount = 1
-        product_variation.save()
 
-        order_serializer = OrderSerializer(data=data['order'])
-        order_serializer.is_valid(raise_exception=True)
-        order = order_serializer.save(product=product_variation, payment=None)
-        order_serializer = OrderSerializer(order)
+        # Prices are frozen now, from the rows already loaded above
+        product_variation = ProductVariation(product=product, product_color=product_color, amount=1)
+        lettering_item_variations = [
+            LetteringItemVariation(
+                lettering_item_category=item_categories[custom_lettering_item['title']],
+                lettering=custom_lettering_item['text'],
+            )
+            for custom_lettering_item in lettering_items
+        ]
+        product_variation.set_price_snapshot(lettering_item_variations)
+
+        # All or nothing, a failure half way must not leave orphaned rows behind
+        with transaction.atomic():
+            product_variation.save()
+            for lettering_item_variation in lettering_item_variations:
+                lettering_item_variation.product_variation = product_variation
+            LetteringItemVariation.objects.bulk_create(lettering_item_variations)
+            order = order_serializer.save(
+                product=product_variation, payment=None, total=product_variation.total, priced_at=timezone.now(),
+            )
 
-        return Response({"Result":order_serializer.data}, status=status.HTTP_200_OK)
+        # Load the lettering items (with their ids) for the response in one query
+        prefetch_related_objects([product_variation], Prefetch(
+            'lettering_item_variation_set',
+            queryset=LetteringItemVariation.objects.select_related('lettering_item_category'),
+        ))
+        return Response({"Result": get_field_plan(OrderSerializer).serialize(order)}, status=status.HTTP_200_OK)
 
 
 
 
-class RetrieveOrder(RetrieveAPIView):
+class RetrieveOrder(FastSerializerMixin, RetrieveAPIView):
     authentication_classes = []
     serializer_class = OrderSerializer
     model = Order
     lookup_field = 'id'
     
     def get_queryset(self):
+        # For the nested product in the response, the total is the snapshot
         return Order.objects.select_related(
             'product',
             'product__product',
@@ -247,124 +270,93 @@ class PaymentView(GenericAPIView):
         ).prefetch_related(
             'product__lettering_item_variation_set__lettering_item_category'
         ).get(id=id)
-        order_serializer = OrderSerializer(order)
-        return Response({"Order": order_serializer.data}, status=status.HTTP_200_OK)
+        return Response({"Order": get_field_plan(OrderSerializer).serialize(order)}, status=status.HTTP_200_OK)
 
+    @idempotent
     def post(self, request, id, format=None):
 
         try:
         # if True:
-            order = Order.objects.select_related(
-                'product',
-                'product__product',
-                'product__product__category',
-                'product__product_color',
-                'payment'
-            ).prefetch_related(
-                'product__lettering_item_variation_set__lettering_item_category'
-            ).get(id=id)
-            try:
-                order_serializer = OrderSerializer(order, data=request.data['order'], partial=True)
-                order_serializer.is_valid(raise_exception=True)
-                order = order_serializer.save()
-            except:
-                pass
-
-            card_num = request.data['card_num']
-            exp_month = request.data['exp_month']
-            exp_year = request.data['exp_year']
-            cvc = request.data['cvc']
-
-            token = stripe.Token.create(
-                card={
-                    "number": card_num,
-                    "exp_month": int(exp_month),
-                    "exp_year": int(exp_year),
-                    "cvc": cvc
-                },
-            )
-
-            amount = int(order.get_total_price() * 100)
-
-            charge = stripe.Charge.create(
-                amount=amount,
-                currency="usd",
-                source=token
-            )
-
-
-            stripe_charge_id = charge['id']
-            payment = Payment(user_email = order.user_email, stripe_charge_id=stripe_charge_id, amount=amount)
-            payment.save()
-            order.ordered = True
-            order.payment = payment
-            order.save()
-
-            # Send Email to user
-            # email_subject="Purchase made."
-            # message=render_to_string('purchase-made.html', {
-            #     'user': order.user_email,
-            #     'image': order.product.product.image,
-            #     'amount_of_product': str(order.product.amount),
-            #     'total_amount':str("{:.2f}".format(order.get_total_price())),
-            # })
-            # to_email = order.user_email
-            # email = EmailMultiAlternatives(email_subject, to=[to_email])
-            # email.attach_alternative(message, "text/html")
-            # email.send()
-            #
-            # admin_message=render_to_string('admin-purchase-made.html',{
-            #     'user': order.user_email,
-            #     'order': order.id,
-            #     'current_admin_domain':current_admin_domain,
-            # })
-
-            # to_admin_email = admin_email
-            # email = EmailMultiAlternatives(email_subject, to=[to_admin_email])
-            # email.attach_alternative(admin_message, "text/html")
-            # email.send()
+            order, card = self.prepare(request, id)
+
+            if self.is_async(request):
+                job = enqueue_payment(order, card, idempotency_key=stripe_key(request, 'order-%d' % order.id))
+                status_url = reverse(
+                    'trucks-signs-root:order-payment-status-api',
+                    kwargs={'id': order.id, 'token': job.token},
+                    request=request,
+                )
+                return Response(
+                    {"Result": job.status, "status_url": status_url},
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': status_url},
+                )
+
+            charge_order(order, card, idempotency_key=stripe_key(request, 'order-%d' % order.id))
 
             return Response({"Result": "Success"}, status=status.HTTP_200_OK)
 
         # else:
         #     pass
-        except stripe.error.CardError as e:
-            return Response({"Result":"Error with card during payment"}, status=status.HTTP_400_BAD_REQUEST)
-
-        except stripe.error.RateLimitError as e:
-            return Response({"Result":"Rate Limit error during payment"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.payment_error(e)
+
+    def prepare(self, request, id):
+        """
+        Loads the order, applies the order details sent along with the
+        payment and returns it with the card details.
+        """
+        # The charge only reads the price snapshot (Order.total), no joins
+        order = Order.objects.get(id=id)
+        try:
+            order_serializer = OrderSerializer(order, data=request.data['order'], partial=True)
+            order_serializer.is_valid(raise_exception=True)
+            # Only the fields sent, a concurrent payment may be changing the others
+            for name, value in order_serializer.validated_data.items():
+                setattr(order, name, value)
+            order.save(update_fields=list(order_serializer.validated_data))
+        except:
+            pass
+        return order, get_card(request.data)
 
-        except stripe.error.InvalidRequestError as e:
-            return Response({"Result":"Invalid request error during payment"}, status=status.HTTP_400_BAD_REQUEST)
+    def payment_error(self, exc):
+        response = Response({"Result": payment_error_message(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Not stored for the Idempotency-Key, the same key may be sent again
+        response.retryable = isinstance(exc, RETRYABLE_ERRORS)
+        return response
 
-        except stripe.error.AuthenticationError as e:
-            return Response({"Result":"Authentication error during payment"}, status=status.HTTP_400_BAD_REQUEST)
+    def is_async(self, request):
+        if 'respond-async' in request.META.get('HTTP_PREFER', ''):
+            return True
+        return getattr(settings, 'PAYMENT_ASYNC', False)
 
-        except stripe.error.APIConnectionError as e:
-            return Response({"Result":"API connection error during payment"}, status=status.HTTP_400_BAD_REQUEST)
 
-        except stripe.error.StripeError as e:
-            return Response({"Result":"Something went wrong during payment"}, status=status.HTTP_400_BAD_REQUEST)
+class PaymentStatusView(APIView):
+    """
+    Polled by the client after an asynchronous payment was accepted (202).
+    """
+    authentication_classes = []
 
-        except:
-            return Response({"Result":"Error during payment"}, status=status.HTTP_400_BAD_REQUEST)
+    def get(self, request, id, token, format=None):
+        try:
+            job = PaymentJob.objects.get(order_id=id, token=token)
+        except PaymentJob.DoesNotExist:
+            return Response({"Result": "Unknown payment"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"Result": job.status, "Message": job.result}, status=status.HTTP_200_OK)
 
 
 
 
-class CommentsView(ListAPIView):
+class CommentsView(CachedResponseMixin, FastSerializerMixin, ListAPIView):
     authentication_classes = []
     serializer_class = CommentSerializer
     model = Comment
-    
+    cache_key_prefix = 'comments_list'
+    cache_models = (Comment,)
+    pagination_class = CatalogCursorPagination
+
     def get_queryset(self):
-        cache_key = 'comments_list_queryset'
-        queryset_ids = cache.get(cache_key)
-        if queryset_ids is None:
-            queryset = Comment.objects.filter(visible=True)
-            queryset_ids = list(queryset.values_list('id', flat=True))
-            cache.set(cache_key, queryset_ids, 300)  # Cache for 5 minutes
-        return Comment.objects.filter(id__in=queryset_ids, visible=True)
+        return Comment.objects.filter(visible=True)
 
 
 class CommentCreateView(CreateAPIView):
@@ -373,10 +365,10 @@ class CommentCreateView(CreateAPIView):
     queryset = Comment.objects.all()
     
     def perform_create(self, serializer):
-        instance = serializer.save()
-        # Invalidate comments cache when a new comment is created
-        cache.delete('comments_list_queryset')
-        return instance
+        # The comments cache is invalidated by the post_save signal
+        comment = serializer.save()
+        enqueue_renditions(comment)
+        return comment
 
 
 class UploadCustomerImage(GenericAPIView):
@@ -394,5 +386,179 @@ class UploadCustomerImage(GenericAPIView):
         product = product_serializer.save()
         product.detail_image = product.image
         product.save()
+        # Thumbnails are built in the background, the response doesn't wait for them
+        enqueue_renditions(product)
         product_serializer = ProductSerializer(product)
-        return Response({"Result": product_serializer.data}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({"Result": product_serializer.data}, status=status.HTTP_200_OK)
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Starts a chunked upload, see backend/uploads.py.
+    """
+    authentication_classes = []
+
+    def post(self, request, format=None):
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({"Result": "size is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session = start_session(request.data.get('filename') or '', size, request.data.get('kind', UploadSession.PRODUCT))
+        except UploadError as e:
+            return Response({"Result": e.args[0]}, status=e.status_code)
+
+        upload_url = reverse('trucks-signs-root:upload-session-api', kwargs={'token': session.token}, request=request)
+        return Response({
+            "token": session.token,
+            "upload_url": upload_url,
+            "finalize_url": reverse('trucks-signs-root:upload-session-finalize-api', kwargs={'token': session.token}, request=request),
+            "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+            "max_chunk_size": settings.UPLOAD_MAX_CHUNK_SIZE,
+            "received": session.received,
+        }, status=status.HTTP_201_CREATED, headers={'Location': upload_url})
+
+
+class UploadSessionView(APIView):
+    """
+    GET reports how much of the upload has arrived, PUT appends the next
+    chunk. The chunk is the raw request body, its position the Upload-Offset
+    header.
+    """
+    authentication_classes = []
+
+    def get_session(self, token):
+        try:
+            return UploadSession.objects.get(token=token)
+        except UploadSession.DoesNotExist:
+            return None
+
+    def get(self, request, token, format=None):
+        session = self.get_session(token)
+        if session is None:
+            return Response({"Result": "Unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"status": session.status, "received": session.received, "size": session.size},
+                        headers={'Upload-Offset': session.received})
+
+    def put(self, request, token, format=None):
+        session = self.get_session(token)
+        if session is None:
+            return Response({"Result": "Unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return Response({"Result": "Upload-Offset and Content-Length headers are required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Streams the body from the socket, request.data is never touched
+            received = write_chunk(session, offset, request.stream, length)
+        except UploadError as e:
+            return Response({"Result": e.args[0], "received": session.received},
+                            status=e.status_code, headers={'Upload-Offset': session.received})
+        return Response({"status": session.status, "received": received, "size": session.size},
+                        headers={'Upload-Offset': received})
+
+
+class UploadSessionFinalizeView(APIView):
+    """
+    Hands a complete upload over to product (or comment) creation. For
+    direct uploads this is the completion callback, the image is checked in
+    storage first.
+    """
+    authentication_classes = []
+
+    def post(self, request, token, format=None):
+        try:
+            session = UploadSession.objects.get(token=token)
+        except UploadSession.DoesNotExist:
+            return Response({"Result": "Unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            if session.direct:
+                confirm_upload(session)
+            if session.kind == UploadSession.COMMENT:
+                instance = finish_session(session, user_email=request.data.get('user_email'), text=request.data.get('text', ''))
+            else:
+                instance = finish_session(session)
+        except UploadError as e:
+            return Response({"Result": e.args[0]}, status=e.status_code)
+
+        if session.kind == UploadSession.COMMENT:
+            data = get_field_plan(CommentSerializer).serialize(instance, request)
+        else:
+            data = get_field_plan(ProductSerializer).serialize(instance, request)
+        return Response({"Result": data}, status=status.HTTP_200_OK)
+
+
+class DirectUploadCreateView(APIView):
+    """
+    Issues signed, time-limited parameters to upload an image straight to
+    storage, see backend/direct_uploads.py.
+    """
+    authentication_classes = []
+
+    def post(self, request, format=None):
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({"Result": "size is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session, params = start_direct_session(
+                request.data.get('filename') or '', size, request.data.get('kind', UploadSession.PRODUCT), request,
+            )
+        except UploadError as e:
+            return Response({"Result": e.args[0]}, status=e.status_code)
+
+        params.update({
+            "token": session.token,
+            "finalize_url": reverse('trucks-signs-root:upload-session-finalize-api', kwargs={'token': session.token}, request=request),
+        })
+        return Response(params, status=status.HTTP_201_CREATED)
+
+
+class DirectUploadLocalView(APIView):
+    """
+    The "local" DIRECT_UPLOAD_BACKEND: stores the raw request body the way
+    an object store would. For development and tests only.
+    """
+    authentication_classes = []
+
+    def put(self, request, signed, format=None):
+        try:
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return Response({"Result": "Content-Length header is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            LocalBackend().receive(signed, request.stream, length)
+        except UploadSession.DoesNotExist:
+            return Response({"Result": "Unknown upload"}, status=status.HTTP_404_NOT_FOUND)
+        except UploadError as e:
+            return Response({"Result": e.args[0]}, status=e.status_code)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SalesReportView(APIView):
+    """
+    Sales per category, product, color or lettering item category from the
+    daily rollups (backend/reporting.py). Staff only.
+
+    ?dimension=category|product|color|lettering-category, ?since= and ?until=
+    (YYYY-MM-DD, until is exclusive), ?by=day for one row per day.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        dimension = request.query_params.get('dimension', DailySales.CATEGORY)
+        if dimension not in dict(DailySales.DIMENSION_CHOICES):
+            return Response({"Result": "Unknown dimension %r" % dimension}, status=status.HTTP_400_BAD_REQUEST)
+        dates = {}
+        for name in ('since', 'until'):
+            value = request.query_params.get(name)
+            try:
+                dates[name] = parse_date(value) if value else None
+            except ValueError:
+                dates[name] = None
+            if value and dates[name] is None:
+                return Response({"Result": "%s must be a date (YYYY-MM-DD)" % name}, status=status.HTTP_400_BAD_REQUEST)
+        rows = report(dimension, by_day=request.query_params.get('by') == 'day', **dates)
+        return Response({"Result": rows}, status=status.HTTP_200_OK)
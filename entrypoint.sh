@@ -28,4 +28,6 @@ else:
     print(f'Superuser {username} already exists')
 "
 
-gunicorn truck_signs_designs.wsgi:application --bind 0.0.0.0:8000
\ No newline at end of file
+# Worker class, counts and recycling from GUNICORN_* variables, see gunicorn.conf.py.
+# The application too: wsgi.py, or asgi.py with GUNICORN_WORKER_CLASS=uvicorn
+exec gunicorn -c gunicorn.conf.py
@@ -0,0 +1,98 @@
+"""
+gunicorn settings, read from the environment (entrypoint.sh and the Procfile
+pass ``-c gunicorn.conf.py``), including the application to serve.
+
+GUNICORN_WORKER_CLASS
+    ``gthread`` (default): WORKERS processes with THREADS threads each. A
+    request waiting on Stripe or SMTP parks a thread, not a whole process.
+    ``gevent``: one event loop per process with up to WORKER_CONNECTIONS
+    requests each, for many concurrent slow requests (Stripe during a
+    checkout rush). psycopg2 is made cooperative (see post_worker_init),
+    every request holds its own database connection though, so keep
+    WORKERS x WORKER_CONNECTIONS below what PostgreSQL (or PgBouncer) takes.
+    ``sync``: one request per process, the gunicorn default.
+    ``uvicorn``: serves truck_signs_designs/asgi.py instead of wsgi.py, one
+    event loop per process. The catalog and payment views are async there
+    (backend/async_views.py), a checkout waiting on Stripe costs a
+    coroutine, everything else runs in a thread per process like sync.
+GUNICORN_WORKERS          default 2 x CPUs + 1 (sync/gthread), CPUs (gevent/uvicorn)
+GUNICORN_THREADS          gthread threads per worker, default 4
+GUNICORN_WORKER_CONNECTIONS   gevent requests per worker, default 100
+GUNICORN_MAX_REQUESTS     recycle a worker after that many requests, default 1000 (0 = never)
+GUNICORN_MAX_REQUESTS_JITTER  randomizes that per worker so they don't all restart at once, default 100
+GUNICORN_PRELOAD          import the app once before forking (less memory, faster restarts), default off
+GUNICORN_KEEPALIVE        seconds an idle keep-alive connection is kept, default 5
+GUNICORN_TIMEOUT / GUNICORN_GRACEFUL_TIMEOUT   default 30 / 30
+PORT                      default 8000
+"""
+import multiprocessing
+import os
+
+
+def _int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+def _bool(name, default=False):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or 'gthread'
+if worker_class == 'uvicorn':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'truck_signs_designs.asgi:application'
+else:
+    wsgi_app = 'truck_signs_designs.wsgi:application'
+if worker_class in ('gevent', 'uvicorn.workers.UvicornWorker'):
+    workers = _int('GUNICORN_WORKERS', cpus)
+else:
+    workers = _int('GUNICORN_WORKERS', cpus * 2 + 1)
+threads = _int('GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1)
+worker_connections = _int('GUNICORN_WORKER_CONNECTIONS', 100)
+
+max_requests = _int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+preload_app = _bool('GUNICORN_PRELOAD')
+keepalive = _int('GUNICORN_KEEPALIVE', 5)
+timeout = _int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+
+if worker_class == 'gevent' and preload_app:
+    # The app is imported in the master before forking, so it has to be patched first
+    from gevent import monkey
+    monkey.patch_all()
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL') or 'info'
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    # Waits for psycopg2 through the gevent hub instead of blocking the process
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import extensions, OperationalError
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError("Bad result from poll: %r" % state)
+
+
+def post_worker_init(worker):
+    # Also when the worker class was given on the command line (manage.py benchmark)
+    if 'gevent' in worker.cfg.worker_class_str.lower():
+        from psycopg2 import extensions
+        extensions.set_wait_callback(_gevent_wait_callback)
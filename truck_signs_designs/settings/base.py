@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.db_routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -78,16 +79,24 @@ LOGGING = {
             'handlers': ['console'],
             'level': 'WARNING',
         },
+        # One JSON line per request when RequestMetricsMiddleware is enabled
+        'backend.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
+# Seconds between flushes of the per-worker request histogram to the cache
+REQUEST_METRICS_FLUSH_INTERVAL = 10
+
 ROOT_URLCONF = 'truck_signs_designs.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR,],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -95,15 +104,34 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are compiled once per process, also with DEBUG on (production.py).
+            # dev.py reads them from disk on every render instead.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'truck_signs_designs.wsgi.application'
 
+# Async catalog and payment views (backend/async_views.py), for truck_signs_designs/asgi.py
+ASYNC_VIEWS = False
+
 
 # Database
-# https://docs.djangoproject.com/en/2.2/ref/settings/#databases
+# https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+
+# The type of the existing primary keys, no migration needed
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# The catalog endpoints read from a "replica" alias when one is configured (backend/db_routing.py).
+# Reads stay on the primary for DATABASE_REPLICA_LAG seconds after a write.
+DATABASE_ROUTERS = ['backend.db_routing.ReplicaRouter']
+DATABASE_REPLICA_LAG = 10
 
 # DATABASES = {
 #     'default': {
@@ -180,8 +208,14 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cursor pagination for the product, logo and comment listings (backend/pagination.py),
+# opt-in per request with ?paginate=true, True paginates unless ?paginate=false
+CATALOG_PAGINATION = False
+CATALOG_PAGE_SIZE = 50
+CATALOG_MAX_PAGE_SIZE = 200
+
 # Cache configuration - using in-memory cache by default
-# For production, consider using Redis or Memcached
+# production_docker.py switches to a shared Redis/Memcached cache via CACHE_BACKEND
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -207,6 +241,42 @@ SESSION_SAVE_EVERY_REQUEST = False  # Don't save on every request (performance)
 # Admin-specific database optimizations
 # These are applied via CONN_MAX_AGE in production/test_docker settings
 
+# Payments (backend/payments.py)
+# PAYMENT_ASYNC answers 202 and charges in a background pool of PAYMENT_WORKERS threads,
+# clients can also ask for it per request with a "Prefer: respond-async" header.
+PAYMENT_ASYNC = False
+PAYMENT_WORKERS = 4
+# Seconds the response to a request with an Idempotency-Key header is replayed for
+# (backend/idempotency.py), older keys are removed by manage.py clean_idempotency_keys
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Purchase emails (backend/outbox.py), sent by manage.py send_emails in batches over one
+# connection. Failed ones are retried after EMAIL_OUTBOX_RETRY_DELAY seconds, doubling each time.
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_RETRY_DELAY = 60
+# Set to the fake Stripe server (manage.py run_fake_stripe) for offline runs
+STRIPE_API_BASE = None
+
+# Image renditions (backend/images.py), built by a background pool of IMAGE_WORKERS threads
+IMAGE_WORKERS = 2
+
+# Chunked uploads (backend/uploads.py)
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # suggested to clients
+UPLOAD_MAX_CHUNK_SIZE = 5 * 1024 * 1024
+UPLOAD_MAX_PIXELS = 50 * 1000 * 1000
+UPLOAD_ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+# Partial uploads, must be shared by all app servers. Defaults to a directory in /tmp
+UPLOAD_SESSION_DIR = None
+# Seconds after which an unfinished upload is removed by manage.py clean_upload_sessions
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Uploads straight to storage (backend/direct_uploads.py): "cloudinary", or "local" to
+# stand in for it offline. Seconds a signed upload URL stays valid.
+DIRECT_UPLOAD_BACKEND = 'local'
+DIRECT_UPLOAD_EXPIRES = 15 * 60
+
 # STRIPE_PUBLISHABLE_KEY=os.getenv("STRIPE_PUBLISHABLE_KEY")
 # STRIPE_SECRET_KEY=os.getenv("STRIPE_SECRET_KEY")
 
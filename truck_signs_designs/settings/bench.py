@@ -0,0 +1,41 @@
+"""
+Settings for ``python manage.py benchmark`` on a machine without PostgreSQL.
+
+Same as production_docker.py (cache backend, pagination, request metrics are
+still selected through the environment) with a SQLite file standing in for
+the database, so a benchmark only needs the checkout and a virtualenv:
+
+    export DJANGO_SETTINGS_MODULE=truck_signs_designs.settings.bench
+    python manage.py migrate --run-syncdb
+    python manage.py benchmark
+
+Numbers from SQLite are only comparable with other SQLite runs. Writes are
+serialized, a payment holds the database lock while it waits for Stripe
+(a row lock on PostgreSQL).
+"""
+from .production_docker import *
+
+DATABASES = {
+    'default': {
+        # Transactions wait for each other, see backend/bench_sqlite/base.py
+        'ENGINE': 'backend.bench_sqlite',
+        'NAME': env('BENCH_DB_PATH', default=os.path.join(ROOT_BASE_DIR, 'bench.sqlite3')),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            # Concurrent order inserts from several gunicorn workers wait instead of failing
+            'timeout': 30,
+        },
+    }
+}
+
+# Migrations 0018/0019 look the legacy columns up in PostgreSQL's information_schema,
+# the backend tables of the bench database are created from the models instead
+MIGRATION_MODULES = {'backend': None}
+
+MEDIA_ROOT = env('BENCH_MEDIA_ROOT', default=os.path.join(ROOT_BASE_DIR, 'media'))
+
+# Server-Timing is how the benchmark counts queries per request
+if 'backend.metrics.RequestMetricsMiddleware' not in MIDDLEWARE:
+    MIDDLEWARE = ['backend.metrics.RequestMetricsMiddleware'] + MIDDLEWARE
+# ... but a log line per request would mostly measure the console
+LOGGING['loggers']['backend.metrics']['level'] = 'WARNING'
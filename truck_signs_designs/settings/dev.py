@@ -10,6 +10,12 @@ environ.Env.read_env()
 SECRET_KEY= env("SECRET_KEY")
 DEBUG = True
 
+# Template changes show up without a restart
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS').split(',')
 
 DATABASES = {
@@ -24,6 +24,8 @@ CLOUDINARY_STORAGE = {
 }
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Clients upload images straight to Cloudinary, see backend/direct_uploads.py
+DIRECT_UPLOAD_BACKEND = 'cloudinary'
 
 DATABASES = {
     'default': {
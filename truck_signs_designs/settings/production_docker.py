@@ -23,24 +23,102 @@ CORS_ALLOWED_ORIGINS = env.list('CORS_ALLOWED_ORIGINS', default=[])
 # Filter out empty strings to avoid validation errors
 CORS_ALLOWED_ORIGINS = [origin.strip() for origin in CORS_ALLOWED_ORIGINS if origin.strip()]
 
-DATABASES = {
-    'default': {
+# DB_PGBOUNCER=True when DOCKER_DB_HOST is PgBouncer in transaction pooling mode: every
+# transaction may run on another server connection, so no server-side cursors and no session
+# settings in the startup packet (set statement_timeout on the role instead, see README).
+# Connections to PgBouncer are cheap to keep, PgBouncer bounds the ones to PostgreSQL.
+DB_PGBOUNCER = env.bool('DB_PGBOUNCER', default=False)
+
+
+def database(host, port):
+    options = {
+        'connect_timeout': 10,  # 10 second connection timeout
+    }
+    if not DB_PGBOUNCER:
+        options['options'] = '-c statement_timeout=30000'  # 30 second query timeout
+    return {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
         'NAME': env('DOCKER_DB_NAME'),
         'USER': env('DOCKER_DB_USER'),
         'PASSWORD': env('DOCKER_DB_PASSWORD'),
-        'HOST': env('DOCKER_DB_HOST'),
-        'PORT': env('DOCKER_DB_PORT'),
-        'CONN_MAX_AGE': 600,  # Keep connections open for 10 minutes (connection pooling)
-        'OPTIONS': {
-            'connect_timeout': 10,  # 10 second connection timeout
-            'options': '-c statement_timeout=30000'  # 30 second query timeout
-        },
+        'HOST': host,
+        'PORT': port,
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=600),  # Keep connections open for 10 minutes (connection pooling)
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
+        'OPTIONS': options,
     }
+
+
+DATABASES = {
+    'default': database(env('DOCKER_DB_HOST'), env('DOCKER_DB_PORT')),
+}
+# Streaming replica of the primary, read by the catalog endpoints (backend/db_routing.py)
+if env('DOCKER_DB_REPLICA_HOST', default=''):
+    DATABASES['replica'] = database(
+        env('DOCKER_DB_REPLICA_HOST'), env('DOCKER_DB_REPLICA_PORT', default=env('DOCKER_DB_PORT')),
+    )
+DATABASE_REPLICA_LAG = env.int('DATABASE_REPLICA_LAG', default=DATABASE_REPLICA_LAG)
+
+# Cache configuration
+# CACHE_BACKEND selects the cache every gunicorn worker shares:
+#   locmem    - per-worker memory, no sharing (default, same as base.py)
+#   redis     - django-redis, CACHE_LOCATION e.g. redis://redis:6379/1
+#   memcached - pymemcache, CACHE_LOCATION e.g. memcached:11211
+#   fake      - in-process stand-in for a cache server (CI / local runs)
+# CACHE_LOCAL_TIER=True puts a small per-worker LRU in front of the shared cache.
+SHARED_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django_redis.cache.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'fake': 'backend.cache_backends.FakeSharedCache',
 }
+CACHE_BACKEND = env('CACHE_BACKEND', default='locmem')
+SHARED_CACHE = {
+    'BACKEND': SHARED_CACHE_BACKENDS[CACHE_BACKEND],
+    'LOCATION': env('CACHE_LOCATION', default='unique-snowflake'),
+    'KEY_PREFIX': 'truck_signs',
+}
+if CACHE_BACKEND == 'locmem':
+    SHARED_CACHE['OPTIONS'] = {'MAX_ENTRIES': 1000}
+elif CACHE_BACKEND == 'redis':
+    SHARED_CACHE['OPTIONS'] = {
+        'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        'SOCKET_CONNECT_TIMEOUT': 2,
+        'SOCKET_TIMEOUT': 2,
+    }
+
+if env.bool('CACHE_LOCAL_TIER', default=False):
+    CACHES = {
+        'default': {
+            'BACKEND': 'backend.cache_backends.TwoTierCache',
+            'OPTIONS': {
+                'SHARED_ALIAS': 'shared',
+                'LOCAL_MAX_ENTRIES': env.int('CACHE_LOCAL_MAX_ENTRIES', default=500),
+                'LOCAL_TIMEOUT': env.int('CACHE_LOCAL_TIMEOUT', default=60),
+            },
+        },
+        'shared': SHARED_CACHE,
+    }
+else:
+    CACHES = {
+        'default': SHARED_CACHE,
+    }
 
 STRIPE_PUBLISHABLE_KEY = env("DOCKER_STRIPE_PUBLISHABLE_KEY")
 STRIPE_SECRET_KEY = env("DOCKER_STRIPE_SECRET_KEY")
+STRIPE_API_BASE = env('STRIPE_API_BASE', default=None)
+PAYMENT_ASYNC = env.bool('PAYMENT_ASYNC', default=False)
+PAYMENT_WORKERS = env.int('PAYMENT_WORKERS', default=4)
+# With GUNICORN_WORKER_CLASS=uvicorn (truck_signs_designs/asgi.py)
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=IDEMPOTENCY_KEY_TTL)
+IMAGE_WORKERS = env.int('IMAGE_WORKERS', default=2)
+UPLOAD_MAX_SIZE = env.int('UPLOAD_MAX_SIZE', default=UPLOAD_MAX_SIZE)
+UPLOAD_MAX_PIXELS = env.int('UPLOAD_MAX_PIXELS', default=UPLOAD_MAX_PIXELS)
+UPLOAD_SESSION_DIR = env('UPLOAD_SESSION_DIR', default=None)
+# No default, serving uploads from container disk by accident is worse than not starting
+DIRECT_UPLOAD_BACKEND = env('DIRECT_UPLOAD_BACKEND')
+DIRECT_UPLOAD_EXPIRES = env.int('DIRECT_UPLOAD_EXPIRES', default=DIRECT_UPLOAD_EXPIRES)
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -48,6 +126,12 @@ EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = env("DOCKER_EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = env("DOCKER_EMAIL_HOST_PASSWORD")
+DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default=EMAIL_HOST_USER or 'webmaster@localhost')
+# Gets a notification of every purchase, none if empty
+EMAIL_ADMIN = env('EMAIL_ADMIN', default=None)
+CURRENT_ADMIN_DOMAIN = env('CURRENT_ADMIN_DOMAIN', default='')
+EMAIL_OUTBOX_BATCH_SIZE = env.int('EMAIL_OUTBOX_BATCH_SIZE', default=EMAIL_OUTBOX_BATCH_SIZE)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int('EMAIL_OUTBOX_MAX_ATTEMPTS', default=EMAIL_OUTBOX_MAX_ATTEMPTS)
 
 # Static files configuration
 STATIC_URL = '/static/'
@@ -64,9 +148,13 @@ MEDIA_ROOT = '/app/media'
 
 # Whitenoise configuration
 MIDDLEWARE = [
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'backend.static_files.StaticFilesMiddleware',  # WhiteNoise, async under ASGI
 ] + MIDDLEWARE
 
+# Per-request query/latency instrumentation, outermost so it times everything
+if env.bool('REQUEST_METRICS', default=False):
+    MIDDLEWARE = ['backend.metrics.RequestMetricsMiddleware'] + MIDDLEWARE
+
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Whitenoise settings
@@ -81,6 +169,10 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cursor pagination, set CATALOG_PAGINATION=True once the frontend follows the next links
+CATALOG_PAGINATION = env.bool('CATALOG_PAGINATION', default=False)
+CATALOG_PAGE_SIZE = env.int('CATALOG_PAGE_SIZE', default=50)
+
 # Security settings for production
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
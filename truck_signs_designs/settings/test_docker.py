@@ -34,6 +34,23 @@ DATABASES = {
     }
 }
 
+# A second local database as the replica, so the routing tests see where a response was read from
+DATABASES['replica'] = dict(DATABASES['default'], TEST={'NAME': 'test_%s_replica' % env('DOCKER_DB_NAME')})
+
+# In-process stand-in for the shared cache server, behind the per-worker tier
+CACHES = {
+    'default': {
+        'BACKEND': 'backend.cache_backends.TwoTierCache',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+        },
+    },
+    'shared': {
+        'BACKEND': 'backend.cache_backends.FakeSharedCache',
+        'LOCATION': 'test-cache-server',
+    },
+}
+
 STRIPE_PUBLISHABLE_KEY=env("DOCKER_STRIPE_PUBLISHABLE_KEY")
 STRIPE_SECRET_KEY=env("DOCKER_STRIPE_SECRET_KEY")
 
@@ -55,5 +72,5 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/app/media'
 
 # Whitenoise configuration
-MIDDLEWARE = ['whitenoise.middleware.WhiteNoiseMiddleware'] + MIDDLEWARE
+MIDDLEWARE = ['backend.static_files.StaticFilesMiddleware'] + MIDDLEWARE
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file